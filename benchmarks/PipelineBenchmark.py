@@ -0,0 +1,498 @@
+'''
+Benchmark suite for the conversion pipeline.
+
+Times every algorithm of the AlgorithmModule, the creation of the
+final page image, the exports, the ocr runner and the alignment
+services on synthetic A4 pages (gray and color, 300 and 400 dpi)
+and on sample scans from tests/SampleFiles.
+
+Every benchmark runs in its own python process, so the peak
+resident set size it reports belongs to this benchmark (it
+includes the memory for the imported libraries, which are
+the same for all benchmarks). The scan cache is cleared before
+every repetition, the fastest repetition counts.
+
+The results are compared with a stored baseline. A benchmark
+that is slower (or needs more memory) than the baseline plus
+the tolerance is reported as a regression and the exit code is
+1. Benchmarks that fail count as regressions. The baseline
+depends on the machine, so create it on the machine you compare
+on (it is not under version control):
+
+    PYTHONPATH=src python benchmarks/PipelineBenchmark.py --save-baseline
+    PYTHONPATH=src python benchmarks/PipelineBenchmark.py
+    PYTHONPATH=src python benchmarks/PipelineBenchmark.py --filter "algorithm\\.(OTSU|SAUVOLA)"
+
+Benchmarks that need tesseract or exiftool are skipped if
+these programs are not installed.
+
+Created on 18.10.2026
+
+@author: michael
+'''
+import argparse
+from functools import partial
+import json
+import os
+import platform
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_FILE_DIR = os.path.join(BENCHMARK_DIR, "..", "tests", "SampleFiles")
+DEFAULT_BASELINE_FILE = os.path.join(BENCHMARK_DIR, "baseline.json")
+
+DEFAULT_REPEAT = 3
+DEFAULT_TOLERANCE = 0.25
+DEFAULT_RSS_TOLERANCE = 0.25
+# Differences below this are just noise
+TIME_NOISE_FLOOR = 0.02
+
+# name, mode, resolution
+SYNTHETIC_INPUTS = (("gray-300", "L", 300),
+                    ("gray-400", "L", 400),
+                    ("color-300", "RGB", 300),
+                    ("color-400", "RGB", 400))
+
+SAMPLE_INPUTS = (("sample-text", os.path.join("AlgorithmTest", "algorithm-test.png")),
+                 ("sample-color", os.path.join("ColorNormalization", "geschichtswerkstatt_6_001.jpg")))
+
+PAGE_INPUTS = tuple([name for name, _, _ in SYNTHETIC_INPUTS] + [name for name, _ in SAMPLE_INPUTS])
+
+# The exports and the alignment of a whole project use all synthetic pages
+PROJECT_INPUT = "project"
+
+A4_WIDTH_INCH = 8.27
+A4_HEIGHT_INCH = 11.69
+
+def create_synthetic_page(mode: str, resolution: int) -> Image:
+    '''
+    An A4 page with lines of word like blocks, a heading and
+    a picture. The color page has tinted paper, a colored heading
+    and a colored picture. The page is always the same, so the
+    timings are comparable.
+    '''
+
+    rng = np.random.default_rng(resolution)
+    scale = resolution / 300
+    width = round(A4_WIDTH_INCH * resolution)
+    height = round(A4_HEIGHT_INCH * resolution)
+    if mode == "L":
+        paper, text, heading, picture = 235, 30, 30, (90, 200)
+    else:
+        paper, text, heading, picture = (238, 228, 196), (35, 30, 40), (170, 30, 30), ((40, 60, 150), (220, 180, 60))
+
+    img = Image.new(mode, (width, height), paper)
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((int(150 * scale), int(150 * scale), int(1600 * scale), int(230 * scale)), fill=heading)
+    draw.rectangle((int(150 * scale), int(300 * scale), int(900 * scale), int(900 * scale)), fill=picture[0])
+    draw.ellipse((int(300 * scale), int(400 * scale), int(750 * scale), int(800 * scale)), fill=picture[1])
+    for y in range(int(1000 * scale), int(3300 * scale), int(60 * scale)):
+        x = int(150 * scale)
+        while x < int(2200 * scale):
+            word_width = int(rng.integers(40, 160) * scale)
+            draw.rectangle((x, y, x + word_width, y + int(25 * scale)), fill=text)
+            x += word_width + int(18 * scale)
+
+    # Scanner noise
+    pixels = np.asarray(img, dtype=np.int16)
+    pixels = pixels + rng.integers(-12, 13, size=pixels.shape, dtype=np.int16)
+    img = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), mode)
+    return img.rotate(0.7, fillcolor=paper, resample=Image.BICUBIC)
+
+def create_inputs(input_dir: str):
+
+    for name, mode, resolution in SYNTHETIC_INPUTS:
+        create_synthetic_page(mode, resolution).save(get_input_file(input_dir, name), dpi=(resolution, resolution))
+
+def get_input_file(input_dir: str, name: str) -> str:
+
+    for sample_name, sample_file in SAMPLE_INPUTS:
+        if sample_name == name:
+            return os.path.join(SAMPLE_FILE_DIR, sample_file)
+    return os.path.join(input_dir, "%s.png" % name)
+
+class Benchmark(object):
+    '''
+    The prepare function gets the services and the input and
+    returns the function to time. It is called before every
+    repetition, so the timed function may change its arguments.
+    '''
+
+    def __init__(self, name: str, prepare, inputs=PAGE_INPUTS, required_programs=()):
+
+        self.name = name
+        self.prepare = prepare
+        self.inputs = inputs
+        self.required_programs = required_programs
+
+    def get_missing_programs(self) -> []:
+
+        return [program for program in self.required_programs if shutil.which(program) is None]
+
+    def run(self, services, input_dir: str, repeat: int) -> {}:
+
+        from Asb.ScanConvert2.ScanCache import scan_cache
+
+        timings = {}
+        for input_name in self.inputs:
+            seconds = []
+            for _ in range(0, repeat):
+                scan_cache.clear()
+                function = self.prepare(services, input_dir, input_name)
+                start = time.perf_counter()
+                function()
+                seconds.append(time.perf_counter() - start)
+            timings[input_name] = seconds
+        return timings
+
+class Services(object):
+    '''
+    Gives the prepare functions access to the injector
+    '''
+
+    def __init__(self, output_dir: str):
+
+        from injector import Injector
+        from Asb.ScanConvert2.Algorithms import AlgorithmModule
+
+        self.injector = Injector([AlgorithmModule])
+        self.output_dir = output_dir
+
+    def get(self, service_class):
+
+        return self.injector.get(service_class)
+
+def load_page_image(input_dir: str, input_name: str) -> Image:
+
+    img = Image.open(get_input_file(input_dir, input_name))
+    img.load()
+    return img
+
+def create_project(services: Services, input_dir: str, input_names: []):
+
+    from Asb.ScanConvert2.ProjectGenerator import ProjectGenerator, SortType
+    from Asb.ScanConvert2.ScanConvertDomain import Scan
+
+    scans = [Scan(get_input_file(input_dir, input_name)) for input_name in input_names]
+    project = services.get(ProjectGenerator).scans_to_project(scans, 1, SortType.STRAIGHT, 0, False)
+    project.metadata.title = "Benchmark"
+    project.project_properties.run_ocr = False
+    project.project_properties.create_pdfa = False
+    return project
+
+def create_project_with_all_pages(services: Services, input_dir: str):
+
+    return create_project(services, input_dir, [name for name, _, _ in SYNTHETIC_INPUTS])
+
+def prepare_algorithm(algorithm, services: Services, input_dir: str, input_name: str):
+    '''
+    The finishing service hands the images to the
+    algorithms in their input mode
+    '''
+
+    from Asb.ScanConvert2.Algorithms import AlgorithmImplementations
+
+    implementation = services.get(AlgorithmImplementations)[algorithm]
+    img = load_page_image(input_dir, input_name).convert(implementation.input_mode)
+    return partial(implementation.transform, img, None)
+
+def prepare_skimage_sauvola(services: Services, input_dir: str, input_name: str):
+    '''
+    The skimage implementation we replaced, for comparison
+    '''
+
+    from skimage.filters.thresholding import threshold_sauvola
+    from Asb.ScanConvert2.Algorithms import SAUVOLA_WINDOW_SIZE
+
+    gray = np.asarray(load_page_image(input_dir, input_name).convert("L"))
+    return lambda: gray > threshold_sauvola(gray, window_size=SAUVOLA_WINDOW_SIZE)
+
+def prepare_sauvola_grid(grid_step: int, services: Services, input_dir: str, input_name: str):
+
+    from Asb.ScanConvert2.Algorithms import Sauvola
+
+    img = load_page_image(input_dir, input_name).convert("RGB")
+    return partial(Sauvola(statistics_grid_step=grid_step).transform, img, None)
+
+def prepare_final_image(target_resolution: int, services: Services, input_dir: str, input_name: str):
+
+    from Asb.ScanConvert2.ScanConvertServices import FinishingService
+
+    page = create_project(services, input_dir, [input_name]).pages[0]
+    return partial(services.get(FinishingService).create_final_image, page, [], target_resolution)
+
+def prepare_pdf_export(services: Services, input_dir: str, input_name: str):
+
+    from Asb.ScanConvert2.ScanConvertServices import PdfService
+
+    project = create_project_with_all_pages(services, input_dir)
+    return partial(services.get(PdfService).create_pdf_file, project, os.path.join(services.output_dir, "benchmark.pdf"))
+
+def prepare_tif_export(services: Services, input_dir: str, input_name: str):
+
+    from Asb.ScanConvert2.ScanConvertServices import TiffService
+
+    project = create_project_with_all_pages(services, input_dir)
+    return partial(services.get(TiffService).create_tiff_file_archive, project, os.path.join(services.output_dir, "benchmark_tif"))
+
+def prepare_ddf_export(services: Services, input_dir: str, input_name: str):
+
+    from Asb.ScanConvert2.ScanConvertServices import DDFService
+
+    project = create_project_with_all_pages(services, input_dir)
+    project.metadata.ddf_prefix = "benchmark"
+    return partial(services.get(DDFService).create_ddf_file_archive, project, os.path.join(services.output_dir, "benchmark_ddf"))
+
+def prepare_ocr(services: Services, input_dir: str, input_name: str):
+    '''
+    Uses an ocr runner without cache, we want to time tesseract
+    '''
+
+    from Asb.ScanConvert2.OCR import OcrRunner
+
+    img = load_page_image(input_dir, input_name)
+    return partial(OcrRunner().run_tesseract_multi, img, "deu")
+
+def prepare_angle_correction(services: Services, input_dir: str, input_name: str):
+
+    from Asb.ScanConvert2.AngleCorrection import AngleCorrectionService
+
+    img = load_page_image(input_dir, input_name)
+    return partial(services.get(AngleCorrectionService).get_correct_angle, img)
+
+def prepare_deskew(services: Services, input_dir: str, input_name: str):
+
+    from Asb.ScanConvert2.AngleCorrection import DeskewService
+
+    img = load_page_image(input_dir, input_name)
+    return partial(services.get(DeskewService).get_correct_angle, img)
+
+def prepare_align_pages(services: Services, input_dir: str, input_name: str):
+
+    from Asb.ScanConvert2.AngleCorrection import AlignmentService
+
+    project = create_project_with_all_pages(services, input_dir)
+    return partial(services.get(AlignmentService).align_pages, project.pages)
+
+def get_benchmarks() -> []:
+
+    from Asb.ScanConvert2.Algorithms import AlgorithmModule
+
+    benchmarks = []
+    for algorithm in AlgorithmModule().algorithm_provider():
+        benchmarks.append(Benchmark("algorithm.%s" % algorithm.name, partial(prepare_algorithm, algorithm)))
+    benchmarks.append(Benchmark("sauvola.skimage", prepare_skimage_sauvola))
+    for grid_step in (2, 4):
+        benchmarks.append(Benchmark("sauvola.grid_step_%d" % grid_step, partial(prepare_sauvola_grid, grid_step)))
+    benchmarks.append(Benchmark("finishing.create_final_image", partial(prepare_final_image, 300)))
+    # 400 dpi inputs are reduced by an integer factor
+    benchmarks.append(Benchmark("finishing.create_final_image_200", partial(prepare_final_image, 200)))
+    benchmarks.append(Benchmark("export.pdf", prepare_pdf_export, (PROJECT_INPUT,)))
+    benchmarks.append(Benchmark("export.tif", prepare_tif_export, (PROJECT_INPUT,)))
+    benchmarks.append(Benchmark("export.ddf", prepare_ddf_export, (PROJECT_INPUT,), ("tesseract", "exiftool")))
+    benchmarks.append(Benchmark("ocr.tesseract", prepare_ocr, ("gray-300", "sample-text"), ("tesseract",)))
+    benchmarks.append(Benchmark("alignment.angle_correction", prepare_angle_correction))
+    benchmarks.append(Benchmark("alignment.deskew", prepare_deskew))
+    benchmarks.append(Benchmark("alignment.align_pages", prepare_align_pages, (PROJECT_INPUT,)))
+    return benchmarks
+
+def get_peak_rss_mb() -> float:
+    '''
+    ru_maxrss is in kilobytes on linux, but in bytes on macOS
+    '''
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak_rss / (1024 * 1024)
+    return peak_rss / 1024
+
+def run_benchmark(name: str, input_dir: str, repeat: int, workers: int) -> {}:
+    '''
+    Runs in the benchmark process
+    '''
+
+    from Asb.ScanConvert2.ProcessPool import set_max_workers
+
+    set_max_workers(workers)
+    benchmark = [benchmark for benchmark in get_benchmarks() if benchmark.name == name][0]
+    with tempfile.TemporaryDirectory() as output_dir:
+        services = Services(output_dir)
+        import_rss_mb = get_peak_rss_mb()
+        timings = benchmark.run(services, input_dir, repeat)
+    return {"timings": timings,
+            "import_rss_mb": import_rss_mb,
+            "peak_rss_mb": get_peak_rss_mb()}
+
+def run_benchmark_process(benchmark: Benchmark, input_dir: str, repeat: int, workers: int) -> {}:
+
+    missing_programs = benchmark.get_missing_programs()
+    if len(missing_programs) > 0:
+        return {"skipped": "%s not installed" % ", ".join(missing_programs)}
+
+    with tempfile.NamedTemporaryFile(suffix=".json") as result_file:
+        command = [sys.executable, os.path.abspath(__file__),
+                   "--run-benchmark", benchmark.name,
+                   "--input-dir", input_dir,
+                   "--result-file", result_file.name,
+                   "--repeat", "%d" % repeat,
+                   "--workers", "%d" % workers]
+        completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        if completed.returncode != 0:
+            return {"error": completed.stdout.strip().split("\n")[-1]}
+        with open(result_file.name) as file:
+            return json.load(file)
+
+def collect_results(benchmark: Benchmark, benchmark_result: {}) -> {}:
+    '''
+    Flattens the result of a benchmark process to one result
+    per benchmark and input
+    '''
+
+    if "timings" not in benchmark_result:
+        return {"%s[%s]" % (benchmark.name, input_name): benchmark_result for input_name in benchmark.inputs}
+    results = {}
+    for input_name, seconds in benchmark_result["timings"].items():
+        results["%s[%s]" % (benchmark.name, input_name)] = {"seconds": min(seconds),
+                                                             "mean_seconds": sum(seconds) / len(seconds),
+                                                             "peak_rss_mb": benchmark_result["peak_rss_mb"]}
+    return results
+
+def compare(result: {}, baseline_result: {}, tolerance: float, rss_tolerance: float) -> []:
+    '''
+    Returns the regressions as list of strings
+    '''
+
+    regressions = []
+    if baseline_result is None or "seconds" not in result or "seconds" not in baseline_result:
+        return regressions
+    if result["seconds"] > baseline_result["seconds"] * (1 + tolerance) and \
+            result["seconds"] - baseline_result["seconds"] > TIME_NOISE_FLOOR:
+        regressions.append("time %.3f s > %.3f s" % (result["seconds"], baseline_result["seconds"]))
+    if result["peak_rss_mb"] > baseline_result["peak_rss_mb"] * (1 + rss_tolerance):
+        regressions.append("peak rss %.0f MB > %.0f MB" % (result["peak_rss_mb"], baseline_result["peak_rss_mb"]))
+    return regressions
+
+def format_result(name: str, result: {}, baseline_result: {}, regressions: []) -> str:
+
+    if "skipped" in result:
+        return "%-52s skipped: %s" % (name, result["skipped"])
+    if "error" in result:
+        return "%-52s ERROR: %s" % (name, result["error"])
+    line = "%-52s %9.3f %9.0f" % (name, result["seconds"], result["peak_rss_mb"])
+    if baseline_result is not None and "seconds" in baseline_result:
+        line += " %9.3f %+7.1f%%" % (baseline_result["seconds"],
+                                     100.0 * (result["seconds"] - baseline_result["seconds"]) / max(baseline_result["seconds"], 1e-9))
+    if len(regressions) > 0:
+        line += "  REGRESSION: %s" % ", ".join(regressions)
+    return line
+
+def load_baseline(baseline_file: str) -> {}:
+
+    if not os.path.exists(baseline_file):
+        return None
+    with open(baseline_file) as file:
+        return json.load(file)
+
+def save_baseline(baseline_file: str, results: {}, repeat: int, workers: int):
+
+    with open(baseline_file, "w") as file:
+        json.dump({"machine": {"platform": platform.platform(),
+                               "processor": platform.processor(),
+                               "cpu_count": os.cpu_count(),
+                               "python": platform.python_version()},
+                   "repeat": repeat,
+                   "workers": workers,
+                   "results": results}, file, indent=2, sort_keys=True)
+
+def create_argument_parser() -> argparse.ArgumentParser:
+
+    parser = argparse.ArgumentParser(description="Benchmarks for the conversion pipeline")
+    parser.add_argument("--filter", default=None,
+                        help="Only run benchmarks whose name matches this regular expression")
+    parser.add_argument("--list", action="store_true", help="List the benchmarks and exit")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                        help="Repetitions of every benchmark, the fastest counts")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes the services may use")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_FILE, help="The baseline file")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Store the results as new baseline instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed slowdown relative to the baseline")
+    parser.add_argument("--rss-tolerance", type=float, default=DEFAULT_RSS_TOLERANCE,
+                        help="Allowed growth of the peak rss relative to the baseline")
+    # Used internally to run a single benchmark in its own process
+    parser.add_argument("--run-benchmark", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--input-dir", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", default=None, help=argparse.SUPPRESS)
+    return parser
+
+def main(argv=None) -> int:
+
+    args = create_argument_parser().parse_args(argv)
+
+    if args.run_benchmark is not None:
+        result = run_benchmark(args.run_benchmark, args.input_dir, args.repeat, args.workers)
+        with open(args.result_file, "w") as file:
+            json.dump(result, file)
+        return 0
+
+    benchmarks = get_benchmarks()
+    if args.filter is not None:
+        benchmarks = [benchmark for benchmark in benchmarks if re.search(args.filter, benchmark.name)]
+    if args.list:
+        for benchmark in benchmarks:
+            print("%-32s %s" % (benchmark.name, ", ".join(benchmark.inputs)))
+        return 0
+
+    baseline = None
+    if not args.save_baseline:
+        baseline = load_baseline(args.baseline)
+        if baseline is None:
+            print("No baseline in %s, create one with --save-baseline" % args.baseline)
+    baseline_results = {}
+    if baseline is not None:
+        baseline_results = baseline["results"]
+
+    print("%-52s %9s %9s %9s %8s" % ("Benchmark", "Seconds", "Peak MB", "Baseline", "Change"))
+    results = {}
+    failures = []
+    with tempfile.TemporaryDirectory() as input_dir:
+        create_inputs(input_dir)
+        for benchmark in benchmarks:
+            benchmark_results = collect_results(benchmark,
+                                                run_benchmark_process(benchmark, input_dir, args.repeat, args.workers))
+            for name, result in benchmark_results.items():
+                regressions = compare(result, baseline_results.get(name), args.tolerance, args.rss_tolerance)
+                if len(regressions) > 0 or "error" in result:
+                    failures.append(name)
+                print(format_result(name, result, baseline_results.get(name), regressions), flush=True)
+            results.update(benchmark_results)
+
+    if args.save_baseline:
+        if args.filter is not None and os.path.exists(args.baseline):
+            # Only replace the benchmarks we have run
+            merged_results = load_baseline(args.baseline)["results"]
+            merged_results.update(results)
+            results = merged_results
+        save_baseline(args.baseline, results, args.repeat, args.workers)
+        print("Baseline saved to %s" % args.baseline)
+        return 0
+
+    if len(failures) > 0:
+        print("%d regressions or errors" % len(failures))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+
+    sys.exit(main())
@@ -0,0 +1,80 @@
+'''
+Compares the numpy smearing engine with the original pixel
+by pixel implementation on a binarized sample page and on a
+synthetic A4 page at 400 dpi.
+
+Run it with the src directory on the python path:
+
+    PYTHONPATH=src python benchmarks/SmearingBenchmark.py
+
+Created on 18.10.2026
+
+@author: michael
+'''
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from Asb.ScanConvert2.AngleCorrection import SmearingService, AngleCorrectionService,\
+    BINARY_BLACK
+
+SAMPLE_FILE = os.path.join(os.path.dirname(__file__), "..", "tests", "SampleFiles", "Single000", "Seite1.png")
+
+def reference_smear_horizontal(bin_img, constraint, boundary_color):
+    '''
+    The original implementation, kept here as reference
+    '''
+    height = bin_img.shape[0]
+    width = bin_img.shape[1]
+    smeared_img = bin_img.copy()
+    for row_idx in range(0, height):
+        line = bin_img[row_idx]
+        col_idx = 0
+        gap_size = None
+        while col_idx < width:
+            if line[col_idx] == boundary_color:
+                if gap_size is not None and gap_size > 0:
+                    if gap_size < constraint:
+                        gap_start = col_idx - gap_size
+                        smeared_img[row_idx, gap_start:col_idx] = boundary_color
+                gap_size = 0
+            else:
+                if gap_size is not None:
+                    gap_size += 1
+            col_idx += 1
+    return smeared_img
+
+def create_synthetic_page():
+    '''
+    An A4 page at 400 dpi with text like black runs
+    '''
+    rng = np.random.default_rng(0)
+    bin_img = np.ones((4677, 3307), dtype=bool)
+    for line_start in range(300, 4400, 60):
+        line = bin_img[line_start:line_start + 30, 300:3000]
+        line[rng.random(line.shape) < 0.3] = False
+    return bin_img
+
+def measure(function, *args):
+
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def run_benchmark(name, bin_img, constraint=25):
+
+    smearing_service = SmearingService()
+    new_result, new_time = measure(smearing_service.smear_horizontal, bin_img, constraint, BINARY_BLACK)
+    old_result, old_time = measure(reference_smear_horizontal, bin_img, constraint, BINARY_BLACK)
+    _, vertical_time = measure(smearing_service.smear_vertical, bin_img, constraint, BINARY_BLACK)
+    assert np.array_equal(new_result, old_result), "Results differ for %s" % name
+    print("%-20s %5d x %5d  original: %8.2f s  numpy: %6.3f s (vertical %6.3f s)  speedup: %6.0fx" %
+          (name, bin_img.shape[1], bin_img.shape[0], old_time, new_time, vertical_time, old_time / new_time))
+
+if __name__ == '__main__':
+
+    angle_correction_service = AngleCorrectionService(SmearingService())
+    run_benchmark("Sample page", angle_correction_service.binarize_otsu(Image.open(SAMPLE_FILE)))
+    run_benchmark("Synthetic A4 400dpi", create_synthetic_page())
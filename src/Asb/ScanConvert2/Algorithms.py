@@ -10,13 +10,16 @@ Created on 18.01.2023
 
 @author: michael
 '''
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
+import hashlib
+import threading
 
-from PIL import Image, ImageFilter, ImageEnhance
+from PIL import Image, ImageFilter, ImageEnhance, ImageStat
 import cv2
 from injector import Module, BoundKey, provider, singleton, inject
-from skimage.filters.thresholding import threshold_otsu, threshold_sauvola, \
-    threshold_niblack
+from skimage.filters.thresholding import threshold_otsu, threshold_niblack
 
 import numpy as np
 from PIL.ImageOps import invert
@@ -29,8 +32,115 @@ RGB_BLACK = (0, 0, 0)
 GRAY_WHITE = 255
 BIN_WHITE = 1
 
+# Number of rows for which masks are calculated at once
+MASK_BAND_HEIGHT = 512
+
+SAUVOLA_WINDOW_SIZE = 101
+SAUVOLA_K = 0.2
+# Half of the range of uint8, like skimage
+SAUVOLA_R = 127.5
+
+# The color quantization fits the k-means centers on a sample
+# of this many pixels and uses a lookup table with 6 bits per
+# channel to map the pixels to the centers
+QUANTIZATION_SAMPLE_SIZE = 100000
+QUANTIZATION_SEED = 4711
+LOOKUP_TABLE_BITS = 6
+LOOKUP_TABLE_SHIFT = 8 - LOOKUP_TABLE_BITS
+AMBIGUOUS_CELL = 255
+QUANTIZATION_ATTEMPTS = 10
+# With a warm start from the palette cache
+WARM_QUANTIZATION_ATTEMPTS = 5
+
+# The color signature for the palette cache is a histogram
+# with 4 bits per channel, the share of each bin rounded to
+# 1/256 of the pixels
+SIGNATURE_BITS = 4
+SIGNATURE_LEVELS = 256
+MAX_PALETTE_CACHE_ENTRIES = 256
+
+# Parameters of the DenoiseAlgorithm and the BadContrastAlgorithm
+CONTRAST_FACTOR = 2.0
+BACKGROUND_BLUR_SIZE = 51
+THRESHOLD_BLOCK_SIZE = 31
+
 AlgorithmImplementations = BoundKey("algorithm implementations")
 
+def fast_threshold_sauvola(image: np.ndarray, window_size: int=SAUVOLA_WINDOW_SIZE, k: float=SAUVOLA_K,
+                           r: float=SAUVOLA_R, grid_step: int=1) -> np.ndarray:
+    """
+    A replacement for skimage's threshold_sauvola on uint8 images.
+    Mean and standard deviation come from cv2's box filters (which
+    are running sums, like integral images) in float32, in bands of
+    rows on as many threads as cv2 may use. skimage uses several
+    float64 arrays of the size of the whole image instead.
+    
+    The thresholds differ from skimage by less than 0.01 gray
+    levels on our samples (float32 loses some precision where the
+    deviation is nearly zero), the binarized images are identical.
+    
+    With a grid step > 1 the thresholds are calculated on the image
+    downsampled by this factor and interpolated. This is up to twice
+    as fast, but the thresholds differ by up to 3 (step 2) or 7 (step
+    4) gray levels, so up to 0.3% or 1% of the pixels switch color.
+    """
+    
+    if grid_step > 1:
+        return _threshold_sauvola_on_grid(image, window_size, k, r, grid_step)
+    
+    threshold = np.empty(image.shape, dtype=np.float32)
+    halo = window_size // 2
+    no_of_bands = max(1, min(cv2.getNumThreads(), image.shape[0] // (4 * window_size)))
+    band_height = -(-image.shape[0] // no_of_bands)
+    
+    def calculate_band(start):
+        
+        end = min(start + band_height, image.shape[0])
+        halo_start = max(0, start - halo)
+        band = image[halo_start:min(end + halo, image.shape[0])]
+        band_threshold = _calculate_sauvola_threshold(band, window_size, k, r)
+        threshold[start:end] = band_threshold[start - halo_start:end - halo_start]
+    
+    if no_of_bands == 1:
+        calculate_band(0)
+    else:
+        with ThreadPoolExecutor(max_workers=no_of_bands) as executor:
+            list(executor.map(calculate_band, range(0, image.shape[0], band_height)))
+    return threshold
+
+def _calculate_sauvola_threshold(image: np.ndarray, window_size: int, k: float, r: float) -> np.ndarray:
+    """
+    numpy's reflect padding, which skimage uses, is BORDER_REFLECT_101
+    """
+    
+    mean = cv2.boxFilter(image, cv2.CV_32F, (window_size, window_size), borderType=cv2.BORDER_REFLECT_101)
+    deviation = cv2.sqrBoxFilter(image, cv2.CV_32F, (window_size, window_size), borderType=cv2.BORDER_REFLECT_101)
+    return _combine_sauvola_statistics(mean, deviation, k, r)
+
+def _combine_sauvola_statistics(mean: np.ndarray, square_mean: np.ndarray, k: float, r: float) -> np.ndarray:
+    """
+    T = m * (1 + k * (s / R - 1)), calculated in place
+    """
+    
+    square_mean -= mean * mean
+    np.maximum(square_mean, 0, out=square_mean)
+    deviation = cv2.sqrt(square_mean, square_mean)
+    deviation *= k / r
+    deviation += 1 - k
+    mean *= deviation
+    return mean
+
+def _threshold_sauvola_on_grid(image: np.ndarray, window_size: int, k: float, r: float, grid_step: int) -> np.ndarray:
+    
+    height, width = image.shape
+    grid = cv2.resize(image, (max(1, round(width / grid_step)), max(1, round(height / grid_step))),
+                      interpolation=cv2.INTER_AREA)
+    grid_window_size = max(3, (window_size // grid_step) | 1)
+    mean = cv2.boxFilter(grid, cv2.CV_32F, (grid_window_size, grid_window_size), borderType=cv2.BORDER_REFLECT_101)
+    square_mean = cv2.sqrBoxFilter(grid, cv2.CV_32F, (grid_window_size, grid_window_size), borderType=cv2.BORDER_REFLECT_101)
+    threshold = _combine_sauvola_statistics(mean, square_mean, k, r)
+    return cv2.resize(threshold, (width, height), interpolation=cv2.INTER_LINEAR)
+
 class TooManyColors(Exception):
 
     pass
@@ -111,19 +221,178 @@ class AlgorithmHelper(object):
         
         resolution = self.get_image_resolution(img)
         
-        np_array = np.array(img.convert("RGB"))
-        red, green, blue = np_array.T
-        src_color_areas = (red == src_color[0]) & (green == src_color[1]) & (blue == src_color[2])
-        np_array[src_color_areas.T] = target_color
+        if img.mode == "P":
+            return self.replace_colors_in_palette(img, {src_color: target_color})
+        if img.mode == "RGB":
+            np_array = np.array(img)
+        else:
+            np_array = np.array(img.convert("RGB"))
+        self.replace_color_in_array(np_array, src_color, target_color)
         
         img = Image.fromarray(np_array)
         img.info['dpi'] = (resolution, resolution)
         
         return img
 
+    def replace_color_in_array(self, np_array: np.ndarray, src_color: (), target_color: ()):
+        
+        self.replace_colors_in_array(np_array, {src_color: target_color})
+
+    def replace_colors_in_array(self, np_array: np.ndarray, replacements: {}, mask_array: np.ndarray=None,
+                                palette: np.ndarray=None):
+        '''
+        Works in place on an RGB array: Every pixel that has one of
+        the source colors (the keys of the replacements) gets the
+        target color. If a mask array is given, the source colors
+        are looked up there, otherwise in the array itself. The mask
+        array may also hold the indices into a palette. All
+        replacements see the colors before any of them is applied.
+        
+        The colors are packed into one uint32 per pixel, so every
+        color needs only one comparison. This is done in bands of
+        rows, so a poster does not need masks of its full size.
+        '''
+        
+        if mask_array is None:
+            mask_array = np_array
+        packed_palette = None
+        if palette is not None:
+            packed_palette = self.pack_colors(palette[np.newaxis])[0]
+        packed_replacements = [(self.pack_color(src_color), target_color)
+                               for src_color, target_color in replacements.items()]
+        for start in range(0, np_array.shape[0], MASK_BAND_HEIGHT):
+            band = np_array[start:start + MASK_BAND_HEIGHT]
+            if packed_palette is None:
+                packed_band = self.pack_colors(mask_array[start:start + MASK_BAND_HEIGHT])
+            else:
+                packed_band = packed_palette[mask_array[start:start + MASK_BAND_HEIGHT]]
+            masks = [(packed_band == packed_color, target_color)
+                     for packed_color, target_color in packed_replacements]
+            for mask, target_color in masks:
+                band[mask] = target_color
+
+    def get_color_mask(self, np_array: np.ndarray, color: ()) -> np.ndarray:
+        '''
+        Returns a boolean mask of the pixels of an RGB array
+        that have the given color
+        '''
+        
+        mask = np.empty(np_array.shape[:2], dtype=bool)
+        packed_color = self.pack_color(color)
+        for start in range(0, np_array.shape[0], MASK_BAND_HEIGHT):
+            np.equal(self.pack_colors(np_array[start:start + MASK_BAND_HEIGHT]), packed_color,
+                     out=mask[start:start + MASK_BAND_HEIGHT])
+        return mask
+
+    def pack_colors(self, np_array: np.ndarray) -> np.ndarray:
+        '''
+        Packs the channels of an RGB array into one uint32 per pixel
+        '''
+        
+        packed = np.left_shift(np_array[:, :, 0], 16, dtype=np.uint32)
+        packed |= np.left_shift(np_array[:, :, 1], 8, dtype=np.uint32)
+        packed |= np_array[:, :, 2]
+        return packed
+
+    def pack_color(self, color: ()) -> int:
+        
+        return (int(color[0]) << 16) | (int(color[1]) << 8) | int(color[2])
+
+    def create_palette_image(self, indices: np.ndarray, palette: np.ndarray) -> Image:
+        '''
+        Quantized images have just a few colors, so they are kept
+        as palette images with one byte per pixel (png encodes them
+        with 1, 2 or 4 bits per pixel) instead of three.
+        '''
+        
+        img = Image.frombuffer("P", (indices.shape[1], indices.shape[0]),
+                               np.ascontiguousarray(indices, dtype=np.uint8), "raw", "P", 0, 1)
+        img.putpalette(np.ascontiguousarray(palette, dtype=np.uint8).tobytes())
+        return img
+
+    def get_palette(self, img: Image) -> np.ndarray:
+        '''
+        Returns the palette of a palette image as n x 3 array
+        '''
+        
+        return np.array(img.getpalette("RGB"), dtype=np.uint8).reshape(-1, 3)
+
+    def replace_colors_in_palette(self, img: Image, replacements: {}) -> Image:
+        '''
+        For palette images only the palette needs to be changed
+        '''
+        
+        palette = self.get_palette(img)
+        new_palette = palette.copy()
+        for src_color, target_color in replacements.items():
+            new_palette[np.all(palette == src_color, axis=1)] = target_color
+        img = img.copy()
+        img.putpalette(new_palette.tobytes())
+        return img
+
+    def to_palette_image(self, img: Image) -> Image:
+        '''
+        Converts a palette or bilevel image into a palette image
+        with just the colors used
+        '''
+        
+        if img.mode == "1":
+            palette_img = self.create_palette_image(np.asarray(img, dtype=np.uint8),
+                                                    np.array((RGB_BLACK, RGB_WHITE), dtype=np.uint8))
+        else:
+            palette_img = img.copy()
+        if 'dpi' in img.info:
+            palette_img.info['dpi'] = img.info['dpi']
+        return palette_img
+
+    def merge_palette_images(self, img: Image, other_img: Image) -> (Image, Image):
+        '''
+        Changes the palette of the first image, so that it also
+        has the colors of the second image and returns it with the
+        second image mapped on this palette. Returns None, if the
+        palettes together have more than 256 colors.
+        '''
+        
+        palette = self.get_palette(img)
+        other_palette = self.get_palette(other_img)
+        packed_palette = list(self.pack_colors(palette[np.newaxis])[0])
+        index_map = np.zeros(256, dtype=np.uint8)
+        new_colors = []
+        for index, packed_color in enumerate(self.pack_colors(other_palette[np.newaxis])[0]):
+            if packed_color not in packed_palette:
+                packed_palette.append(packed_color)
+                new_colors.append(other_palette[index])
+            index_map[index] = packed_palette.index(packed_color)
+        if len(packed_palette) > 256:
+            return None
+        
+        if len(new_colors) > 0:
+            img.putpalette(np.concatenate((palette, np.array(new_colors))).tobytes())
+        mapped_img = self.create_palette_image(index_map[np.asarray(other_img)], self.get_palette(img))
+        mapped_img.info = other_img.info
+        return img, mapped_img
+
+    def convert_image(self, img: Image, mode: str) -> Image:
+        '''
+        Converts the image only if it does not have the mode
+        already, Image.convert would copy it anyway
+        '''
+        
+        if img.mode == mode:
+            return img
+        return img.convert(mode)
+
+    def convert_array(self, np_array: np.ndarray, mode: str) -> np.ndarray:
+        '''
+        Uses pillow for the conversion, so an array gets
+        exactly the same values as the image
+        '''
+        
+        return np.asarray(Image.fromarray(np_array).convert(mode))
+
     def get_colors(self, img: Image):
         
-        color_infos = img.convert("RGB").getcolors()
+        color_infos = self.get_color_counts(img)
         if color_infos is None:
             raise TooManyColors()
         
@@ -132,6 +401,24 @@ class AlgorithmHelper(object):
             colors.append(info[1])
         return colors
 
+    def get_color_counts(self, img: Image):
+        '''
+        Like Image.getcolors() for an RGB image, but palette images
+        are not converted. Palette entries with the same color are
+        counted together.
+        '''
+        
+        if img.mode != "P":
+            return img.convert("RGB").getcolors()
+        
+        counts = {}
+        histogram = img.histogram()
+        for index, color in enumerate(self.get_palette(img)):
+            if histogram[index] > 0:
+                color = tuple(int(value) for value in color)
+                counts[color] = counts.get(color, 0) + histogram[index]
+        return [(count, color) for color, count in counts.items()]
+
     def replace_white_with_color(self, img: Image, color: ()) -> Image:
         
         if color == RGB_WHITE:
@@ -152,21 +439,93 @@ class ModeTransformationAlgorithm(AlgorithmHelper):
     This is the base class for all ModeTransformationAlgorithms
     """
     
+    # Set to True if the algorithm calculates a background
+    # color when called without one
+    determines_bg_color = False
+    
+    # The mode of the images (and tiles) transform expects. An
+    # algorithm that works on gray values gets an "L" image and
+    # does not need to convert it again.
+    input_mode = "RGB"
+    
+    # Set to True if the algorithm implements transform_tile,
+    # i.e. it may be applied to very large images tile by tile
+    tile_safe = False
+    # Set to True if transform_tile needs statistics of the
+    # whole image, collected in a first pass over all tiles
+    needs_tile_statistics = False
+    # The number of pixels around a tile local algorithms need
+    # to calculate the tile. The tiles are extended by this halo
+    # (less at the borders of the image) and cut out again from
+    # the result of transform_tile.
+    tile_halo = 0
+    
     def transform(self, img: Image, bg_color) -> (Image, ()):
         
         raise Exception("Please implement in child class")
     
+    def get_tile_mode(self, bg_color) -> str:
+        """
+        The mode of the image the tiles returned by
+        transform_tile are assembled to
+        """
+        
+        raise Exception("Please implement in child class")
+    
+    def get_tile_statistics(self, tile: np.ndarray, core: ()):
+        """
+        Called for every tile (with halo) in the first pass,
+        the core slices select the tile itself
+        """
+        
+        return None
+    
+    def merge_tile_statistics(self, statistics, tile_statistics):
+        """
+        Gets the statistics of the tiles so far (None for the
+        first tile) and returns the updated statistics
+        """
+        
+        return statistics
+    
+    def finish_tile_statistics(self, statistics):
+        """
+        Turns the statistics of all tiles into the value
+        handed to transform_tile
+        """
+        
+        return statistics
+    
+    def transform_tile(self, tile: np.ndarray, bg_color, statistics) -> np.ndarray:
+        """
+        Gets a tile (with halo) in the input mode as array and returns the
+        transformed tile as array. The assembled tiles must be
+        the same image transform would return for the whole image.
+        """
+        
+        raise Exception("Please implement in child class")
+    
 class NoneAlgorithm(ModeTransformationAlgorithm):
     """
     This implementation does nothing to the image.
     """
     
+    tile_safe = True
+    
     def transform(self, img:Image, bg_color)->Image:
 
         # Replacement of background color does not make sense,
         # so we just return the background color without
         # application to the image
         return (img, None)
+    
+    def get_tile_mode(self, bg_color) -> str:
+        
+        return "RGB"
+    
+    def transform_tile(self, tile: np.ndarray, bg_color, statistics) -> np.ndarray:
+        
+        return tile
 
 class Gray(ModeTransformationAlgorithm):
     """
@@ -175,12 +534,23 @@ class Gray(ModeTransformationAlgorithm):
     transformed also to gray.
     """
     
+    tile_safe = True
+    input_mode = "L"
+    
     def transform(self, img:Image, bg_color) -> (Image, ()):
         
         # Replacement of background color does not make sense,
         # so we just return the background color without
         # application to the image
-        return (img.convert("L"), None)
+        return (self.convert_image(img, "L"), None)
+    
+    def get_tile_mode(self, bg_color) -> str:
+        
+        return "L"
+    
+    def transform_tile(self, tile: np.ndarray, bg_color, statistics) -> np.ndarray:
+        
+        return self.convert_array(tile, "L")
 
 class FloydSteinberg(ModeTransformationAlgorithm):
     """
@@ -207,7 +577,7 @@ class ThresholdAlgorithm(ModeTransformationAlgorithm):
     def apply_cv2_mask(self, img:Image, mask_implementation, bg_color, **nargs) -> (Image, ()):
         
         resolution = self.get_image_resolution(img)
-        in_array = np.asarray(img.convert("L"))
+        in_array = np.asarray(self.convert_image(img, "L"))
         mask = mask_implementation(in_array, **nargs)
         out_array = in_array > mask
 
@@ -219,6 +589,23 @@ class ThresholdAlgorithm(ModeTransformationAlgorithm):
             return (img, bg_color)
         
         return (img.convert("1"), None)
+    
+    def get_tile_mode(self, bg_color) -> str:
+        
+        if bg_color is None or bg_color == RGB_WHITE:
+            return "1"
+        return "RGB"
+    
+    def apply_tile_mask(self, mask: np.ndarray, bg_color) -> np.ndarray:
+        """
+        The tile version of the end of apply_cv2_mask
+        """
+        
+        if self.get_tile_mode(bg_color) == "1":
+            return mask
+        colored_tile = np.zeros(mask.shape + (3,), dtype=np.uint8)
+        colored_tile[mask] = bg_color
+        return colored_tile
 
 class Otsu(ThresholdAlgorithm):
     """
@@ -228,8 +615,39 @@ class Otsu(ThresholdAlgorithm):
     if the background is spotted or the text color uneven.
     """
     
+    tile_safe = True
+    needs_tile_statistics = True
+    input_mode = "L"
+    
     def transform(self, img:Image, bg_color):
         return self.apply_cv2_mask(img, threshold_otsu, bg_color)
+    
+    def get_tile_statistics(self, tile: np.ndarray, core: ()) -> np.ndarray:
+        
+        return np.bincount(self.convert_array(tile[core], "L").ravel(), minlength=256)
+    
+    def merge_tile_statistics(self, histogram: np.ndarray, tile_histogram: np.ndarray) -> np.ndarray:
+        
+        if histogram is None:
+            return tile_histogram
+        return histogram + tile_histogram
+    
+    def finish_tile_statistics(self, histogram: np.ndarray) -> int:
+        """
+        Returns the global threshold. Like threshold_otsu on the
+        whole image the histogram only covers the range from the
+        darkest to the lightest gray.
+        """
+        
+        gray_values = np.nonzero(histogram)[0]
+        darkest, lightest = gray_values[0], gray_values[-1]
+        if darkest == lightest:
+            return darkest
+        return threshold_otsu(hist=(histogram[darkest:lightest + 1], np.arange(darkest, lightest + 1)))
+    
+    def transform_tile(self, tile: np.ndarray, bg_color, threshold: int) -> np.ndarray:
+        
+        return self.apply_tile_mask(self.convert_array(tile, "L") > threshold, bg_color)
 
 class Sauvola(ThresholdAlgorithm):
     """
@@ -238,14 +656,35 @@ class Sauvola(ThresholdAlgorithm):
     quantization on slanted characters.
     """
     
+    tile_halo = SAUVOLA_WINDOW_SIZE // 2 + 1
+    input_mode = "L"
+    
+    def __init__(self, statistics_grid_step: int=1):
+        """
+        See fast_threshold_sauvola for the grid step
+        """
+        
+        self.statistics_grid_step = statistics_grid_step
+    
     def transform(self, img:Image, bg_color):
-        return self.apply_cv2_mask(img, threshold_sauvola, bg_color, window_size=101)
+        return self.apply_cv2_mask(img, fast_threshold_sauvola, bg_color,
+                                   window_size=SAUVOLA_WINDOW_SIZE, grid_step=self.statistics_grid_step)
+    
+    def transform_tile(self, tile: np.ndarray, bg_color, statistics) -> np.ndarray:
+        
+        gray_tile = self.convert_array(tile, "L")
+        return self.apply_tile_mask(gray_tile > fast_threshold_sauvola(gray_tile, window_size=SAUVOLA_WINDOW_SIZE), bg_color)
+    
+    # The grid of a tile does not fit the grid of the whole image
+    tile_safe = property(lambda self: self.statistics_grid_step == 1)
     
 class Niblack(ThresholdAlgorithm):
     """
     It is, like Sauvola, a local thresholding algorithm but I did not find
     a use case where either Otsu or Sauvola would have produced a superior result.
     """
+    
+    input_mode = "L"
 
     def transform(self, img:Image, bg_color):
         return self.apply_cv2_mask(img, threshold_niblack, bg_color, window_size=11)
@@ -281,34 +720,284 @@ class BadStencilPrint(ThresholdAlgorithm):
         return Sauvola().transform(img_gray, bg_color)
 
 
+@singleton
+class PaletteCache(object):
+    """
+    Remembers palettes, so pages and regions do not need to run
+    k-means from random centers again and again:
+    
+    - The palette for the same pixel sample (e.g. when a page is
+      rendered again, or its background color was determined before)
+      is returned as it is.
+    - Every sample gets a coarse color histogram as signature. For
+      each signature (and number of colors) a weighted k-means on
+      the histogram gives initial centers. Pages with similar colors
+      (e.g. a series of flyers printed on the same paper) start from
+      the same or similar centers, so they end up with the same
+      palette instead of slightly different ones.
+    
+    Both values only depend on their keys and not on the pages
+    processed before, so the palettes do not depend on the order of
+    the pages or on the worker process that renders a page.
+    """
+    
+    def __init__(self, max_entries: int=MAX_PALETTE_CACHE_ENTRIES, seed: int=QUANTIZATION_SEED):
+        
+        self.max_entries = max_entries
+        self.seed = seed
+        self.hits = 0
+        self._palettes = OrderedDict()
+        self._initial_centers = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get_palette(self, pixels: np.ndarray, no_of_colors: int) -> np.ndarray:
+        
+        with self._lock:
+            palette = self._get_entry(self._palettes, self._get_sample_key(pixels, no_of_colors))
+            if palette is not None:
+                self.hits += 1
+            return palette
+    
+    def add_palette(self, pixels: np.ndarray, no_of_colors: int, palette: np.ndarray):
+        
+        with self._lock:
+            self._add_entry(self._palettes, self._get_sample_key(pixels, no_of_colors), palette)
+    
+    def get_initial_centers(self, pixels: np.ndarray, no_of_colors: int) -> np.ndarray:
+        """
+        Returns None if the signature has less colors than wanted
+        """
+        
+        key = (no_of_colors, self.get_signature(pixels).tobytes())
+        with self._lock:
+            if key in self._initial_centers:
+                self._initial_centers.move_to_end(key)
+                return self._initial_centers[key]
+        initial_centers = self._fit_signature(np.frombuffer(key[1], dtype=np.uint8), no_of_colors)
+        with self._lock:
+            self._add_entry(self._initial_centers, key, initial_centers)
+        return initial_centers
+    
+    def get_signature(self, pixels: np.ndarray) -> np.ndarray:
+        
+        shift = 8 - SIGNATURE_BITS
+        bins = (pixels[:, 0].astype(np.uint32) >> shift << (2 * SIGNATURE_BITS)) | \
+               (pixels[:, 1].astype(np.uint32) >> shift << SIGNATURE_BITS) | (pixels[:, 2] >> shift)
+        histogram = np.bincount(bins, minlength=1 << (3 * SIGNATURE_BITS))
+        return np.uint8(np.minimum(np.round(histogram * SIGNATURE_LEVELS / pixels.shape[0]), 255))
+    
+    def clear(self):
+        
+        with self._lock:
+            self._palettes.clear()
+            self._initial_centers.clear()
+    
+    def _fit_signature(self, signature: np.ndarray, no_of_colors: int) -> np.ndarray:
+        """
+        k-means on the colors of the histogram bins, weighted
+        by their share, with k-means++ initialization
+        """
+        
+        bins = np.nonzero(signature)[0]
+        if bins.shape[0] < no_of_colors:
+            return None
+        shift = 8 - SIGNATURE_BITS
+        mask = (1 << SIGNATURE_BITS) - 1
+        offset = ((1 << shift) - 1) / 2
+        colors = np.stack(((bins >> (2 * SIGNATURE_BITS)) << shift,
+                           ((bins >> SIGNATURE_BITS) & mask) << shift,
+                           (bins & mask) << shift), axis=1).astype(np.float32) + offset
+        weights = signature[bins].astype(np.float64)
+        
+        random_generator = np.random.default_rng(self.seed)
+        best_centers = None
+        best_compactness = None
+        for _ in range(QUANTIZATION_ATTEMPTS):
+            centers = colors[[random_generator.choice(colors.shape[0], p=weights / weights.sum())]]
+            while centers.shape[0] < no_of_colors:
+                distances = self._get_distances(colors, centers).min(axis=1) * weights
+                centers = np.concatenate((centers, colors[[random_generator.choice(colors.shape[0], p=distances / distances.sum())]]))
+            for _ in range(20):
+                labels = self._get_distances(colors, centers).argmin(axis=1)
+                totals = np.bincount(labels, weights=weights, minlength=no_of_colors)
+                new_centers = np.stack([np.bincount(labels, weights=weights * colors[:, channel], minlength=no_of_colors)
+                                        for channel in range(3)], axis=1) / np.maximum(totals, 1)[:, np.newaxis]
+                new_centers[totals == 0] = centers[totals == 0]
+                converged = np.abs(new_centers - centers).max() < 1.0
+                centers = new_centers.astype(np.float32)
+                if converged:
+                    break
+            compactness = (self._get_distances(colors, centers).min(axis=1) * weights).sum()
+            if best_compactness is None or compactness < best_compactness:
+                best_centers, best_compactness = centers, compactness
+        return best_centers
+    
+    def _get_distances(self, colors: np.ndarray, centers: np.ndarray) -> np.ndarray:
+        
+        return ((colors[:, np.newaxis, :] - centers[np.newaxis, :, :]) ** 2).sum(axis=2)
+    
+    def _get_sample_key(self, pixels: np.ndarray, no_of_colors: int):
+        
+        return (no_of_colors, hashlib.blake2b(np.ascontiguousarray(pixels).tobytes(), digest_size=16).digest())
+    
+    def _get_entry(self, entries: OrderedDict, key):
+        
+        if key not in entries:
+            return None
+        entries.move_to_end(key)
+        return entries[key]
+    
+    def _add_entry(self, entries: OrderedDict, key, value):
+        
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+class ColorQuantizer(object):
+    """
+    k-means color quantization that is fast enough for full pages.
+    The centers are fitted on a random sample of the pixels, which
+    gives the same palettes as fitting on all pixels (k-means on all
+    pixels does not find the same palette on every run either). The
+    seed is fixed, so the palette of an image is always the same.
+    With a palette cache the fit is warm started (see PaletteCache).
+    
+    The pixels are then mapped to their nearest center with a lookup
+    table over the colors reduced to 6 bits per channel. Only pixels
+    in cells of the table that are too close to the border between
+    two centers are compared with the centers one by one.
+    """
+    
+    def __init__(self, palette_cache: PaletteCache=None,
+                 sample_size: int=QUANTIZATION_SAMPLE_SIZE, seed: int=QUANTIZATION_SEED):
+        
+        self.palette_cache = palette_cache
+        self.sample_size = sample_size
+        self.seed = seed
+    
+    def quantize(self, np_array: np.ndarray, no_of_colors: int) -> (np.ndarray, np.ndarray):
+        """
+        Returns the quantized RGB array and the centers
+        """
+        
+        centers = self.fit(np_array, no_of_colors)
+        return self.apply(np_array, centers), centers
+    
+    def fit(self, np_array: np.ndarray, no_of_colors: int) -> np.ndarray:
+        """
+        Returns the centers as float32 array
+        """
+        
+        pixels = np_array.reshape(-1, 3)
+        if pixels.shape[0] > self.sample_size:
+            random_generator = np.random.default_rng(self.seed)
+            pixels = pixels[random_generator.integers(0, pixels.shape[0], self.sample_size)]
+        if self.palette_cache is None:
+            return self._run_kmeans(pixels, no_of_colors)
+        
+        centers = self.palette_cache.get_palette(pixels, no_of_colors)
+        if centers is None:
+            centers = self._run_kmeans(pixels, no_of_colors, self.palette_cache.get_initial_centers(pixels, no_of_colors))
+            self.palette_cache.add_palette(pixels, no_of_colors, centers)
+        return centers
+    
+    def _run_kmeans(self, pixels: np.ndarray, no_of_colors: int, initial_centers: np.ndarray=None) -> np.ndarray:
+        """
+        With initial centers, the first attempt starts with the
+        labels they give. cv2 keeps the first of several equally
+        good results, so similar pages end up with the same palette.
+        """
+        
+        pixels = np.float32(pixels)
+        condition = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 1.0)
+        cv2.setRNGSeed(self.seed)
+        if initial_centers is None:
+            _, _, centers = cv2.kmeans(pixels, no_of_colors, None, condition,
+                                       QUANTIZATION_ATTEMPTS, cv2.KMEANS_RANDOM_CENTERS)
+        else:
+            labels = self._find_nearest_centers(pixels, initial_centers).astype(np.int32).reshape(-1, 1)
+            _, _, centers = cv2.kmeans(pixels, no_of_colors, labels, condition,
+                                       WARM_QUANTIZATION_ATTEMPTS, cv2.KMEANS_USE_INITIAL_LABELS)
+        return centers
+    
+    def apply(self, np_array: np.ndarray, centers: np.ndarray) -> np.ndarray:
+        
+        return np.uint8(centers)[self.get_labels(np_array, centers)]
+    
+    def get_labels(self, np_array: np.ndarray, centers: np.ndarray) -> np.ndarray:
+        """
+        Returns the index of the nearest center for every pixel
+        """
+        
+        lookup_table = self.create_lookup_table(centers)
+        all_labels = np.empty(np_array.shape[:2], dtype=np.uint8)
+        for start in range(0, np_array.shape[0], MASK_BAND_HEIGHT):
+            band = np_array[start:start + MASK_BAND_HEIGHT] >> LOOKUP_TABLE_SHIFT
+            indices = (band[:, :, 0].astype(np.uint32) << (2 * LOOKUP_TABLE_BITS)) | \
+                      (band[:, :, 1].astype(np.uint32) << LOOKUP_TABLE_BITS) | band[:, :, 2]
+            labels = lookup_table[indices]
+            ambiguous = labels == AMBIGUOUS_CELL
+            if ambiguous.any():
+                labels[ambiguous] = self._find_nearest_centers(np_array[start:start + MASK_BAND_HEIGHT][ambiguous], centers)
+            all_labels[start:start + MASK_BAND_HEIGHT] = labels
+        return all_labels
+    
+    def create_lookup_table(self, centers: np.ndarray) -> np.ndarray:
+        """
+        Maps every 6 bit color (as r << 12 | g << 6 | b) to the
+        index of the nearest center. The color of a cell is the
+        middle of the 8 bit colors it stands for. If the nearest
+        center is not nearer by more than the diameter of the cell
+        than the second nearest, not all colors of the cell have
+        the same nearest center, the cell gets AMBIGUOUS_CELL.
+        """
+        
+        cell_values = np.arange(1 << LOOKUP_TABLE_BITS, dtype=np.float32) * (1 << LOOKUP_TABLE_SHIFT) + \
+            ((1 << LOOKUP_TABLE_SHIFT) - 1) / 2
+        red, green, blue = np.meshgrid(cell_values, cell_values, cell_values, indexing="ij")
+        cell_colors = np.stack((red.ravel(), green.ravel(), blue.ravel()), axis=1)
+        distances = np.sqrt(((cell_colors[:, np.newaxis, :] - centers[np.newaxis, :, :]) ** 2).sum(axis=2))
+        lookup_table = np.argmin(distances, axis=1).astype(np.uint8)
+        if centers.shape[0] > 1:
+            distances.sort(axis=1)
+            cell_diameter = np.sqrt(3) * ((1 << LOOKUP_TABLE_SHIFT) - 1)
+            lookup_table[distances[:, 1] - distances[:, 0] <= cell_diameter] = AMBIGUOUS_CELL
+        return lookup_table
+    
+    def _find_nearest_centers(self, pixels: np.ndarray, centers: np.ndarray) -> np.ndarray:
+        
+        distances = ((np.float32(pixels)[:, np.newaxis, :] - centers[np.newaxis, :, :]) ** 2).sum(axis=2)
+        return np.argmin(distances, axis=1).astype(np.uint8)
+
 class QuantizationAlgorithm(ModeTransformationAlgorithm):
     """
     Base class for transforming images using a k-means algorithm to
     extract the 2 dominant colors of an image
     """
     
+    def __init__(self, palette_cache: PaletteCache=None):
+        
+        self.quantizer = ColorQuantizer(palette_cache)
+    
     def _apply_quantization(self, img: Image, no_of_colors=2):
         """
-        Uses the k-means algorithm to quantize the image for two colors
+        Uses the k-means algorithm to quantize the image for two colors.
+        The result is a palette image.
         """
         
         img = img.convert("RGB")
-        np_array = np.array(img)
-        flattend = np.float32(np_array).reshape(-1,3)
-        condition = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER,20,1.0)
-        ret,label,center = cv2.kmeans(flattend, no_of_colors , None, condition, 10, cv2.KMEANS_RANDOM_CENTERS)
-        center = np.uint8(center)
-        final_flattend = center[label.flatten()]
-        final_img_array = final_flattend.reshape(np_array.shape)
-        
-        new_img = Image.fromarray(final_img_array)
+        np_array = np.asarray(img)
+        centers = self.quantizer.fit(np_array, no_of_colors)
+        
+        new_img = self.create_palette_image(self.quantizer.get_labels(np_array, centers), np.uint8(centers))
         new_img.info['dpi'] = img.info['dpi']
         
         return (new_img, self._find_bg_color(new_img))
 
     def _find_bg_color(self, quantized_img: Image) -> ():
 
-        colors = quantized_img.getcolors()
+        colors = self.get_color_counts(quantized_img)
         max_channel_sum = 0
         max_idx = None
         
@@ -322,7 +1011,7 @@ class QuantizationAlgorithm(ModeTransformationAlgorithm):
     
     def _find_fg_color(self, quantized_img: Image) -> ():
         
-        colors = quantized_img.getcolors()
+        colors = self.get_color_counts(quantized_img)
         sum0 = colors[0][1][0] + colors[0][1][1] + colors[0][1][2] 
         sum1 = colors[1][1][0] + colors[1][1][1] + colors[1][1][2]
         if sum1 > sum0:
@@ -332,6 +1021,8 @@ class QuantizationAlgorithm(ModeTransformationAlgorithm):
         
 class TwoColors(QuantizationAlgorithm):
     
+    determines_bg_color = True
+    
     def transform(self, img:Image, bg_color):
         
         img, calculated_bg_color =  self._apply_quantization(img)
@@ -342,6 +1033,8 @@ class TwoColors(QuantizationAlgorithm):
         
 class FourColors(QuantizationAlgorithm):
     
+    determines_bg_color = True
+    
     def transform(self, img:Image, bg_color):
         
         img, calculated_bg_color =  self._apply_quantization(img, 4)
@@ -373,17 +1066,9 @@ class ColorTextOnWhite(QuantizationAlgorithm):
         
         quantized_img, quantized_bg_color = self._apply_quantization(img)
 
-        np_img = np.array(quantized_img)
-        red, green, blue = np_img.T
-
-        bg_areas = (red == quantized_bg_color[0]) & (green == quantized_bg_color[1]) & (blue == quantized_bg_color[2])
-        if bg_color is not None:
-            np_img[bg_areas.T] = bg_color
-        else:
-            np_img[bg_areas.T] = RGB_WHITE
-
-        final_img = Image.fromarray(np_img)
-        final_img.info['dpi'] = img.info['dpi']
+        if bg_color is None:
+            bg_color = RGB_WHITE
+        final_img = self.replace_colors_in_palette(quantized_img, {quantized_bg_color: bg_color})
         
         return (final_img, None)
 
@@ -399,7 +1084,7 @@ class BlackAndColorTextOnWhite(QuantizationAlgorithm):
         
         quantized_img, quantized_bg_color = self._apply_quantization(img, no_of_colors=3)
 
-        colors = quantized_img.getcolors()
+        colors = self.get_color_counts(quantized_img)
         assert(len(colors) == 3)
         
         sum0 = colors[0][1][0] + colors[0][1][1] + colors[0][1][2] 
@@ -431,20 +1116,12 @@ class BlackAndColorTextOnWhite(QuantizationAlgorithm):
             black = colors[2][1]
             color = colors[0][1]
         
-        np_img = np.array(quantized_img)
-        red, green, blue = np_img.T
-
-        white_areas = (red == white[0]) & (green == white[1]) & (blue == white[2])
-        black_areas = (red == black[0]) & (green == black[1]) & (blue == black[2])
-        color_areas = (red == color[0]) & (green == color[1]) & (blue == color[2])
-        
+        if project_bg_color is None:
+            project_bg_color = RGB_WHITE
+        # The colored parts keep the original pixels
         np_img = np.array(img)
-        
-        if project_bg_color is not None:
-            np_img[white_areas.T] = project_bg_color
-        else:
-            np_img[white_areas.T] = RGB_WHITE
-        np_img[black_areas.T] = RGB_BLACK
+        self.replace_colors_in_array(np_img, {white: project_bg_color, black: RGB_BLACK},
+                                     mask_array=np.asarray(quantized_img), palette=self.get_palette(quantized_img))
 
         final_img = Image.fromarray(np_img)
         final_img.info['dpi'] = img.info['dpi']
@@ -456,22 +1133,19 @@ class BlackTextOnColor(QuantizationAlgorithm):
     This is the algorithm to use when you have black printed on a color paper.
     """
     
+    determines_bg_color = True
+    
     def transform(self, img:Image, bg_color):
         
         quantized_img, calculated_bg_color = self._apply_quantization(img)
         fg_color = self._find_fg_color(quantized_img)
 
-        np_img = np.array(quantized_img)
-        red, green, blue = np_img.T
-
-        black_areas = (red == fg_color[0]) & (green == fg_color[1]) & (blue == fg_color[2])
-        np_img[black_areas.T] = (0, 0, 0)
-
-        final_img = Image.fromarray(np_img)
-        final_img.info['dpi'] = img.info['dpi']
+        replacements = {fg_color: RGB_BLACK}
+        if bg_color is not None:
+            replacements[calculated_bg_color] = bg_color
+        final_img = self.replace_colors_in_palette(quantized_img, replacements)
 
         if bg_color is not None:
-            final_img = self.replace_color_with_color(final_img, calculated_bg_color, bg_color)
             return (final_img, bg_color)
         
         return (final_img, calculated_bg_color)
@@ -483,21 +1157,19 @@ class GrayTextOnWhite(Otsu):
     white, this is the algorithm to use
     """
     
+    tile_safe = False
+    needs_tile_statistics = False
+    
     def transform(self, img:Image, bg_color) -> (Image, ()):
         
         (mask, col) = super().transform(img, bg_color)
         mask = mask.convert("RGB")
         mask = mask.filter(ImageFilter.BLUR)
 
+        if bg_color is None:
+            bg_color = RGB_WHITE
         np_img = np.array(img.convert("RGB"))
-        np_mask = np.array(mask)
-        red, green, blue = np_mask.T
-
-        white_areas = (red == 255) & (green == 255) & (blue == 255)
-        if bg_color is not None:
-            np_img[white_areas.T] = bg_color
-        else:
-            np_img[white_areas.T] = (255, 255, 255)
+        self.replace_colors_in_array(np_img, {RGB_WHITE: bg_color}, mask_array=np.asarray(mask))
 
         final_img = Image.fromarray(np_img)
         final_img.info['dpi'] = img.info['dpi']
@@ -510,6 +1182,8 @@ class Erase(ModeTransformationAlgorithm):
     over holes, missing corners etc. on the scan.
     """
     
+    tile_safe = True
+    
     def transform(self, img:Image, bg_color) -> (Image, ()):
         
         resolution = self.get_image_resolution(img)
@@ -523,37 +1197,138 @@ class Erase(ModeTransformationAlgorithm):
         img.info['dpi'] = (resolution, resolution)
         
         return (img, None)
+    
+    def get_tile_mode(self, bg_color) -> str:
+        
+        return "RGB"
+    
+    def transform_tile(self, tile: np.ndarray, bg_color, statistics) -> np.ndarray:
+        
+        if bg_color is None:
+            bg_color = RGB_WHITE
+        return np.full(tile.shape, bg_color, dtype=np.uint8)
 
 class InvertAlgorithm(ModeTransformationAlgorithm):
     """
     This implementation does nothing to the image.
     """
     
+    tile_safe = True
+    
     def transform(self, img:Image, bg_color)->Image:
 
         return (invert(img), None)
     
-class DenoiseAlgorithm():
+    def get_tile_mode(self, bg_color) -> str:
+        
+        return "RGB"
+    
+    def transform_tile(self, tile: np.ndarray, bg_color, statistics) -> np.ndarray:
+        
+        return 255 - tile
+    
+class DenoiseAlgorithm(ModeTransformationAlgorithm):
+    
+    tile_safe = True
+    # The contrast enhancement blends with the mean gray
+    needs_tile_statistics = True
+    # The median filter looks at the neighbouring pixels
+    tile_halo = 1
+    input_mode = "L"
     
     def transform(self, img: Image, bg_color) -> Image:
 
+        resolution = self.get_image_resolution(img)
+
         # In Graustufen umwandeln
-        gray_image = img.convert("L")
+        gray_image = self.convert_image(img, "L")
 
         # Kontrast erhöhen
         enhancer = ImageEnhance.Contrast(gray_image)
-        contrasted_image = enhancer.enhance(2.0)  # Kontrastfaktor
+        contrasted_image = enhancer.enhance(CONTRAST_FACTOR)
 
         # Rauschen reduzieren mit Medianfilter
         denoised_image = contrasted_image.filter(ImageFilter.MedianFilter(size=3))
+        denoised_image.info['dpi'] = (resolution, resolution)
 
         return (denoised_image, None)
     
-class BadContrastAlgorithm():
+    def get_tile_mode(self, bg_color) -> str:
+        
+        return "L"
+    
+    def get_tile_statistics(self, tile: np.ndarray, core: ()) -> np.ndarray:
+        
+        return np.bincount(self.convert_array(tile[core], "L").ravel(), minlength=256)
+    
+    def merge_tile_statistics(self, histogram: np.ndarray, tile_histogram: np.ndarray) -> np.ndarray:
+        
+        if histogram is None:
+            return tile_histogram
+        return histogram + tile_histogram
+    
+    def finish_tile_statistics(self, histogram: np.ndarray) -> int:
+        """
+        Returns the mean gray ImageEnhance.Contrast calculates
+        """
+        
+        return int(ImageStat.Stat(histogram.tolist()).mean[0] + 0.5)
+    
+    def transform_tile(self, tile: np.ndarray, bg_color, mean: int) -> np.ndarray:
+        
+        gray_image = Image.fromarray(self.convert_array(tile, "L"))
+        contrasted_image = Image.blend(Image.new("L", gray_image.size, mean), gray_image, CONTRAST_FACTOR)
+        return np.asarray(contrasted_image.filter(ImageFilter.MedianFilter(size=3)))
+    
+class BadContrastAlgorithm(ModeTransformationAlgorithm):
+    
+    tile_safe = True
+    # The difference to the background is normalized
+    # to the range of the whole image
+    needs_tile_statistics = True
+    tile_halo = BACKGROUND_BLUR_SIZE // 2 + THRESHOLD_BLOCK_SIZE // 2
     
     def transform(self, pil_img: Image, bg_color) -> Image:
         
-        img = np.array(pil_img)
+        resolution = self.get_image_resolution(pil_img)
+        diff = self._subtract_background(np.array(pil_img))
+        norm = cv2.normalize(diff, None, 0, 255, cv2.NORM_MINMAX)
+
+        # --- Ergebnis als PIL (grau) ---
+        pil_out = Image.fromarray(self._binarize(norm))
+        pil_out.info['dpi'] = (resolution, resolution)
+
+        return pil_out, bg_color
+    
+    def get_tile_mode(self, bg_color) -> str:
+        
+        return "L"
+    
+    def get_tile_statistics(self, tile: np.ndarray, core: ()) -> ():
+        
+        diff = self._subtract_background(tile)[core]
+        return (int(diff.min()), int(diff.max()))
+    
+    def merge_tile_statistics(self, statistics: (), tile_statistics: ()) -> ():
+        
+        if statistics is None:
+            return tile_statistics
+        return (min(statistics[0], tile_statistics[0]), max(statistics[1], tile_statistics[1]))
+    
+    def transform_tile(self, tile: np.ndarray, bg_color, statistics: ()) -> np.ndarray:
+        
+        diff = self._subtract_background(tile)
+        # This is what cv2.normalize does, but with the
+        # minimum and maximum of the whole image
+        minimum, maximum = statistics
+        scale = 0.0
+        if maximum > minimum:
+            scale = 255.0 * (1.0 / (maximum - minimum))
+        norm = cv2.convertScaleAbs(diff, alpha=scale, beta=-minimum * scale)
+        return self._binarize(norm)
+    
+    def _subtract_background(self, img: np.ndarray) -> np.ndarray:
+        
         if img.ndim == 2:
             img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR) 
         else:
@@ -564,11 +1339,12 @@ class BadContrastAlgorithm():
         L, _A, _B = cv2.split(lab)
 
         # --- Hintergrundschätzung ---
-        background = cv2.GaussianBlur(L, (51, 51), 0)
+        background = cv2.GaussianBlur(L, (BACKGROUND_BLUR_SIZE, BACKGROUND_BLUR_SIZE), 0)
 
         # --- Hintergrund entfernen ---
-        diff = cv2.subtract(background, L)
-        norm = cv2.normalize(diff, None, 0, 255, cv2.NORM_MINMAX)
+        return cv2.subtract(background, L)
+    
+    def _binarize(self, norm: np.ndarray) -> np.ndarray:
 
         # --- Adaptive Binärisierung ---
         binary = cv2.adaptiveThreshold(
@@ -576,17 +1352,12 @@ class BadContrastAlgorithm():
             255,
             cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
             cv2.THRESH_BINARY,
-            31,
+            THRESHOLD_BLOCK_SIZE,
             -10
         )
 
         # --- Invertieren (damit Text schwarz, Hintergrund weiß) ---
-        binary_inv = 255 - binary
-
-        # --- Ergebnis als PIL (grau) ---
-        pil_out = Image.fromarray(binary_inv)
-
-        return pil_out, bg_color
+        return 255 - binary
     
 class AlgorithmModule(Module):
     """
@@ -595,7 +1366,7 @@ class AlgorithmModule(Module):
     
     @provider
     @singleton
-    def algorithm_provider(self) -> AlgorithmImplementations:
+    def algorithm_provider(self, palette_cache: PaletteCache=None) -> AlgorithmImplementations:
         
         return {Algorithm.NONE: NoneAlgorithm(),
                 Algorithm.GRAY: Gray(),
@@ -603,15 +1374,15 @@ class AlgorithmModule(Module):
                 Algorithm.FLOYD_STEINBERG: FloydSteinberg(),
                 Algorithm.OTSU: Otsu(),
                 Algorithm.SAUVOLA: Sauvola(),
-                Algorithm.TWO_COLOR_QUANTIZATION: TwoColors(),
-                Algorithm.FOUR_COLORS: FourColors(),
-                Algorithm.BLACK_AND_COLOR_ON_WHITE: BlackAndColorTextOnWhite(),
-                Algorithm.COLOR_PAPER_QUANTIZATION: BlackTextOnColor(),
-                Algorithm.COLOR_TEXT_QUANTIZATION: ColorTextOnWhite(),
+                Algorithm.TWO_COLOR_QUANTIZATION: TwoColors(palette_cache),
+                Algorithm.FOUR_COLORS: FourColors(palette_cache),
+                Algorithm.BLACK_AND_COLOR_ON_WHITE: BlackAndColorTextOnWhite(palette_cache),
+                Algorithm.COLOR_PAPER_QUANTIZATION: BlackTextOnColor(palette_cache),
+                Algorithm.COLOR_TEXT_QUANTIZATION: ColorTextOnWhite(palette_cache),
                 Algorithm.STENCIL_PRINT_GOOD: GoodStencilPrint(),
                 Algorithm.STENCIL_PRINT_BAD: BadStencilPrint(),
                 Algorithm.ERASE: Erase(),
                 Algorithm.INVERT: InvertAlgorithm(),
-                Algorithm.THREE_COLORS_ON_WHITE: ThreeColorsOnWhite(),
+                Algorithm.THREE_COLORS_ON_WHITE: ThreeColorsOnWhite(palette_cache),
                 Algorithm.BAD_CONTRAST: BadContrastAlgorithm(),
                 Algorithm.DENOISE: DenoiseAlgorithm()}
@@ -3,52 +3,92 @@ Created on 21.05.2024
 
 @author: michael
 '''
+import copy
+import math
+
 import numpy as np
 import cv2
-from injector import singleton, inject
+from injector import singleton, inject, Injector
 from PIL import Image
 from skimage.filters.thresholding import threshold_otsu
 from skimage.color import rgb2gray
 from deskew import determine_skew
 
+from Asb.ScanConvert2.ProcessPool import get_number_of_workers, ordered_map
+from Asb.ScanConvert2.ScanConvertDomain import Page, DRAFT_REDUCTIONS
+
 BINARY_BLACK = False
 BINARY_WHITE = True
 GRAY_BLACK = 0
 GRAY_WHITE = 255
 
+# The maximum gap between letters and words (in pixels
+# of the scan) that is closed when smearing text lines
+SMEAR_CONSTRAINT = 25
+
+# Finding the angle does not need the full resolution
+ALIGNMENT_RESOLUTION = 150
+
+# The index arrays we need for smearing take 4 bytes per pixel,
+# so we smear in chunks of rows (or columns) of about this size
+SMEARING_CHUNK_PIXELS = 4 * 1024 * 1024
+
 @singleton
 class SmearingService(object):
     """
     Implementation of a constrained run length algorithm (CRLA)
+    
+    A gap of non boundary pixels between two boundary pixels is
+    filled with the boundary color if it is shorter than the
+    constraint. Gaps at the start or the end of a line are
+    never filled.
     """
     
     def smear_vertical(self, bin_img: np.ndarray, constraint: int, boundary_color = BINARY_BLACK):
         
-        smeared_img = self.smear_horizontal(np.rot90(bin_img, -1), constraint, boundary_color)
-        return np.rot90(smeared_img)
+        return self._smear(bin_img, constraint, boundary_color, 0)
 
-    def smear_horizontal(self, bin_img, constraint: int, boundary_color = BINARY_BLACK):
-        # This is much faster (factor 1:3) than using the generic
-        # run length methods to implement smearing
-        height = bin_img.shape[0]
-        width = bin_img.shape[1]
+    def smear_horizontal(self, bin_img: np.ndarray, constraint: int, boundary_color = BINARY_BLACK):
+        
+        return self._smear(bin_img, constraint, boundary_color, 1)
+    
+    def _smear(self, bin_img: np.ndarray, constraint: int, boundary_color, axis: int):
+        """
+        Smears along the given axis. For every pixel we determine
+        the position of the previous and the next boundary pixel
+        on its line by accumulating the boundary positions. From
+        these the length of the gap the pixel belongs to follows
+        directly.
+        """
+        
         smeared_img = bin_img.copy()
-        for row_idx in range(0, height):
-            line = bin_img[row_idx]
-            col_idx = 0
-            gap_size = None
-            while col_idx < width:
-                if line[col_idx] == boundary_color:
-                    if gap_size is not None and gap_size > 0:
-                        if gap_size < constraint:
-                            gap_start = col_idx - gap_size
-                            smeared_img[row_idx, gap_start:col_idx] = boundary_color
-                    gap_size = 0
-                else:
-                    if gap_size is not None:
-                        gap_size += 1
-                    
-                col_idx += 1
+        line_length = bin_img.shape[axis]
+        no_of_lines = bin_img.shape[1 - axis]
+        if line_length == 0 or no_of_lines == 0:
+            return smeared_img
+        
+        index_shape = [1, 1]
+        index_shape[axis] = line_length
+        indices = np.arange(line_length, dtype=np.int32).reshape(index_shape)
+        
+        chunk_size = max(1, SMEARING_CHUNK_PIXELS // line_length)
+        for chunk_start in range(0, no_of_lines, chunk_size):
+            chunk_slice = [slice(None), slice(None)]
+            chunk_slice[1 - axis] = slice(chunk_start, chunk_start + chunk_size)
+            chunk_slice = tuple(chunk_slice)
+            
+            is_boundary = bin_img[chunk_slice] == boundary_color
+            previous_boundary = np.where(is_boundary, indices, -1)
+            np.maximum.accumulate(previous_boundary, axis=axis, out=previous_boundary)
+            next_boundary = np.where(is_boundary, indices, line_length)
+            next_boundary = np.flip(np.minimum.accumulate(np.flip(next_boundary, axis), axis=axis), axis)
+            
+            gap_size = next_boundary - previous_boundary - 1
+            fill = ~is_boundary
+            fill &= previous_boundary >= 0
+            fill &= next_boundary < line_length
+            fill &= gap_size < constraint
+            smeared_img[chunk_slice][fill] = boundary_color
                 
         return smeared_img
 
@@ -57,7 +97,10 @@ class DeskewService(object):
     
     def get_correct_angle(self, img):
         
-        grayscale = rgb2gray(img)
+        if img.mode == "L":
+            grayscale = np.asarray(img)
+        else:
+            grayscale = rgb2gray(img)
         angle = determine_skew(grayscale) 
         return angle
 
@@ -91,10 +134,10 @@ class AngleCorrectionService(object):
         
         return gray_ndarray
 
-    def get_correct_angle(self, img):
+    def get_correct_angle(self, img, constraint: int=SMEAR_CONSTRAINT):
         
         bin_ndarray = self.binarize_otsu(img)
-        smeared_ndarray = self.smearing_service.smear_horizontal(bin_ndarray, 25, BINARY_BLACK)
+        smeared_ndarray = self.smearing_service.smear_horizontal(bin_ndarray, constraint, BINARY_BLACK)
         smeared_ndarray_gray = self.convert_binary_to_inverted_gray(smeared_ndarray)
         contours, _ = cv2.findContours(smeared_ndarray_gray, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
         text_contours = self._find_text_lines(contours)
@@ -136,4 +179,95 @@ class AngleCorrectionService(object):
             return median_angle - 90
         else:
             return median_angle
+
+
+@singleton
+class AlignmentService(object):
+    '''
+    Determines the alignment angles for a whole bunch of pages.
+    The pages are distributed over worker processes, and the
+    angles are calculated on a downscaled grayscale proxy of
+    the page image, not on the full resolution image.
+    '''
+    
+    @inject
+    def __init__(self,
+                 angle_correction_service: AngleCorrectionService,
+                 deskew_service: DeskewService):
+        
+        self.angle_correction_service = angle_correction_service
+        self.deskew_service = deskew_service
+        self.max_workers = None
+        
+    def align_pages(self, pages: [], use_deskew_library: bool=False, progress_callback=None) -> []:
+        '''
+        Calculates the alignment angles for all pages and sets
+        them when all angles are known. The progress callback
+        is called with the number of finished pages and the
+        total number of pages.
+        '''
+        
+        tasks = [(page, use_deskew_library) for page in pages]
+        no_of_workers = get_number_of_workers(len(tasks), self.max_workers)
+        if no_of_workers > 1:
+            angles = ordered_map(_get_correct_angle, tasks, no_of_workers)
+        else:
+            angles = (self.get_correct_angle(*task) for task in tasks)
+        
+        results = []
+        for angle in angles:
+            results.append(angle)
+            if progress_callback is not None:
+                progress_callback(len(results), len(tasks))
         
+        for page, angle in zip(pages, results):
+            page.alignment_angle = angle
+        return results
+    
+    def get_correct_angle(self, page: Page, use_deskew_library: bool=False) -> float:
+        '''
+        Returns the alignment angle for the page, regardless of
+        the angle currently set on the page.
+        '''
+        
+        unaligned_page = copy.copy(page)
+        unaligned_page.alignment_angle = 0.0
+        img, scale = self.create_proxy_image(unaligned_page)
+        if use_deskew_library:
+            angle = self.deskew_service.get_correct_angle(img)
+        else:
+            constraint = max(1, round(SMEAR_CONSTRAINT * scale))
+            angle = self.angle_correction_service.get_correct_angle(img, constraint)
+        if angle is None or math.isnan(angle):
+            # No text lines found
+            return 0.0
+        return float(angle)
+
+    def create_proxy_image(self, page: Page) -> (Image, float):
+        '''
+        Returns a grayscale version of the page, reduced by an
+        integer factor to about the alignment resolution, and
+        the scale factor. Jpeg scans are decoded at reduced size
+        if the jpeg decoder can do (a part of) the reduction.
+        '''
+        
+        factor = max(1, round(page.source_resolution / ALIGNMENT_RESOLUTION))
+        draft_reduction = 1
+        for reduction in DRAFT_REDUCTIONS:
+            if factor % reduction == 0:
+                draft_reduction = reduction
+                break
+        draft_reduction = page.get_draft_reduction(page.source_resolution / draft_reduction)
+        img = page.get_raw_image(page.source_resolution / draft_reduction).convert("L")
+        if factor // draft_reduction > 1:
+            img = img.reduce(factor // draft_reduction)
+        return img, 1.0 / factor
+
+_worker_alignment_service = None
+
+def _get_correct_angle(task) -> float:
+    
+    global _worker_alignment_service
+    if _worker_alignment_service is None:
+        _worker_alignment_service = Injector().get(AlignmentService)
+    return _worker_alignment_service.get_correct_angle(*task)
@@ -0,0 +1,304 @@
+'''
+Command line interface to convert projects without the gui,
+for example on a render server.
+
+The input are either saved projects (.scp files) or directories
+with scans. For directories, a project is created with the same
+options the project wizard asks for. This module must not import
+anything from PySide6.
+
+The command line options (like --no-ocr) only apply to the
+conversion, project files are neither written nor changed.
+
+Several projects are converted in parallel. The available worker
+processes are split between the projects, the rest is used to
+process the pages of a project in parallel.
+
+Created on 18.10.2026
+
+@author: michael
+'''
+import argparse
+import os
+import sys
+import time
+
+from injector import Injector, singleton, inject
+
+from Asb.ScanConvert2.Algorithms import AlgorithmModule
+from Asb.ScanConvert2.Instrumentation import tracer
+from Asb.ScanConvert2.ProcessPool import create_executor, set_max_workers, \
+    get_max_workers
+from Asb.ScanConvert2.ProjectGenerator import SortType
+from Asb.ScanConvert2.ScanConvertDomain import Scan, MetaData, Project
+from Asb.ScanConvert2.ScanConvertServices import ProjectService
+
+SCAN_FILE_EXTENSIONS = (".tif", ".tiff", ".jpg", ".jpeg", ".png")
+
+EXPORT_PDF = "pdf"
+EXPORT_TIF = "tif"
+EXPORT_DDF = "ddf"
+
+# The tif and the ddf export both create zip files
+OUTPUT_FILE_SUFFIXES = {
+    EXPORT_PDF: ".pdf",
+    EXPORT_TIF: "_tif.zip",
+    EXPORT_DDF: ".zip"
+}
+
+class ProjectOptions(object):
+    '''
+    The options the project wizard asks for, used
+    to create a project from a scan directory
+    '''
+
+    def __init__(self,
+                 pages_per_scan: int=1,
+                 sort_type: SortType=SortType.STRAIGHT,
+                 scan_rotation: int=0,
+                 rotation_alternating: bool=False,
+                 cropping: bool=False,
+                 default_resolution: int=300):
+
+        self.pages_per_scan = pages_per_scan
+        self.sort_type = sort_type
+        self.scan_rotation = scan_rotation
+        self.rotation_alternating = rotation_alternating
+        self.cropping = cropping
+        self.default_resolution = default_resolution
+
+class ConversionTask(object):
+    '''
+    Everything a worker process needs to know to
+    convert a single project
+    '''
+
+    def __init__(self, input_path: str, exports: [], project_options: ProjectOptions,
+                 output_dir: str=None, run_ocr: bool=True, create_pdfa: bool=True,
+                 trace_dir: str=None, max_workers: int=1):
+
+        self.input_path = input_path
+        self.exports = exports
+        self.project_options = project_options
+        self.output_dir = output_dir
+        self.run_ocr = run_ocr
+        self.create_pdfa = create_pdfa
+        self.trace_dir = trace_dir
+        self.max_workers = max_workers
+
+class ConversionResult(object):
+
+    def __init__(self, input_path: str, no_of_pages: int=0, seconds: float=0.0, error: str=None):
+
+        self.input_path = input_path
+        self.no_of_pages = no_of_pages
+        self.seconds = seconds
+        self.error = error
+
+    def _get_pages_per_second(self):
+
+        if self.seconds == 0:
+            return 0.0
+        return self.no_of_pages / self.seconds
+
+    def __str__(self):
+
+        if self.error is not None:
+            return "%s: Fehler: %s" % (self.input_path, self.error)
+        return "%s: %d Seiten in %.1f s (%.2f Seiten/s)" % (self.input_path,
+                                                            self.no_of_pages,
+                                                            self.seconds,
+                                                            self.pages_per_second)
+
+    pages_per_second = property(_get_pages_per_second)
+
+@singleton
+class ProjectConverter(object):
+    '''
+    Loads or creates a single project and runs the exports
+    '''
+
+    @inject
+    def __init__(self, project_service: ProjectService):
+
+        self.project_service = project_service
+
+    def convert(self, task: ConversionTask) -> ConversionResult:
+
+        start = time.perf_counter()
+        project = self.get_project(task)
+        project.project_properties.run_ocr = project.project_properties.run_ocr and task.run_ocr
+        project.project_properties.create_pdfa = project.project_properties.create_pdfa and task.create_pdfa
+        for export in task.exports:
+            file_name = self.get_output_file(task, export)
+            if export == EXPORT_PDF:
+                self.project_service.export_pdf(project, file_name, save_project=False)
+            elif export == EXPORT_TIF:
+                self.project_service.export_tif(project, file_name)
+            elif export == EXPORT_DDF:
+                self.project_service.export_ddf(project, file_name)
+            else:
+                raise Exception("Unknown export %s" % export)
+        return ConversionResult(task.input_path, len(project.pages), time.perf_counter() - start)
+
+    def get_project(self, task: ConversionTask) -> Project:
+
+        if os.path.isdir(task.input_path):
+            return self.create_project(task.input_path, task.project_options)
+        return self.project_service.load_project(task.input_path)
+
+    def create_project(self, scan_dir: str, options: ProjectOptions) -> Project:
+
+        scans = []
+        for file_name in sorted(os.listdir(scan_dir)):
+            if os.path.splitext(file_name)[1].lower() not in SCAN_FILE_EXTENSIONS:
+                continue
+            scan = Scan(os.path.join(scan_dir, file_name))
+            if scan.resolution is None:
+                scan.resolution = options.default_resolution
+            scans.append(scan)
+        if len(scans) == 0:
+            raise Exception("Keine Scans in %s gefunden" % scan_dir)
+
+        project = self.project_service.create_project(scans,
+                                                      options.pages_per_scan,
+                                                      options.sort_type,
+                                                      options.scan_rotation,
+                                                      options.rotation_alternating,
+                                                      options.cropping)
+        project.metadata = MetaData()
+        project.metadata.title = os.path.basename(os.path.normpath(scan_dir))
+        project.metadata.subject = "Alle Rechte an diesem Digitalisat liegen beim\nArchiv Soziale Bewegungen e.V., Freiburg"
+        return project
+
+    def get_output_file(self, task: ConversionTask, export: str) -> str:
+
+        file_base = os.path.normpath(task.input_path)
+        if file_base[-4:] == ".scp":
+            file_base = file_base[:-4]
+        file_name = file_base + OUTPUT_FILE_SUFFIXES[export]
+        if task.output_dir is not None:
+            file_name = os.path.join(task.output_dir, os.path.basename(file_name))
+        return file_name
+
+def split_workers(no_of_projects: int, max_workers: int) -> (int, int):
+    '''
+    Returns the number of projects to convert in parallel and
+    the number of worker processes every project may use.
+    '''
+
+    project_workers = max(1, min(max_workers, no_of_projects))
+    return project_workers, max(1, max_workers // project_workers)
+
+def convert_projects(tasks: [], max_workers: int=None, result_callback=None) -> []:
+    '''
+    Converts all projects and returns the results in the
+    order of the tasks. The result callback is called as
+    soon as a project is finished.
+    '''
+
+    if max_workers is None:
+        max_workers = get_max_workers()
+    project_workers, page_workers = split_workers(len(tasks), max_workers)
+    for task in tasks:
+        task.max_workers = page_workers
+
+    if project_workers == 1:
+        results = []
+        for task in tasks:
+            results.append(_convert_project(task))
+            if result_callback is not None:
+                result_callback(results[-1])
+        return results
+
+    executor = create_executor(project_workers)
+    try:
+        futures = [executor.submit(_convert_project, task) for task in tasks]
+        if result_callback is not None:
+            for future in futures:
+                future.add_done_callback(lambda future: result_callback(future.result()))
+        return [future.result() for future in futures]
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def _convert_project(task: ConversionTask) -> ConversionResult:
+    '''
+    Runs in a worker process (or in the main process if
+    there is just one project at a time)
+    '''
+
+    set_max_workers(task.max_workers)
+    if task.trace_dir is not None:
+        tracer.trace_dir = task.trace_dir
+    converter = Injector([AlgorithmModule]).get(ProjectConverter)
+    try:
+        return converter.convert(task)
+    except Exception as e:
+        return ConversionResult(task.input_path, error="%s" % e)
+
+def create_argument_parser() -> argparse.ArgumentParser:
+
+    parser = argparse.ArgumentParser(description="Konvertiert Scan-Convert-Projekte ohne grafische Oberfläche.")
+    parser.add_argument("inputs", nargs="+", metavar="PROJEKT",
+                        help="Projektdatei (.scp) oder Verzeichnis mit Scans")
+    parser.add_argument("--pdf", dest="exports", action="append_const", const=EXPORT_PDF,
+                        help="Pdf-Datei erzeugen (Voreinstellung)")
+    parser.add_argument("--tif", dest="exports", action="append_const", const=EXPORT_TIF,
+                        help="Tif-Archiv erzeugen (Dateiname endet auf _tif.zip)")
+    parser.add_argument("--ddf", dest="exports", action="append_const", const=EXPORT_DDF,
+                        help="DDF-Archiv erzeugen")
+    parser.add_argument("--output-dir", default=None,
+                        help="Verzeichnis für die erzeugten Dateien (Voreinstellung: neben der Eingabe)")
+    parser.add_argument("--workers", type=int, default=get_max_workers(),
+                        help="Anzahl der Prozesse (Voreinstellung: Anzahl der Prozessorkerne)")
+    parser.add_argument("--no-ocr", dest="run_ocr", action="store_false",
+                        help="Keine Texterkennung durchführen")
+    parser.add_argument("--no-pdfa", dest="create_pdfa", action="store_false",
+                        help="Pdf-Dateien nicht nach PDF/A konvertieren")
+    parser.add_argument("--trace-dir", default=None,
+                        help="Verzeichnis, in das für jeden Export eine Zeitmessung im Chrome-Trace-Format geschrieben wird")
+
+    wizard = parser.add_argument_group("Optionen für Scan-Verzeichnisse")
+    wizard.add_argument("--pages-per-scan", type=int, choices=(1, 2), default=1,
+                        help="Seiten pro Scan")
+    wizard.add_argument("--sort-type", choices=[sort_type.name for sort_type in SortType],
+                        default=SortType.STRAIGHT.name, help="Sortierung der Scans")
+    wizard.add_argument("--rotation", type=int, choices=(0, 90, 180, 270), default=0,
+                        help="Drehung der Scans")
+    wizard.add_argument("--alternating", action="store_true",
+                        help="Drehung ist alternierend")
+    wizard.add_argument("--crop", action="store_true",
+                        help="Scans müssen zugeschnitten werden")
+    wizard.add_argument("--resolution", type=int, default=300,
+                        help="Auflösung für Scans ohne Auflösungsangabe")
+    return parser
+
+def main(argv=None) -> int:
+
+    args = create_argument_parser().parse_args(argv)
+    exports = args.exports
+    if exports is None:
+        exports = [EXPORT_PDF]
+    project_options = ProjectOptions(args.pages_per_scan,
+                                     SortType[args.sort_type],
+                                     args.rotation,
+                                     args.alternating,
+                                     args.crop,
+                                     args.resolution)
+    tasks = [ConversionTask(input_path, exports, project_options, args.output_dir,
+                            args.run_ocr, args.create_pdfa, args.trace_dir)
+             for input_path in args.inputs]
+
+    start = time.perf_counter()
+    results = convert_projects(tasks, max(1, args.workers), lambda result: print(result, flush=True))
+    seconds = time.perf_counter() - start
+
+    no_of_pages = sum([result.no_of_pages for result in results])
+    print("Insgesamt: %d Seiten in %.1f s (%.2f Seiten/s)" % (no_of_pages, seconds, no_of_pages / seconds))
+    if len([result for result in results if result.error is not None]) > 0:
+        return 1
+    return 0
+
+if __name__ == '__main__':
+
+    sys.exit(main())
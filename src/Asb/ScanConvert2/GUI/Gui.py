@@ -3,10 +3,7 @@ Created on 06.11.2022
 
 @author: michael
 '''
-import os
-import shutil
 import sys
-import tempfile
 
 from PIL import Image
 from PySide6.QtCore import Qt
@@ -15,7 +12,7 @@ from PySide6.QtWidgets import \
     QVBoxLayout, QLabel, QPushButton, QHBoxLayout, \
     QMainWindow, \
     QWidget, QApplication, QComboBox, QFileDialog, QGroupBox, \
-    QButtonGroup, QRadioButton, QCheckBox
+    QButtonGroup, QRadioButton, QCheckBox, QMessageBox
 from injector import inject, Injector, singleton
 
 from Asb.ScanConvert2.Algorithms import Algorithm, AlgorithmModule
@@ -23,13 +20,18 @@ from Asb.ScanConvert2.GUI.Dialogs import MetadataDialog, PropertiesDialog, \
     DDFMetadataDialog, RotationDialog
 from Asb.ScanConvert2.GUI.PageView import PageView
 from Asb.ScanConvert2.GUI.ProjectWizard import ProjectWizard
-from Asb.ScanConvert2.GUI.TaskRunner import TaskManager, JobDefinition
+from Asb.ScanConvert2.GUI.TaskRunner import TaskManager, JobDefinition, \
+    JobPriority, JobStatus, export_pdf, export_ddf, export_tif, align_pages, \
+    create_final_image
 from Asb.ScanConvert2.ScanConvertDomain import Project, \
     Page, NoPagesInProjectException, \
     NoRegionsOnPageException, MetaData
 from Asb.ScanConvert2.ScanConvertServices import ProjectService, \
     FinishingService, OCRService
-from Asb.ScanConvert2.AngleCorrection import AngleCorrectionService, DeskewService
+from Asb.ScanConvert2.AngleCorrection import AlignmentService
+from Asb.ScanConvert2.LivePreview import LivePreviewer
+from Asb.ScanConvert2.PagePrefetcher import PagePrefetcher
+from Asb.ScanConvert2.PreviewPyramid import PreviewPyramid
 
 CREATE_REGION = "Region anlegen"
 APPLY_REGION = "Auswahl übernehmen"
@@ -53,26 +55,13 @@ class FehPreviewer(object):
     @inject
     def __init__(self, finishing_service: FinishingService):
         
-        self.feh = shutil.which("feh")
         self.finishing_service = finishing_service
         
-    def show(self, page: Page, resolution: int):
-        
-        img, _ = self.finishing_service.create_final_image(page, [], resolution)
-        tmp_file = tempfile.NamedTemporaryFile(mode="wb", suffix=".png")
-        img.save(tmp_file, format="png")
-        os.system("%s %s" % (self.feh, tmp_file.name))
-        tmp_file.close()
-
     def export(self, page: Page, resolution: int, file_name: str):
         
         img, _ = self.finishing_service.create_final_image(page, [], resolution)
         img.save(file_name, format="png")
 
-    def is_working(self):
-        
-        return self.feh is not None
-
 class BaseWindow(QMainWindow):
 
     def __init__(self):
@@ -157,6 +146,9 @@ class BaseWindow(QMainWindow):
         self.edit_properties_action.setShortcut('Ctrl+E')
         self.edit_properties_action.setStatusTip('Projekteinstellungen bearbeiten')
 
+        self.cancel_tasks_action = QAction(QIcon('any.png'), 'Aufgaben &abbrechen', self)
+        self.cancel_tasks_action.setStatusTip('Alle wartenden und laufenden Aufgaben abbrechen')
+
         menubar = self.menuBar()
         fileMenu = menubar.addMenu('&Datei')
         fileMenu.addAction(self.new_project_action)
@@ -175,6 +167,7 @@ class BaseWindow(QMainWindow):
         exportMenu.addAction(self.ddf_export_action)
         exportMenu.addAction(self.edit_metadata_action)
         exportMenu.addAction(self.edit_properties_action)
+        exportMenu.addAction(self.cancel_tasks_action)
         
     def _create_left_panel(self):
         
@@ -193,6 +186,7 @@ class BaseWindow(QMainWindow):
         left_panel.addWidget(self.skip_page_checkbox)
 
         self.preview_button = QPushButton("Vorschau")
+        self.preview_button.setCheckable(True)
         left_panel.addWidget(self.preview_button)
 
         self.preview_export_button = QPushButton("Vorschau exportieren")
@@ -361,23 +355,32 @@ class Window(BaseWindow):
     @inject
     def __init__(self,
                  project_service: ProjectService,
-                 angle_correction_service: AngleCorrectionService,
-                 deskew_service: DeskewService,
+                 alignment_service: AlignmentService,
                  ocr_service: OCRService,
                  task_manager: TaskManager,
-                 previewer: FehPreviewer):
+                 previewer: FehPreviewer,
+                 preview_pyramid: PreviewPyramid,
+                 page_prefetcher: PagePrefetcher,
+                 live_previewer: LivePreviewer):
 
         super().__init__()
         
         self.project = None
         self.region_mode = not REGION_SELECT_MODE
         self.project_service = project_service
-        self.angle_correction_service = angle_correction_service
-        self.deskew_service = deskew_service
+        self.alignment_service = alignment_service
         self.ocr_service = ocr_service
         self.task_manager = task_manager
-        self.task_manager.message_function = self.show_job_status
+        self.task_manager.status_changed.connect(self.show_job_status)
+        self.task_manager.job_finished.connect(self.show_job_error)
         self.previewer = previewer
+        self.preview_pyramid = preview_pyramid
+        self.page_prefetcher = page_prefetcher
+        self.live_previewer = live_previewer
+        self.refinement_job = None
+        self.refinement_key = None
+        self.pending_refinement = None
+        self.task_manager.job_finished.connect(self._refinement_finished)
         self.metadata_dialog = MetadataDialog(self)
         self.ddf_metadata_dialog = DDFMetadataDialog(self)
         self.properties_dialog = PropertiesDialog(self)
@@ -387,7 +390,7 @@ class Window(BaseWindow):
         self.setWindowTitle("Scan-Kovertierer")
         self._attach_callbacks()
         
-        self.task_manager.message_function()
+        self.show_job_status()
         
         self.update_gui()
         
@@ -408,10 +411,11 @@ class Window(BaseWindow):
         self.tif_export_action.triggered.connect(self.cb_export_tif)
         self.edit_metadata_action.triggered.connect(self.cb_edit_metadata)
         self.edit_properties_action.triggered.connect(self.cb_edit_properties)
+        self.cancel_tasks_action.triggered.connect(self.task_manager.cancel_all_tasks)
 
         # Left panel main
         self.skip_page_checkbox.clicked.connect(self.cb_toggle_skip_page)
-        self.preview_button.clicked.connect(self.cb_preview_current_page)
+        self.preview_button.toggled.connect(self.cb_preview_current_page)
         self.preview_export_button.clicked.connect(self.cb_preview_export_current_page)
             
         # Left panel, page scroller
@@ -487,25 +491,27 @@ class Window(BaseWindow):
         
         self.project = project
         self.project.first_page()
+        self.page_prefetcher.clear()
+        self.preview_pyramid.build_all([page.scan for page in self.project.pages])
         
     def cb_align_page(self):
         
         if self.project.current_page.alignment_angle != 0.0:
             self.project.current_page.alignment_angle = 0.0
         else:
-            img = self.project.current_page.get_raw_image()
-            try:
-                if self.project.project_properties.deskew_library:
-                    pass
-            except AttributeError:
-                self.project.project_properties.deskew_library = False
-            if self.project.project_properties.deskew_library:
-                angle = self.deskew_service.get_correct_angle(img)
-            else:
-                angle = self.angle_correction_service.get_correct_angle(img)
+            angle = self.alignment_service.get_correct_angle(self.project.current_page,
+                                                             self._use_deskew_library())
             self.project.current_page.alignment_angle = angle
         self.update_gui()
         
+    def _use_deskew_library(self):
+        
+        try:
+            return self.project.project_properties.deskew_library
+        except AttributeError:
+            self.project.project_properties.deskew_library = False
+            return False
+        
     def cb_dewarp_page(self):
         
         self.project.current_page.dewarp = not self.project.current_page.dewarp
@@ -513,9 +519,22 @@ class Window(BaseWindow):
         
     def cb_align_all_pages(self):
         
-        for page in self.project.pages:
-            img = page.get_raw_image()
-            angle = self.angle_correction_service.get_correct_angle(img)
+        # The job works on copies of the pages, so
+        # we set the angles when it is finished
+        pages = self.project.pages
+        job = JobDefinition(
+            self,
+            align_pages,
+            (pages, self._use_deskew_library()),
+            post_job_method=lambda angles: self._set_alignment_angles(pages, angles),
+            priority=JobPriority.HIGH,
+            description="Ausrichten"
+        )
+        self.task_manager.add_task(job)
+        
+    def _set_alignment_angles(self, pages, angles):
+        
+        for page, angle in zip(pages, angles):
             page.alignment_angle = angle
         self.update_gui()
         
@@ -541,7 +560,9 @@ class Window(BaseWindow):
         if file_name[0] != "":
             job = JobDefinition(
                 self,
-                lambda: self.project_service.export_pdf(self.project, file_name[0])
+                export_pdf,
+                (self.project, file_name[0]),
+                description="Pdf-Export"
             )
             self.task_manager.add_task(job)
             
@@ -557,7 +578,9 @@ class Window(BaseWindow):
         if file_name[0] != "":
             job = JobDefinition(
                 self,
-                lambda: self.project_service.export_ddf(self.project, file_name[0])
+                export_ddf,
+                (self.project, file_name[0]),
+                description="DDF-Export"
             )
             self.task_manager.add_task(job)
 
@@ -574,7 +597,9 @@ class Window(BaseWindow):
         if file_name[0] != "":
             job = JobDefinition(
                 self,
-                lambda: self.project_service.export_tif(self.project, file_name[0])
+                export_tif,
+                (self.project, file_name[0]),
+                description="Tiff-Export"
             )
             self.task_manager.add_task(job)
     
@@ -616,10 +641,9 @@ class Window(BaseWindow):
 
     def cb_preview_current_page(self):
         
-        try:
-            self.previewer.show(self.project.current_page, self.project.project_properties.pdf_resolution)
-        except NoPagesInProjectException:
-            pass
+        if self.project is None:
+            return
+        self.update_gui()
 
     def cb_preview_export_current_page(self):
         
@@ -660,8 +684,9 @@ class Window(BaseWindow):
             return
         combo_box = self.sender()
         for algo in Algorithm:
-            if combo_box.currentText() == "%s" % algo:
+            if combo_box.currentText() == "%s" % algo and current_page.main_region.mode_algorithm != algo:
                 current_page.main_region.mode_algorithm = algo
+                self._update_preview()
 
     def cb_change_rotation(self):
         
@@ -702,8 +727,9 @@ class Window(BaseWindow):
             
         combo_box = self.sender()
         for algo in Algorithm:
-            if combo_box.currentText() == "%s" % algo:
+            if combo_box.currentText() == "%s" % algo and region.mode_algorithm != algo:
                 region.mode_algorithm = algo
+                self._update_preview()
     
     def cb_create_save_region(self):
         
@@ -811,7 +837,19 @@ class Window(BaseWindow):
         
         total = len(self.task_manager.finished_tasks) + len(self.task_manager.unfinished_tasks)
         unfinished = len(self.task_manager.unfinished_tasks)
-        self.task_label.setText("<b>Status:</b><br/>Unvollendete Aufgaben: %d<br/>Aufgaben ingesamt: %d" % (unfinished, total))
+        text = "<b>Status:</b><br/>Unvollendete Aufgaben: %d<br/>Aufgaben ingesamt: %d" % (unfinished, total)
+        for job in self.task_manager.running_tasks:
+            if job.progress is None:
+                text += "<br/>%s läuft" % job.description
+            else:
+                text += "<br/>%s: %d von %d" % (job.description, job.progress[0], job.progress[1])
+        self.task_label.setText(text)
+        
+    def show_job_error(self, job: JobDefinition):
+        
+        if job.status != JobStatus.FAILED:
+            return
+        QMessageBox.warning(self, "Fehler", "%s ist fehlgeschlagen:\n%s" % (job.description, job.error))
         
     def reset_region(self):
         
@@ -843,14 +881,123 @@ class Window(BaseWindow):
         if self.current_page.additional_rotation_angle != self._get_rotation():
             self._set_rotation(self.current_page.additional_rotation_angle)
         
-        img = self.current_page.get_raw_image()
-        self.graphics_view.set_page(img)
+        page = self.current_page
+        if self.preview_button.isChecked():
+            final_resolution = self.project.project_properties.pdf_resolution
+            self.graphics_view.show_page(lambda resolution: self._get_preview_image(page, resolution, final_resolution),
+                                         page.size, page.source_resolution, final_resolution)
+        else:
+            self._cancel_preview_refinement()
+            self.graphics_view.show_page(lambda resolution: self._get_page_image(page, resolution),
+                                         page.size, page.source_resolution)
 
         for idx in range(0, self.main_algo_select.count()):
             if self.main_algo_select.itemText(idx) == "%s" % self.current_page.main_region.mode_algorithm:
                 self.main_algo_select.setCurrentIndex(idx)
                 break
 
+    def _get_page_image(self, page: Page, resolution: float):
+        """
+        While the operator looks at the page, the
+        neighbouring pages are prepared in the background
+        """
+        
+        img = self.page_prefetcher.get_page_image(page, resolution)
+        self.page_prefetcher.prefetch(self.project.pages, self.project.current_page_no, resolution)
+        return img
+
+    def _get_preview_image(self, page: Page, resolution: float, final_resolution: int):
+        """
+        The algorithms run on a reduced page first, the
+        final image is rendered in the background
+        """
+        
+        img = self.live_previewer.create_preview(page, resolution, final_resolution)
+        self.page_prefetcher.prefetch(self.project.pages, self.project.current_page_no,
+                                      self.live_previewer.get_preview_resolution(page, resolution, final_resolution))
+        if self.live_previewer.needs_refinement(page, resolution, final_resolution):
+            self._refine_preview(page, final_resolution)
+        return img
+
+    def _refine_preview(self, page: Page, final_resolution: int):
+        """
+        At most one refinement is in flight: A running refinement
+        for another page (or another state of the page) is
+        cancelled and the new one waits until it has stopped, so
+        flipping through the pages does not fill up the workers
+        """
+        
+        key = (self.live_previewer.get_page_key(page), final_resolution)
+        if self.refinement_job is not None and self.pending_refinement is None and \
+                self.refinement_key == key and self.refinement_job in self.task_manager.unfinished_tasks:
+            return
+        if self.refinement_job is not None and self.refinement_job.status == JobStatus.RUNNING:
+            self.task_manager.cancel_task(self.refinement_job)
+            self.pending_refinement = (page, final_resolution)
+            return
+        self._cancel_preview_refinement()
+        self.refinement_key = key
+        self.refinement_job = JobDefinition(
+            self,
+            create_final_image,
+            (page, final_resolution),
+            post_job_method=lambda img: self._show_refined_preview(page, key, img),
+            priority=JobPriority.HIGH,
+            description="Vorschau"
+        )
+        self.task_manager.add_task(self.refinement_job)
+
+    def _show_refined_preview(self, page: Page, key, img):
+        """
+        Only if the operator still looks at the same page
+        """
+        
+        if self.project is None or not self.preview_button.isChecked():
+            return
+        try:
+            if self.current_page is not page:
+                return
+        except NoPagesInProjectException:
+            return
+        if (self.live_previewer.get_page_key(page), self.project.project_properties.pdf_resolution) != key:
+            return
+        self.graphics_view.refine_page(img)
+
+    def _refinement_finished(self, job: JobDefinition):
+        """
+        Starts the refinement that waited for the running one
+        """
+        
+        if job is not self.refinement_job:
+            return
+        self.refinement_job = None
+        self.refinement_key = None
+        if self.pending_refinement is None:
+            return
+        page, final_resolution = self.pending_refinement
+        self.pending_refinement = None
+        if self.project is None or not self.preview_button.isChecked():
+            return
+        try:
+            if self.current_page is not page:
+                return
+        except NoPagesInProjectException:
+            return
+        self._refine_preview(page, final_resolution)
+
+    def _cancel_preview_refinement(self):
+        
+        if self.refinement_job is not None:
+            self.task_manager.cancel_task(self.refinement_job)
+        self.refinement_job = None
+        self.refinement_key = None
+        self.pending_refinement = None
+
+    def _update_preview(self):
+        
+        if self.preview_button.isChecked():
+            self.show_page()
+
     def update_gui(self):
 
         if self.project is None:
@@ -1006,4 +1153,6 @@ if __name__ == '__main__':
     injector = Injector(AlgorithmModule)
     win = injector.get(Window)
     win.show()
-    sys.exit(app.exec())
+    exit_code = app.exec()
+    injector.get(TaskManager).shutdown()
+    sys.exit(exit_code)
@@ -77,22 +77,81 @@ class PageView(QGraphicsView, PageViewBase):
         
         QGraphicsView.__init__(self)
         self.img = None
+        self.page_size = None
+        self.page_loader = None
+        self.source_resolution = None
+        self.max_resolution = None
         self.img_region_cache = None
         self.rubberBand = QRubberBand(QRubberBand.Shape.Rectangle, self)
         self.reset_rubberband()
         self.region_select = False
 
-    def set_page(self, img: Image):
+    def show_page(self, page_loader, page_size: (int, int), source_resolution: float, max_resolution: float=None):
+        """
+        The page loader gets the resolution the view needs and
+        returns the page image in at least this resolution (a
+        level of the preview pyramid). When the view grows beyond
+        the resolution of the image, a larger one is loaded, up
+        to the maximum resolution (the source resolution if not
+        given).
+        """
+        
+        self.source_resolution = source_resolution
+        self.max_resolution = max_resolution
+        if self.max_resolution is None:
+            self.max_resolution = source_resolution
+        self.set_page(page_loader(self._get_needed_resolution(page_size)), page_size, page_loader)
 
-        self.img = img
+    def set_page(self, img: Image, page_size: (int, int)=None, page_loader=None):
+        """
+        The image may be a reduced version of the page, then
+        the page size is needed to calculate the regions
+        """
+
+        self.page_loader = page_loader
+        self.page_size = page_size
+        if self.page_size is None:
+            self.page_size = img.size
         self.region_cache = None
+        self._set_image(img)
+        self.reset_rubberband()
+
+    def _set_image(self, img: Image):
+
+        self.img = img
         pixmap = QPixmap(ImageQt(self.img))
         self.scene = QGraphicsScene()
         self.scene.addPixmap(pixmap)
         self.invalidateScene()
         self.setScene(self.scene)
         self.fitInView(self.image_rectangle, Qt.AspectRatioMode.KeepAspectRatio)
-        self.reset_rubberband()
+
+    def _get_needed_resolution(self, page_size: (int, int)) -> float:
+        
+        if self.source_resolution is None or min(page_size) <= 0:
+            return None
+        geometry = self.geometry()
+        ratio = min(geometry.width() / page_size[0], geometry.height() / page_size[1])
+        return self.source_resolution * ratio * self.devicePixelRatioF()
+    
+    def _load_larger_image(self):
+
+        needed_resolution = self._get_needed_resolution(self.page_size)
+        if needed_resolution is None:
+            return
+        img_resolution = self.source_resolution * self.img.width / self.page_size[0]
+        if img_resolution < min(needed_resolution, self.max_resolution * 0.99):
+            self._set_image(self.page_loader(needed_resolution))
+
+    def refine_page(self, img: Image):
+        """
+        Replaces the image of the page with a better one,
+        the selection stays as it is
+        """
+        
+        self._set_image(img)
+        if self.img_region_cache is not None:
+            self.show_region(self.img_region_cache)
 
     def reset_rubberband(self):
         
@@ -120,7 +179,7 @@ class PageView(QGraphicsView, PageViewBase):
 
     def _get_page_img_size(self):
         
-        return self.img.size
+        return self.page_size
     
     def mousePressEvent(self, event):
 
@@ -142,6 +201,8 @@ class PageView(QGraphicsView, PageViewBase):
     def resizeEvent(self, *args, **kwargs):
         super().resizeEvent(*args, **kwargs)
         if self.img is not None:
+            if self.page_loader is not None:
+                self._load_larger_image()
             self.fitInView(self.image_rectangle, Qt.AspectRatioMode.KeepAspectRatio)
             if self.img_region_cache is not None:
                 self.show_region(self.img_region_cache)
@@ -1,114 +1,387 @@
 '''
 Created on 31.12.2022
 
-This module separates the running of export tasks into a
-worker thread so the user can work on and create more tasks
+This module separates the running of export tasks into worker
+processes so the user can work on and create more tasks
 while the current tasks are running.
 
+Jobs are run in a process pool, several at a time, ordered
+by their priority. The job functions and their arguments are
+sent to the worker processes, so they must be picklable: Job
+functions are defined on module level and get copies of the
+project, not the project the user is working on. The results
+are sent back and handed to the post job method, which is
+called in the gui thread.
+
+If a worker process dies (e.g. killed for using too much memory),
+the pool is broken: The running jobs fail and a new pool is
+created for the next jobs.
+
 @author: michael
 '''
-from enum import Enum
-import traceback
+from concurrent.futures.process import BrokenProcessPool
+from enum import Enum, IntEnum
+import heapq
+import itertools
+import logging
+from multiprocessing import get_context
+import threading
+
+from injector import singleton, inject, Injector
 
-from injector import singleton, inject
+from Asb.ScanConvert2.Algorithms import AlgorithmModule
+from Asb.ScanConvert2.AngleCorrection import AlignmentService
+from Asb.ScanConvert2.ProcessPool import create_executor, get_max_workers, \
+    set_max_workers
+from Asb.ScanConvert2.ScanConvertServices import ProjectService, \
+    FinishingService
+from PySide6.QtCore import QObject, Signal
 
-from Asb.ScanConvert2.PictureDetector import PictureDetector
-from Asb.ScanConvert2.ScanConvertServices import ProjectService
-from PySide6.QtCore import QThread
+logger = logging.getLogger(__name__)
 
+# Every job uses worker processes itself, so
+# we do not run too many of them at once
+DEFAULT_MAX_JOBS = 2
 
 class TaskType(Enum):
-    
+
     PDF_EXPORT = 0
     TIFF_EXPORT = 1
     PHOTO_DETECTION = 2
 
+class JobPriority(IntEnum):
+
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+class JobStatus(Enum):
+
+    WAITING = 0
+    RUNNING = 1
+    FINISHED = 2
+    FAILED = 3
+    CANCELLED = 4
+
+class JobCancelledException(Exception):
+
+    pass
+
 class JobDefinition():
     '''
-    A simple container class wrapping the project, the output file / directory
-    and the task type at hand
+    A simple container class wrapping the job function, its arguments
+    and the methods to call in the gui thread before the job is
+    queued and with the result after it has finished. The job function
+    gets a progress reporter as first argument.
     '''
-    
+
     def __init__(self,
                  parent,
-                 job_method,
+                 job_function,
+                 job_args=(),
                  pre_job_method=None,
-                 post_job_method=None):
-        
+                 post_job_method=None,
+                 priority: JobPriority=JobPriority.NORMAL,
+                 description: str="Aufgabe"):
+
         self.parent = parent
-        self.job_method = job_method
+        self.job_function = job_function
+        self.job_args = job_args
         self.pre_job_method = pre_job_method
         self.post_job_method = post_job_method
+        self.priority = priority
+        self.description = description
+
+        self.job_id = None
+        self.status = JobStatus.WAITING
+        self.progress = None
+        self.result = None
+        self.error = None
+        self.future = None
+        self.cancel_event = None
+
+class ProgressReporter(object):
+    '''
+    Is handed to the job function in the worker process and sends
+    the progress back to the task manager. It also is the place
+    where a running job learns that it has been cancelled.
+    '''
+
+    def __init__(self, job_id: int, progress_queue, cancel_event):
+
+        self.job_id = job_id
+        self.progress_queue = progress_queue
+        self.cancel_event = cancel_event
+
+    def __call__(self, done: int, total: int):
+
+        self.check_cancelled()
+        self.progress_queue.put((self.job_id, done, total))
+
+    def check_cancelled(self):
+
+        if self.cancel_event.is_set():
+            raise JobCancelledException()
 
 @singleton
-class TaskManager():
-    
+class TaskManager(QObject):
+    '''
+    Runs the jobs in a process pool. The waiting jobs are kept in a
+    priority queue, the state is guarded by a lock, because the
+    pool calls back from its own thread. The gui is notified via
+    signals, so the slots are executed in the gui thread.
+    '''
+
+    status_changed = Signal()
+    job_finished = Signal(object)
 
     @inject
-    def __init__(self, project_service: ProjectService,
-                 photo_detector: PictureDetector):
-        
-        self.project_service = project_service
-        self.photo_detector = photo_detector
-        
-        self.message_function = None
-        
-        self.unfinished_tasks = []
-        self.finished_tasks = []
-        self.worker_thread_running = False
-    
+    def __init__(self):
+
+        super().__init__()
+        self.max_workers = DEFAULT_MAX_JOBS
+
+        self._lock = threading.RLock()
+        self._job_counter = itertools.count(1)
+        self._waiting_jobs = []
+        self._running_jobs = {}
+        self._finished_jobs = []
+        self._executor = None
+        self._manager = None
+        self._progress_queue = None
+        self._progress_thread = None
+
+        self.job_finished.connect(self._run_post_job_method)
+
     def add_task(self, job: JobDefinition):
-        
-        self.unfinished_tasks.append(job)
-        self.message_function()
-        if self.worker_thread_running:
-            return
-        thread = WorkerThread(self)
-        thread.start()
-            
-class WorkerThread(QThread):
-    
-    def __init__(self, task_manager: TaskManager):
-        super().__init__(task_manager.unfinished_tasks[0].parent)
-        self.task_manager = task_manager
-
-    def run_job(self, job: JobDefinition):
-        
-        try:
-            if job.pre_job_method is not None:
-                job.pre_job_method()
-            
-            job.job_method()
-            
-            if job.post_job_method is not None:
-                job.post_job_method()
-                
-        except Exception as e:
-            # TODO: Show error somewhere
-            print(e)
-            print(traceback.format_exc())
-
-    def run_photo_detection(self, job: JobDefinition):
-        
-        pass
-    
-    def convert_to_tif(self, job: JobDefinition):
-        
-        raise Exception("Not yet implemented")
-    
-    def convert_to_pdf(self, job: JobDefinition):
-        
-        self.project_service.export_pdf(job.project, job.file_base)
-        
-    def run(self):
-        
-        self.task_manager.worker_thread_running = True
-        
-        while len(self.task_manager.unfinished_tasks) > 0:
-            
-            self.run_job(self.task_manager.unfinished_tasks[0])
-            self.task_manager.finished_tasks.append(self.task_manager.unfinished_tasks[0])
-            del(self.task_manager.unfinished_tasks[0])
-            self.task_manager.message_function()
-        
-        self.task_manager.worker_thread_running = False
+
+        if job.pre_job_method is not None:
+            job.pre_job_method()
+        with self._lock:
+            job.job_id = next(self._job_counter)
+            job.status = JobStatus.WAITING
+            heapq.heappush(self._waiting_jobs, (job.priority, job.job_id, job))
+        self.status_changed.emit()
+        self._dispatch()
+
+    def cancel_task(self, job: JobDefinition):
+        '''
+        Waiting jobs are just removed. Running jobs are told to stop,
+        which they do the next time they report progress.
+        '''
+
+        with self._lock:
+            if job.status == JobStatus.WAITING:
+                self._waiting_jobs = [entry for entry in self._waiting_jobs if entry[2] is not job]
+                heapq.heapify(self._waiting_jobs)
+                job.status = JobStatus.CANCELLED
+                self._finished_jobs.append(job)
+            elif job.status == JobStatus.RUNNING:
+                job.cancel_event.set()
+        self.status_changed.emit()
+
+    def cancel_all_tasks(self):
+
+        for job in self.unfinished_tasks:
+            self.cancel_task(job)
+
+    def shutdown(self):
+
+        self.cancel_all_tasks()
+        with self._lock:
+            pool = self._detach_pool()
+        self._shutdown_pool(*pool, wait=True)
+
+    def _detach_pool(self):
+        '''
+        Must be called with the lock held. The returned pool
+        is shut down with _shutdown_pool outside the lock,
+        since the progress thread needs the lock.
+        '''
+
+        pool = (self._executor, self._manager, self._progress_queue, self._progress_thread)
+        self._executor = None
+        self._manager = None
+        self._progress_queue = None
+        self._progress_thread = None
+        return pool
+
+    def _shutdown_pool(self, executor, manager, progress_queue, progress_thread, wait: bool=False):
+
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+        if progress_thread is not None:
+            progress_queue.put(None)
+            progress_thread.join()
+        if manager is not None:
+            manager.shutdown()
+
+    def _dispatch(self):
+
+        failed_jobs = []
+        broken_pools = []
+        with self._lock:
+            while len(self._running_jobs) < self.max_workers and len(self._waiting_jobs) > 0:
+                job = heapq.heappop(self._waiting_jobs)[2]
+                try:
+                    self._start_job(job)
+                except (BrokenProcessPool, RuntimeError) as e:
+                    # The pool is not usable anymore
+                    failed_jobs.append(self._fail_job(job, e))
+                    broken_pools.append(self._detach_pool())
+        for pool in broken_pools:
+            self._shutdown_pool(*pool)
+        for job in failed_jobs:
+            self.job_finished.emit(job)
+        if len(failed_jobs) > 0:
+            self.status_changed.emit()
+
+    def _fail_job(self, job: JobDefinition, error: Exception) -> JobDefinition:
+        '''
+        Must be called with the lock held
+        '''
+
+        job.status = JobStatus.FAILED
+        job.error = error
+        self._running_jobs.pop(job.job_id, None)
+        self._finished_jobs.append(job)
+        return job
+
+    def _start_job(self, job: JobDefinition):
+
+        if self._executor is None:
+            self._manager = get_context("spawn").Manager()
+            self._progress_queue = self._manager.Queue()
+            self._progress_thread = threading.Thread(target=self._read_progress, daemon=True)
+            self._progress_thread.start()
+            self._executor = create_executor(self.max_workers)
+        job.cancel_event = self._manager.Event()
+        job.status = JobStatus.RUNNING
+        self._running_jobs[job.job_id] = job
+        page_workers = max(1, get_max_workers() // self.max_workers)
+        job.future = self._executor.submit(_run_job,
+                                          job.job_function,
+                                          job.job_args,
+                                          ProgressReporter(job.job_id, self._progress_queue, job.cancel_event),
+                                          page_workers)
+        job.future.add_done_callback(lambda future: self._job_done(job, future))
+
+    def _job_done(self, job: JobDefinition, future):
+        '''
+        Called by the process pool in its own thread
+        '''
+
+        broken_pool = None
+        finished_jobs = [job]
+        with self._lock:
+            if self._running_jobs.get(job.job_id) is not job:
+                # Already failed together with its broken pool
+                return
+            try:
+                job.result = future.result()
+                job.status = JobStatus.FINISHED
+            except JobCancelledException:
+                job.status = JobStatus.CANCELLED
+            except BrokenProcessPool as e:
+                # All running jobs are lost with the pool
+                logger.error("Ein Prozess ist abgestürzt, %d Aufgabe(n) abgebrochen", len(self._running_jobs))
+                finished_jobs = [self._fail_job(running_job, e) for running_job in list(self._running_jobs.values())]
+                broken_pool = self._detach_pool()
+            except Exception as e:
+                logger.error("%s ist fehlgeschlagen", job.description, exc_info=e)
+                job.status = JobStatus.FAILED
+                job.error = e
+            if broken_pool is None:
+                del self._running_jobs[job.job_id]
+                self._finished_jobs.append(job)
+        if broken_pool is not None:
+            self._shutdown_pool(*broken_pool)
+        self._dispatch()
+        for finished_job in finished_jobs:
+            self.job_finished.emit(finished_job)
+        self.status_changed.emit()
+
+    def _read_progress(self):
+
+        progress_queue = self._progress_queue
+        while True:
+            message = progress_queue.get()
+            if message is None:
+                return
+            job_id, done, total = message
+            with self._lock:
+                if job_id in self._running_jobs:
+                    self._running_jobs[job_id].progress = (done, total)
+            self.status_changed.emit()
+
+    def _run_post_job_method(self, job: JobDefinition):
+
+        if job.status == JobStatus.FINISHED and job.post_job_method is not None:
+            job.post_job_method(job.result)
+
+    def _get_unfinished_tasks(self):
+
+        with self._lock:
+            waiting_jobs = [entry[2] for entry in sorted(self._waiting_jobs)]
+            return list(self._running_jobs.values()) + waiting_jobs
+
+    def _get_running_tasks(self):
+
+        with self._lock:
+            return list(self._running_jobs.values())
+
+    def _get_finished_tasks(self):
+
+        with self._lock:
+            return list(self._finished_jobs)
+
+    unfinished_tasks = property(_get_unfinished_tasks)
+    running_tasks = property(_get_running_tasks)
+    finished_tasks = property(_get_finished_tasks)
+
+def _run_job(job_function, job_args, progress_reporter: ProgressReporter, page_workers: int):
+    '''
+    Runs in the worker process
+    '''
+
+    set_max_workers(page_workers)
+    progress_reporter.check_cancelled()
+    return job_function(progress_reporter, *job_args)
+
+_worker_injector = None
+
+def _get_worker_service(service_class):
+
+    global _worker_injector
+    if _worker_injector is None:
+        _worker_injector = Injector([AlgorithmModule])
+    return _worker_injector.get(service_class)
+
+def export_pdf(progress_reporter, project, file_name):
+
+    _get_worker_service(ProjectService).export_pdf(project, file_name, progress_reporter)
+
+def export_ddf(progress_reporter, project, file_name):
+
+    _get_worker_service(ProjectService).export_ddf(project, file_name, progress_reporter)
+
+def export_tif(progress_reporter, project, file_name):
+
+    _get_worker_service(ProjectService).export_tif(project, file_name, progress_reporter)
+
+def create_final_image(progress_reporter, page, resolution):
+    '''
+    For the preview, the page is just a copy. A cancelled
+    refinement stops between the rendering steps.
+    '''
+
+    img, _ = _get_worker_service(FinishingService).create_final_image(page, [], resolution,
+                                                                      check_cancelled=progress_reporter.check_cancelled)
+    return img
+
+def align_pages(progress_reporter, pages, use_deskew_library):
+    '''
+    Returns the angles, the pages here are just copies
+    '''
+
+    return _get_worker_service(AlignmentService).align_pages(pages, use_deskew_library, progress_reporter)
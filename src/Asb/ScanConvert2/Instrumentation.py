@@ -0,0 +1,214 @@
+'''
+Lightweight instrumentation of the export pipeline.
+
+The services wrap the stages of an export (decoding, the mode
+transformation algorithms, encoding, tesseract, ocrmypdf, exiftool
+and so on) in named spans. A span just records its start time and
+its duration, so it is cheap enough to be always on.
+
+The tracer is a module level object like the scan cache, because
+the domain objects record spans, too. Worker processes have their
+own tracer, the process pool sends their spans back with the
+results and merges them into the tracer of the calling process.
+
+An export is wrapped in a trace, which collects all spans recorded
+while it runs. The trace prints a summary table and may be written
+as plain json or in the Chrome trace format (chrome://tracing or
+https://ui.perfetto.dev).
+
+Created on 18.10.2026
+
+@author: michael
+'''
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+TRACE_DIR_ENVIRONMENT_VARIABLE = "SCANCONVERT_TRACE_DIR"
+
+class Span(object):
+    '''
+    A single timed stage. The start is wall clock time, so
+    spans from different processes fit together.
+    '''
+
+    def __init__(self, name: str, start: float, duration: float, pid: int, tid: int, args: {}=None):
+
+        self.name = name
+        self.start = start
+        self.duration = duration
+        self.pid = pid
+        self.tid = tid
+        self.args = args
+
+    def as_dict(self):
+
+        return {"name": self.name,
+                "start": self.start,
+                "duration": self.duration,
+                "pid": self.pid,
+                "tid": self.tid,
+                "args": self.args}
+
+    def as_chrome_event(self):
+
+        event = {"name": self.name,
+                 "cat": self.name.split(".")[0],
+                 "ph": "X",
+                 "ts": self.start * 1000000,
+                 "dur": self.duration * 1000000,
+                 "pid": self.pid,
+                 "tid": self.tid}
+        if self.args is not None:
+            event["args"] = self.args
+        return event
+
+class Trace(object):
+    '''
+    The spans recorded during an export
+    '''
+
+    def __init__(self, name: str):
+
+        self.name = name
+        self.start = time.time()
+        self.duration = None
+        self.spans = []
+
+    def get_summary(self) -> []:
+        '''
+        Returns (name, count, total seconds) for every span name,
+        the most expensive first
+        '''
+
+        totals = {}
+        for span in self.spans:
+            count, total = totals.get(span.name, (0, 0.0))
+            totals[span.name] = (count + 1, total + span.duration)
+        summary = [(name, count, total) for name, (count, total) in totals.items()]
+        summary.sort(key=lambda entry: entry[2], reverse=True)
+        return summary
+
+    def format_summary(self) -> str:
+        '''
+        The share is relative to the wall clock time of the
+        trace. With worker processes and nested spans the
+        shares add up to more than 100%.
+        '''
+
+        duration = self.duration
+        if duration is None:
+            duration = time.time() - self.start
+        lines = ["%s: %.2f s" % (self.name, duration),
+                 "%-32s %7s %10s %10s %8s" % ("Stage", "Count", "Total s", "Mean ms", "Share")]
+        for name, count, total in self.get_summary():
+            share = 0.0
+            if duration > 0:
+                share = 100.0 * total / duration
+            lines.append("%-32s %7d %10.2f %10.1f %7.1f%%" % (name, count, total, 1000.0 * total / count, share))
+        return "\n".join(lines)
+
+    def write_json(self, file_name: str):
+
+        with open(file_name, "w") as file:
+            json.dump({"name": self.name,
+                       "start": self.start,
+                       "duration": self.duration,
+                       "spans": [span.as_dict() for span in self.spans]}, file)
+
+    def write_chrome_trace(self, file_name: str):
+
+        with open(file_name, "w") as file:
+            json.dump({"traceEvents": [span.as_chrome_event() for span in self.spans],
+                       "displayTimeUnit": "ms"}, file)
+
+class Tracer(object):
+    '''
+    Spans are only kept while a trace is running or while
+    spans are collected, otherwise they are dropped. So the
+    tracer does not grow when the gui renders pages.
+    '''
+
+    def __init__(self):
+
+        self.trace_dir = os.environ.get(TRACE_DIR_ENVIRONMENT_VARIABLE)
+        self._lock = threading.Lock()
+        self._spans = []
+        self._no_of_recorders = 0
+
+    @contextmanager
+    def span(self, name: str, **args):
+
+        start = time.time()
+        start_counter = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start_counter
+            if len(args) == 0:
+                args = None
+            self.add_spans([Span(name, start, duration, os.getpid(), threading.get_ident(), args)])
+
+    @contextmanager
+    def trace(self, name: str, print_summary: bool=True):
+        '''
+        Collects all spans recorded in the block. When the block
+        is finished, the summary is printed and, if there is a trace
+        directory, the trace is written in the Chrome format.
+        '''
+
+        trace = Trace(name)
+        first_span = self._start_recording()
+        try:
+            with self.span(name):
+                yield trace
+        finally:
+            trace.spans = self._stop_recording(first_span)
+            trace.duration = time.time() - trace.start
+            if print_summary:
+                print(trace.format_summary(), flush=True)
+            if self.trace_dir is not None:
+                os.makedirs(self.trace_dir, exist_ok=True)
+                trace.write_chrome_trace(os.path.join(self.trace_dir, "%s-%d-%d.json" % (
+                    name.replace(" ", "_"), os.getpid(), int(trace.start))))
+
+    def add_spans(self, spans: []):
+
+        with self._lock:
+            if self._no_of_recorders > 0:
+                self._spans.extend(spans)
+
+    @contextmanager
+    def collect(self):
+        '''
+        Used in worker processes: Hands out the spans recorded
+        in the block and removes them from the tracer.
+        '''
+
+        spans = []
+        first_span = self._start_recording()
+        try:
+            yield spans
+        finally:
+            spans.extend(self._stop_recording(first_span, remove=True))
+
+    def _start_recording(self) -> int:
+
+        with self._lock:
+            self._no_of_recorders += 1
+            return len(self._spans)
+
+    def _stop_recording(self, first_span: int, remove: bool=False) -> []:
+
+        with self._lock:
+            spans = self._spans[first_span:]
+            self._no_of_recorders -= 1
+            if self._no_of_recorders == 0:
+                self._spans = []
+            elif remove:
+                del self._spans[first_span:]
+            return spans
+
+tracer = Tracer()
@@ -0,0 +1,136 @@
+'''
+Encodes IPTC metadata in the IIM format, so the exports can embed
+it while they write the image files instead of letting exiftool
+read and rewrite every file afterwards.
+
+IIM data is a sequence of datasets: 0x1C, the record number, the
+dataset number, a two byte length and the value. The values of
+the application record (record 2) are written as utf-8, which is
+declared by the coded character set dataset (1:90) of the envelope
+record if there is a non ascii character. Tiff files take the IIM
+data in the IPTC-NAA tag (33723), jpeg files in an Adobe Photoshop
+image resource block (0x0404) in an APP13 segment.
+
+Only the tags the IPTCService writes are supported, for everything
+else we still need exiftool.
+
+Created on 18.10.2026
+
+@author: michael
+'''
+import struct
+
+from injector import singleton
+
+from PIL.TiffImagePlugin import ImageFileDirectory_v2
+from PIL.TiffTags import UNDEFINED
+
+IIM_TAG_MARKER = 0x1C
+ENVELOPE_RECORD = 1
+APPLICATION_RECORD = 2
+CODED_CHARACTER_SET = 90
+RECORD_VERSION = 0
+IIM_VERSION = 4
+UTF8_ESCAPE_SEQUENCE = b"\x1b%G"
+
+TIFF_IPTC_TAG = 33723
+
+JPEG_APP13_MARKER = b"\xff\xed"
+PHOTOSHOP_SIGNATURE = b"Photoshop 3.0\x00"
+IMAGE_RESOURCE_SIGNATURE = b"8BIM"
+IPTC_RESOURCE_ID = 0x0404
+MAX_JPEG_SEGMENT_SIZE = 65533
+
+# exiftool tag name: (dataset number, maximum length in bytes)
+APPLICATION_DATASETS = {
+    "1IPTC:SpecialInstructions": (40, 256),
+    "1IPTC:City": (90, 32),
+    "1IPTC:Source": (115, 32),
+    "1IPTC:CatalogSets": (255, 256)
+}
+
+class UnsupportedIPTCTag(Exception):
+
+    pass
+
+@singleton
+class IPTCEncoder(object):
+    '''
+    Converts a dictionary of exiftool tag names and values, the
+    same the IPTCService gets, into IIM data. Empty values are
+    left out, exiftool would delete these tags anyway.
+    '''
+
+    def can_encode(self, tags: {}) -> bool:
+
+        for tag in tags:
+            if tag not in APPLICATION_DATASETS:
+                return False
+        return True
+
+    def encode(self, tags: {}) -> bytes:
+
+        datasets = []
+        utf8 = False
+        for tag in sorted(tags, key=lambda tag: self._get_dataset(tag)[0]):
+            dataset_number, max_length = self._get_dataset(tag)
+            value = tags[tag]
+            if value is None or value == "":
+                continue
+            encoded_value = self._truncate(value.encode("utf-8"), max_length)
+            utf8 = utf8 or not value.isascii()
+            datasets.append(self._encode_dataset(APPLICATION_RECORD, dataset_number, encoded_value))
+
+        header = []
+        if utf8:
+            header.append(self._encode_dataset(ENVELOPE_RECORD, CODED_CHARACTER_SET, UTF8_ESCAPE_SEQUENCE))
+        header.append(self._encode_dataset(APPLICATION_RECORD, RECORD_VERSION, struct.pack(">H", IIM_VERSION)))
+        return b"".join(header + datasets)
+
+    def add_to_tiff_metadata(self, tiff_meta_data: ImageFileDirectory_v2, tags: {}) -> ImageFileDirectory_v2:
+        '''
+        Photoshop pads the data to full 4 byte words, so do we
+        '''
+
+        iim_data = self.encode(tags)
+        if len(iim_data) % 4 != 0:
+            iim_data += b"\x00" * (4 - len(iim_data) % 4)
+        tiff_meta_data.tagtype[TIFF_IPTC_TAG] = UNDEFINED
+        tiff_meta_data[TIFF_IPTC_TAG] = iim_data
+        return tiff_meta_data
+
+    def get_jpeg_segment(self, tags: {}) -> bytes:
+        '''
+        Returns a complete APP13 segment, to be handed to
+        pillow as "extra" parameter when saving a jpeg.
+        '''
+
+        iim_data = self.encode(tags)
+        # Empty resource name as pascal string, padded to even length
+        resource = IMAGE_RESOURCE_SIGNATURE + struct.pack(">H", IPTC_RESOURCE_ID) + b"\x00\x00"
+        resource += struct.pack(">I", len(iim_data)) + iim_data
+        if len(iim_data) % 2 != 0:
+            resource += b"\x00"
+        segment_data = PHOTOSHOP_SIGNATURE + resource
+        if len(segment_data) > MAX_JPEG_SEGMENT_SIZE:
+            raise Exception("IPTC data too large for a jpeg segment")
+        return JPEG_APP13_MARKER + struct.pack(">H", len(segment_data) + 2) + segment_data
+
+    def _get_dataset(self, tag: str) -> (int, int):
+
+        if tag not in APPLICATION_DATASETS:
+            raise UnsupportedIPTCTag(tag)
+        return APPLICATION_DATASETS[tag]
+
+    def _encode_dataset(self, record: int, dataset_number: int, value: bytes) -> bytes:
+
+        return struct.pack(">BBBH", IIM_TAG_MARKER, record, dataset_number, len(value)) + value
+
+    def _truncate(self, value: bytes, max_length: int) -> bytes:
+        '''
+        Does not cut utf-8 sequences in half
+        '''
+
+        if len(value) <= max_length:
+            return value
+        return value[:max_length].decode("utf-8", "ignore").encode("utf-8")
@@ -0,0 +1,74 @@
+'''
+The algorithm preview inside the main window.
+
+Tuning the algorithms of a page means looking at the result again
+and again. Rendering it at the pdf resolution takes seconds, so the
+preview is done in two steps: First the algorithms of the page and
+its regions run on a reduced version of the page (the one the page
+view shows anyway, from the page prefetcher), which takes a few
+hundred milliseconds. Then the final image is rendered at the pdf
+resolution in the background and replaces the quick preview, if
+the page has not been changed in the meantime.
+
+Created on 18.10.2026
+
+@author: michael
+'''
+from PIL import Image
+from injector import singleton, inject
+
+from Asb.ScanConvert2.Instrumentation import tracer
+from Asb.ScanConvert2.PagePrefetcher import PagePrefetcher
+from Asb.ScanConvert2.ScanConvertDomain import Page
+from Asb.ScanConvert2.ScanConvertServices import FinishingService
+
+# Below this resolution the algorithms (which work with fixed
+# window sizes) do not give an idea of the final result
+MIN_PREVIEW_RESOLUTION = 100
+
+@singleton
+class LivePreviewer(object):
+
+    @inject
+    def __init__(self, finishing_service: FinishingService, page_prefetcher: PagePrefetcher):
+
+        self.finishing_service = finishing_service
+        self.page_prefetcher = page_prefetcher
+        self.min_resolution = MIN_PREVIEW_RESOLUTION
+
+    def create_preview(self, page: Page, target_resolution: float, final_resolution: int) -> Image:
+        '''
+        Returns the final image of the page in about the target
+        resolution (see get_preview_resolution)
+        '''
+
+        resolution = self.get_preview_resolution(page, target_resolution, final_resolution)
+        raw_img = self.page_prefetcher.get_page_image(page, resolution)
+        with tracer.span("preview.algorithms", resolution=resolution):
+            img, _ = self.finishing_service.create_final_image(page, [], resolution, raw_img)
+        return img
+
+    def get_preview_resolution(self, page: Page, target_resolution: float, final_resolution: int) -> int:
+        '''
+        The resolution the page view needs, but not more than
+        the final resolution and not less than the minimum
+        preview resolution
+        '''
+
+        if target_resolution is None or page.source_resolution is None:
+            return final_resolution
+        resolution = max(round(target_resolution), self.min_resolution)
+        return min(resolution, final_resolution)
+
+    def needs_refinement(self, page: Page, target_resolution: float, final_resolution: int) -> bool:
+
+        return self.get_preview_resolution(page, target_resolution, final_resolution) < final_resolution
+
+    def get_page_key(self, page: Page):
+        '''
+        Everything that changes the final image of the page
+        '''
+
+        regions = tuple((region.x, region.y, region.width, region.height, region.mode_algorithm)
+                        for region in [page.main_region] + page.sub_regions)
+        return (page.scan.filename, regions, page.final_rotation_angle, page.dewarp, page.alignment_angle)
@@ -3,16 +3,33 @@ Created on 03.11.2022
 
 @author: michael
 '''
-from injector import singleton
+from injector import singleton, inject
 import re
 from PIL import Image
 import pytesseract
+from pytesseract.pytesseract import save
 import xml.etree.ElementTree as ET
 
+from Asb.ScanConvert2.OcrCache import OcrCache
+from Asb.ScanConvert2.Instrumentation import tracer
+
 OCR_PICTURE_MODE_MANUAL = 1
 OCR_PICTURE_MODE_OTSU = 2
 OCR_PICTURE_MODE_RAW = 3
 
+OUTPUT_HOCR = "hocr"
+OUTPUT_ALTO = "alto"
+OUTPUT_TEXT = "txt"
+ALL_OUTPUTS = (OUTPUT_HOCR, OUTPUT_ALTO, OUTPUT_TEXT)
+
+# tesseract names the output files after the file type,
+# not after the config file that produces them
+OUTPUT_FILE_EXTENSIONS = {
+    OUTPUT_HOCR: "hocr",
+    OUTPUT_ALTO: "xml",
+    OUTPUT_TEXT: "txt"
+}
+
 class OCRPage(object):
     
     def __init__(self, dpi=300):
@@ -61,14 +78,30 @@ class OCRWord(object):
         string += "\n    Text: %s" % self.text
         return string
 
+class OCRResult(object):
+    '''
+    Everything one tesseract run produced. Outputs that
+    were not requested are None.
+    '''
+    
+    def __init__(self, page: OCRPage=None, alto: ET.ElementTree=None, text: str=None):
+        
+        self.page = page
+        self.alto = alto
+        self.text = text
+
 @singleton
 class OcrRunner(object):
     '''
-    This wraps the whole execution of tesseract and parsing the HOCR output
+    This wraps the whole execution of tesseract and parsing the HOCR output.
+    If there is an ocr cache, tesseract is only run for images it has
+    not seen before.
     '''
 
-    def __init__(self):
+    @inject
+    def __init__(self, ocr_cache: OcrCache=None):
         
+        self.ocr_cache = ocr_cache
         self.re_boundingbox = re.compile(r'bbox\s+(\d+)\s+(\d+)\s+(\d+)\s+(\d+);.*')
         self.re_x_size = re.compile(r'.*x_size\s+([0-9.]+);.*')
         self.re_baseline = re.compile(r'.*baseline\s+([0-9-.]+)\s+([0-9-.]+);.*')
@@ -80,33 +113,75 @@ class OcrRunner(object):
         This is one of two public methods. It executes OCR on the given image and
         returns the information in a page object.
         '''
-        print("create hocr")
-        hocr = pytesseract.image_to_pdf_or_hocr(img, extension='hocr', lang=lang)
-        
-        print("read hocr")
-        dom = ET.fromstring(hocr)
-        print("prepare page")
-        page = OCRPage(img.info['dpi'][0])
-        page.width = img.size[0]
-        page.height = img.size[1]
-        print("parsing dom")
-        return self._parse_dom(dom, page)
-
-    def run_tesseract_for_alto(self, img: Image, lang: str) -> ET.Element:
+
+        return self.run_tesseract_multi(img, lang, (OUTPUT_HOCR,)).page
+
+    def run_tesseract_for_alto(self, img: Image, lang: str) -> ET.ElementTree:
         '''
         Executes tesseract and returns the result als alto dom.
         '''
 
-        alto = pytesseract.image_to_alto_xml(img, lang=lang)
-        return ET.ElementTree(ET.fromstring(alto))
+        return self.run_tesseract_multi(img, lang, (OUTPUT_ALTO,)).alto
     
     def run_tesseract_for_string(self, img: Image, lang: str) -> str:
         
-        return pytesseract.image_to_string(img, lang=lang)
+        return self.run_tesseract_multi(img, lang, (OUTPUT_TEXT,)).text
+    
+    def run_tesseract_multi(self, img: Image, lang: str, outputs=ALL_OUTPUTS) -> OCRResult:
+        '''
+        Runs tesseract just once and lets it write all the requested
+        outputs (hocr, alto and / or txt). Layout analysis and
+        recognition are by far the most expensive parts of ocr, so
+        this is a lot cheaper than calling tesseract for every format.
+        '''
+        
+        output_files = None
+        if self.ocr_cache is not None:
+            with tracer.span("ocr.cache_lookup"):
+                output_files = self.ocr_cache.get_outputs(img, lang, outputs)
+        if output_files is not None:
+            return self.parse_outputs(img, output_files)
+        
+        with tracer.span("ocr.tesseract", outputs=" ".join(outputs)):
+            with save(img) as (temp_name, input_file_name):
+                pytesseract.pytesseract.run_tesseract(input_file_name, temp_name, " ".join(outputs), lang)
+                output_files = {}
+                for output in outputs:
+                    with open("%s.%s" % (temp_name, OUTPUT_FILE_EXTENSIONS[output]), "rb") as file:
+                        output_files[output] = file.read()
+        
+        if self.ocr_cache is not None:
+            with tracer.span("ocr.cache_store"):
+                self.ocr_cache.put_outputs(img, lang, output_files)
+        return self.parse_outputs(img, output_files)
+    
+    def parse_outputs(self, img: Image, output_files) -> OCRResult:
+        '''
+        Converts the raw tesseract output (a dictionary of output type
+        and file content) into a result object.
+        '''
+        
+        with tracer.span("ocr.parse"):
+            return self._parse_outputs(img, output_files)
+        
+    def _parse_outputs(self, img: Image, output_files) -> OCRResult:
+        
+        result = OCRResult()
+        if OUTPUT_HOCR in output_files:
+            page = OCRPage(img.info['dpi'][0])
+            page.width = img.size[0]
+            page.height = img.size[1]
+            result.page = self._parse_dom(ET.fromstring(output_files[OUTPUT_HOCR]), page)
+        if OUTPUT_ALTO in output_files:
+            result.alto = ET.ElementTree(ET.fromstring(output_files[OUTPUT_ALTO]))
+        if OUTPUT_TEXT in output_files:
+            result.text = output_files[OUTPUT_TEXT].decode("utf-8")
+        return result
     
     def _parse_dom(self, root: ET.Element, page: OCRPage):
 
-        for paragraph in root.findall("p"):
+        # hocr is xhtml, so we ignore the namespace
+        for paragraph in root.iterfind(".//{*}p[@class='ocr_par']"):
             page = self._add_lines_to_page(paragraph, page)
         return page
     
@@ -118,7 +193,9 @@ class OcrRunner(object):
             line_data.bbox = self._get_bounding_box(line, page_data)
             line_data.baseline_coefficients = self._get_baseline_coefficients(line)
             line_data.textangle = self._get_textangle(line)
-            assert(line_data.textangle == 90 or line_data.textangle == 0) # No other angles implemented
+            if line_data.textangle not in (0, 90):
+                # No other angles implemented
+                continue
             line_data = self._add_words_to_line(line, line_data, page_data)
             page_data.lines.append(line_data)
 
@@ -129,7 +206,7 @@ class OcrRunner(object):
         for word in self._get_words(line):
             word_data = OCRWord()
             word_data.bbox = self._get_bounding_box(word, page_data)
-            word_data.text = word.firstChild.nodeValue
+            word_data.text = "".join(word.itertext())
             line_data.words.append(word_data)
         
         return line_data
@@ -137,14 +214,14 @@ class OcrRunner(object):
     def _get_lines(self, paragraph: ET.Element):
         
         lines = []
-        for child in paragraph.findall("./span[@class='ocr_line'"):
+        for child in paragraph.findall("./{*}span[@class='ocr_line']"):
                 lines.append(child)
         return lines
 
     def _get_words(self, line: ET.Element):
         
         words = []
-        for child in line.findall("./span[@class='ocrx_word']"):
+        for child in line.findall("./{*}span[@class='ocrx_word']"):
                 words.append(child)
         return words
     
@@ -0,0 +1,176 @@
+'''
+An on disk cache for tesseract output.
+
+Ocr is by far the most expensive part of an export (about
+20 seconds per page), and re-exporting a project after fixing
+some metadata feeds exactly the same images to tesseract again.
+So we store the raw tesseract output files under a hash of the
+image pixels, the language and the tesseract version. When the
+cache grows beyond its byte budget, the least recently used
+entries are deleted. Hits touch the files, so the modification
+time tells us when an entry has been used last.
+
+Several worker processes may use the cache at the same time,
+so files are written to a temporary name and then renamed.
+
+Walking the cache directory for every new entry would make a large
+export quadratic, so the cache keeps a running total of the bytes in
+use. It is determined from the directory on the first write and when
+it exceeds the budget (other processes may have written entries, too).
+
+Created on 18.10.2026
+
+@author: michael
+'''
+from injector import singleton
+import hashlib
+import os
+import tempfile
+
+from PIL import Image
+import pytesseract
+
+DEFAULT_BYTE_BUDGET = 500 * 1024 * 1024
+
+# Part of the key, so changing the way we call
+# tesseract invalidates all old entries
+TESSERACT_CONFIG = ""
+
+def get_default_cache_dir() -> str:
+
+    cache_home = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache_home, "ScanConvert2", "ocr")
+
+@singleton
+class OcrCache(object):
+    '''
+    Maps (image, language, output type) to the content of the
+    file tesseract wrote for this output type.
+    '''
+
+    def __init__(self, cache_dir: str=None, byte_budget: int=DEFAULT_BYTE_BUDGET, tesseract_version: str=None):
+
+        if cache_dir is None:
+            cache_dir = get_default_cache_dir()
+        self.cache_dir = cache_dir
+        self.byte_budget = byte_budget
+        self._tesseract_version = tesseract_version
+        self.hits = 0
+        self.misses = 0
+        # Unknown until the first write
+        self.used_bytes = None
+
+    def get_outputs(self, img: Image, lang: str, outputs):
+        '''
+        Returns a dictionary with the file content for every requested
+        output or None, if at least one of them is not cached.
+        '''
+
+        key = self.get_key(img, lang)
+        output_files = {}
+        for output in outputs:
+            file_name = self._get_file_name(key, output)
+            try:
+                with open(file_name, "rb") as file:
+                    output_files[output] = file.read()
+            except FileNotFoundError:
+                self.misses += 1
+                return None
+        for output in outputs:
+            self._touch(self._get_file_name(key, output))
+        self.hits += 1
+        return output_files
+
+    def put_outputs(self, img: Image, lang: str, output_files):
+
+        if self.used_bytes is None:
+            self.used_bytes = self._get_used_bytes()
+        key = self.get_key(img, lang)
+        for output, content in output_files.items():
+            file_name = self._get_file_name(key, output)
+            os.makedirs(os.path.dirname(file_name), exist_ok=True)
+            file_descriptor, temp_file_name = tempfile.mkstemp(dir=os.path.dirname(file_name), suffix=".tmp")
+            with os.fdopen(file_descriptor, "wb") as file:
+                file.write(content)
+            os.replace(temp_file_name, file_name)
+            self.used_bytes += len(content)
+        if self.used_bytes > self.byte_budget:
+            self.evict()
+
+    def get_key(self, img: Image, lang: str) -> str:
+
+        digest = hashlib.sha256()
+        digest.update(("%s|%s|%s|%s|%s|%s|" % (img.mode,
+                                               img.size,
+                                               img.info.get('dpi'),
+                                               lang,
+                                               self.tesseract_version,
+                                               TESSERACT_CONFIG)).encode("utf-8"))
+        digest.update(img.tobytes())
+        return digest.hexdigest()
+
+    def evict(self):
+        '''
+        Deletes the least recently used entries until the cache
+        fits into the byte budget again.
+        '''
+
+        entries = []
+        used_bytes = 0
+        for dir_entry in self._scan_files():
+            stat = dir_entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, dir_entry.path))
+            used_bytes += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if used_bytes <= self.byte_budget:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Another process was faster
+                pass
+            used_bytes -= size
+        self.used_bytes = used_bytes
+
+    def clear(self):
+
+        for dir_entry in self._scan_files():
+            os.remove(dir_entry.path)
+        self.hits = 0
+        self.misses = 0
+        self.used_bytes = 0
+
+    def _get_used_bytes(self) -> int:
+
+        return sum(dir_entry.stat().st_size for dir_entry in self._scan_files())
+
+    def _scan_files(self):
+
+        if not os.path.isdir(self.cache_dir):
+            return
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for dir_entry in os.scandir(shard.path):
+                if dir_entry.is_file() and not dir_entry.name.endswith(".tmp"):
+                    yield dir_entry
+
+    def _get_file_name(self, key: str, output: str) -> str:
+
+        return os.path.join(self.cache_dir, key[:2], "%s.%s" % (key, output))
+
+    def _touch(self, file_name: str):
+
+        try:
+            os.utime(file_name)
+        except FileNotFoundError:
+            pass
+
+    def _get_tesseract_version(self) -> str:
+
+        if self._tesseract_version is None:
+            self._tesseract_version = str(pytesseract.get_tesseract_version())
+        return self._tesseract_version
+
+    tesseract_version = property(_get_tesseract_version)
@@ -0,0 +1,162 @@
+'''
+Prefetching of the page images for the gui.
+
+Showing a page crops, rotates, maybe dewarps and aligns its image,
+even with the preview pyramid this takes some time for every click
+on next or previous. While the operator looks at a page, we prepare
+the images of the neighbouring pages in a background thread and keep
+them in a small LRU cache.
+
+The key of a page image contains everything that changes the image
+(the scan, the main region, the rotation, dewarping and alignment)
+and the preview level, so pages that have been changed since they
+were prefetched are simply prepared again.
+
+Every call of prefetch starts a new generation: Jobs of older
+generations that have not started yet are cancelled, so jumping
+around in a large project does not queue up work for pages the
+operator has already left.
+
+Created on 18.10.2026
+
+@author: michael
+'''
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+from PIL import Image
+from injector import singleton, inject
+
+from Asb.ScanConvert2.Instrumentation import tracer
+from Asb.ScanConvert2.PreviewPyramid import PreviewPyramid
+from Asb.ScanConvert2.ScanConvertDomain import Page
+
+# Pages on each side of the current page
+DEFAULT_NEIGHBOURS = 2
+# The current page, its neighbours and a few pages
+# the operator has just left
+DEFAULT_MAX_ENTRIES = 12
+
+@singleton
+class PagePrefetcher(object):
+    '''
+    Returns the page images for the page view and prepares
+    the images of the neighbouring pages in the background.
+    '''
+
+    @inject
+    def __init__(self, preview_pyramid: PreviewPyramid):
+
+        self.preview_pyramid = preview_pyramid
+        self.neighbours = DEFAULT_NEIGHBOURS
+        self.max_entries = DEFAULT_MAX_ENTRIES
+        self.hits = 0
+        self._images = OrderedDict()
+        self._futures = {}
+        self._generation = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="page-prefetch")
+        self._lock = threading.Lock()
+
+    def get_page_image(self, page: Page, target_resolution: float=None) -> Image:
+        '''
+        Returns the image of the page in at least the target
+        resolution (see PreviewPyramid.get_page_image). The image
+        may be shared, so it must not be modified in place.
+        '''
+
+        key = self._get_key(page, target_resolution)
+        with self._lock:
+            if key in self._images:
+                self._images.move_to_end(key)
+                self.hits += 1
+                return self._images[key]
+            future = self._futures.get(key)
+        if future is not None and not future.cancel():
+            # Already in the works, no need to do it twice
+            img = future.result()
+            if img is not None:
+                return img
+        return self._prepare(page, target_resolution, key)
+
+    def prefetch(self, pages: [], current_page_no: int, target_resolution: float=None):
+        '''
+        Prepares the pages around the current page (the page
+        number starts with 1 as in the project), the next pages
+        first. Like the project, we wrap around at the ends.
+        '''
+
+        if len(pages) == 0:
+            return
+        page_indices = []
+        for distance in range(1, self.neighbours + 1):
+            for index in (current_page_no - 1 + distance, current_page_no - 1 - distance):
+                index = index % len(pages)
+                if index != current_page_no - 1 and index not in page_indices:
+                    page_indices.append(index)
+
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+            for future in self._futures.values():
+                future.cancel()
+            self._futures.clear()
+            for index in page_indices:
+                page = pages[index]
+                key = self._get_key(page, target_resolution)
+                if key in self._images or key in self._futures:
+                    continue
+                future = self._executor.submit(self._prefetch, page, target_resolution, key, generation)
+                self._futures[key] = future
+
+    def clear(self):
+
+        with self._lock:
+            self._generation += 1
+            for future in self._futures.values():
+                future.cancel()
+            self._futures.clear()
+            self._images.clear()
+            self.hits = 0
+
+    def _prefetch(self, page: Page, target_resolution: float, key, generation: int) -> Image:
+
+        with self._lock:
+            if generation != self._generation:
+                self._futures.pop(key, None)
+                return None
+        with tracer.span("prefetch.page"):
+            img = self._prepare(page, target_resolution, key)
+        with self._lock:
+            if self._futures.get(key) is not None and generation == self._generation:
+                self._futures.pop(key)
+        return img
+
+    def _prepare(self, page: Page, target_resolution: float, key) -> Image:
+
+        img = self.preview_pyramid.get_page_image(page, target_resolution)
+        if self._get_key(page, target_resolution) != key:
+            # The page has been changed in the meantime
+            return img
+        with self._lock:
+            self._images[key] = img
+            self._images.move_to_end(key)
+            while len(self._images) > self.max_entries:
+                self._images.popitem(last=False)
+        return img
+
+    def _get_key(self, page: Page, target_resolution: float):
+        '''
+        The name of the preview level covers the scan file, its
+        modification time and cropping and the reduction
+        '''
+
+        region = page.main_region
+        reduction = self.preview_pyramid.get_reduction(page.scan, target_resolution)
+        return (self.preview_pyramid.get_level_filename(page.scan, reduction),
+                (region.x, region.y, region.width, region.height),
+                page.final_rotation_angle,
+                page.dewarp,
+                page.alignment_angle)
+
+    no_of_images = property(lambda self: len(self._images))
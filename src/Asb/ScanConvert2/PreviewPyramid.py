@@ -0,0 +1,196 @@
+'''
+Reduced versions of the scans for the page display.
+
+Showing a page in the gui decodes the whole scan, although the
+page view displays maybe a tenth of its pixels. For every scan
+we store reduced versions (1/2, 1/4 and 1/8 of the size) in the
+directory .scanconvert_previews beside the scans. They are built
+once in a background thread, the page view then uses the smallest
+level that still fills the view. Decoding a 1/4 level of an A3
+scan at 400 dpi takes a few milliseconds instead of about a
+second.
+
+The levels are built from the cropped scan, so the page geometry
+is simply divided by the reduction. The file name contains a hash
+of the filename, the modification time and the cropping of the
+scan, so a changed scan gets new levels. Decoded levels live in
+the scan cache like the scans themselves.
+
+If the directory can not be written (e.g. scans on a read only
+archive share), there are no levels and the pages are decoded
+from the scans as before.
+
+Created on 18.10.2026
+
+@author: michael
+'''
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import threading
+
+from PIL import Image
+from injector import singleton
+
+from Asb.ScanConvert2.Instrumentation import tracer
+from Asb.ScanConvert2.ScanCache import scan_cache
+from Asb.ScanConvert2.ScanConvertDomain import Page, Scan
+
+PREVIEW_DIRECTORY = ".scanconvert_previews"
+PREVIEW_REDUCTIONS = (2, 4, 8)
+
+@singleton
+class PreviewPyramid(object):
+    '''
+    Builds the levels in a single background thread (decoding is
+    done by pillow, which releases the GIL, so the gui stays
+    responsive) and returns page images from the matching level.
+    '''
+
+    def __init__(self):
+
+        self.reductions = PREVIEW_REDUCTIONS
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="preview-pyramid")
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def get_page_image(self, page: Page, target_resolution: float=None) -> Image:
+        '''
+        Returns the raw image of the page with at least the target
+        resolution (if the scan has it). Without a stored level the
+        page is decoded from the scan and the levels are built in
+        the background.
+        '''
+
+        reduction = self.get_reduction(page.scan, target_resolution)
+        if reduction > 1:
+            level_img = self.get_level(page.scan, reduction)
+            if level_img is not None:
+                return page.create_raw_image(level_img, reduction)
+            self.build(page.scan)
+        return page.get_raw_image(target_resolution)
+
+    def get_reduction(self, scan: Scan, target_resolution: float=None) -> int:
+        '''
+        The largest reduction that still has the target resolution
+        '''
+
+        if target_resolution is None or scan.resolution is None:
+            return 1
+        for reduction in sorted(self.reductions, reverse=True):
+            if scan.resolution / reduction >= target_resolution:
+                return reduction
+        return 1
+
+    def get_level(self, scan: Scan, reduction: int) -> Image:
+        '''
+        Returns the decoded level from the scan cache or None if
+        it has not been built yet. As with Scan.get_cached_image,
+        the image must not be modified in place.
+        '''
+
+        level_filename = self.get_level_filename(scan, reduction)
+        if not os.path.exists(level_filename):
+            return None
+        return scan_cache.get_image(level_filename, None, self._load_level)
+
+    def get_level_filename(self, scan: Scan, reduction: int) -> str:
+
+        return os.path.join(os.path.dirname(os.path.abspath(scan.filename)), PREVIEW_DIRECTORY,
+                            "%s.%s.%d.png" % (os.path.basename(scan.filename), self._get_hash(scan), reduction))
+
+    def build(self, scan: Scan):
+        '''
+        Schedules building the levels of the scan, unless they
+        are already there or scheduled
+        '''
+
+        key = self.get_level_filename(scan, self.reductions[-1])
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+            future = self._executor.submit(self._build, scan)
+            self._pending[key] = future
+        future.add_done_callback(lambda future: self._remove_pending(key))
+        return future
+
+    def build_all(self, scans: []):
+
+        for scan in scans:
+            self.build(scan)
+
+    def _remove_pending(self, key):
+
+        with self._lock:
+            self._pending.pop(key, None)
+
+    def _build(self, scan: Scan):
+
+        missing = [reduction for reduction in sorted(self.reductions)
+                   if not os.path.exists(self.get_level_filename(scan, reduction))]
+        if len(missing) == 0:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.get_level_filename(scan, missing[0])), exist_ok=True)
+        except OSError:
+            return
+
+        with tracer.span("previews.build", filename=scan.filename):
+            # Every level is reduced from the previous one,
+            # jpeg scans are decoded at half size in the first place
+            target_resolution = None
+            if scan.resolution is not None:
+                target_resolution = scan.resolution / min(self.reductions)
+            current_reduction = scan.get_draft_reduction(target_resolution)
+            img = self._convert_mode(scan.decode_image(target_resolution))
+            for reduction in sorted(self.reductions):
+                if reduction > current_reduction:
+                    img = img.reduce(reduction // current_reduction)
+                    current_reduction = reduction
+                if reduction in missing and not self._save_level(img, self.get_level_filename(scan, reduction)):
+                    return
+
+    def _save_level(self, img: Image, level_filename: str) -> bool:
+        '''
+        Writes to a temporary file first, so nobody sees a half
+        written level
+        '''
+
+        tmp_filename = "%s.%d.tmp" % (level_filename, threading.get_ident())
+        try:
+            img.save(tmp_filename, format="png", compress_level=1)
+            os.replace(tmp_filename, level_filename)
+        except OSError:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            return False
+        return True
+
+    def _load_level(self, filename: str, cropping_information) -> Image:
+
+        with tracer.span("previews.decode"):
+            with Image.open(filename) as img:
+                img.load()
+        return img
+
+    def _convert_mode(self, img: Image) -> Image:
+        '''
+        Image.reduce does not work on bilevel or palette images
+        (and averaged pixels look better on the screen anyway)
+        '''
+
+        if img.mode == "L" or img.mode == "RGB":
+            return img
+        if img.mode == "1" or img.mode == "LA":
+            return img.convert("L")
+        return img.convert("RGB")
+
+    def _get_hash(self, scan: Scan) -> str:
+
+        cropping_information = scan.cropping_information
+        if cropping_information is None:
+            cropping_key = None
+        else:
+            cropping_key = (cropping_information.rotation_angle, tuple(cropping_information.bounding_box))
+        key = "%s|%s|%s" % (os.path.abspath(scan.filename), os.path.getmtime(scan.filename), cropping_key)
+        return hashlib.blake2b(key.encode("utf-8"), digest_size=8).hexdigest()
@@ -0,0 +1,99 @@
+'''
+Helpers to spread work over several processes.
+
+The heavy lifting of the scan converter (decoding, the
+mode transformation algorithms, png encoding and tesseract)
+is mostly pure python or holds the GIL, so we use processes
+and not threads. The processes are started with the spawn
+method, because forking a process that runs Qt threads is
+asking for trouble.
+
+Every worker process has its own scan cache. The workers share
+the byte budget of the scan cache of the process that starts
+them, so the decoded scans of a pool never take up more memory
+than those of a single process. In the same way the workers
+share the number of workers of the starting process, which is
+what the thread pools in the workers (e.g. of the TileProcessor)
+use, so a pool of N workers does not start N * N threads.
+
+Created on 18.10.2026
+
+@author: michael
+'''
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import os
+
+from Asb.ScanConvert2.Instrumentation import tracer
+from Asb.ScanConvert2.ScanCache import scan_cache
+
+
+_max_workers = os.cpu_count() or 1
+
+def set_max_workers(max_workers: int):
+    '''
+    Sets the number of worker processes the services use
+    at most. 1 means: do everything in the current process.
+    '''
+
+    global _max_workers
+    _max_workers = max(1, max_workers)
+
+def get_max_workers() -> int:
+
+    return _max_workers
+
+def get_number_of_workers(no_of_tasks: int, max_workers: int=None) -> int:
+
+    if max_workers is None:
+        max_workers = _max_workers
+    return max(1, min(max_workers, no_of_tasks))
+
+def create_executor(max_workers: int) -> ProcessPoolExecutor:
+
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=get_context("spawn"),
+                               initializer=_init_worker,
+                               initargs=(max(1, scan_cache.byte_budget // max_workers),
+                                         max(1, _max_workers // max_workers)))
+
+def _init_worker(byte_budget: int, max_workers: int):
+
+    scan_cache.set_byte_budget(byte_budget)
+    set_max_workers(max_workers)
+
+def ordered_map(function, items, max_workers: int):
+    '''
+    Applies the function to all items in worker processes and
+    yields the results in the order of the items. Only a limited
+    number of tasks is in flight, so results do not pile up in
+    memory if the consumer is slower than the workers.
+
+    The function must be picklable, i.e. defined on module level.
+    The spans the workers record are merged into the tracer of
+    the calling process.
+    '''
+
+    executor = create_executor(max_workers)
+    try:
+        items = iter(items)
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(_traced_call, function, item))
+            if len(pending) >= 2 * max_workers:
+                break
+        while len(pending) > 0:
+            result, spans = pending.popleft().result()
+            tracer.add_spans(spans)
+            for item in items:
+                pending.append(executor.submit(_traced_call, function, item))
+                break
+            yield result
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def _traced_call(function, item):
+
+    with tracer.collect() as spans:
+        result = function(item)
+    return result, spans
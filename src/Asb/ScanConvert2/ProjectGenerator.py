@@ -7,6 +7,7 @@ from injector import inject, singleton
 
 from Asb.ScanConvert2.ScanConvertDomain import Page, Region, \
     Scan, Project, ProjectProperties, ScanPart
+from Asb.ScanConvert2.ScanCache import scan_cache
 from enum import Enum
     
 class SortType(Enum):
@@ -264,6 +265,7 @@ class ProjectGenerator():
         
         # reread scan file and create new scan object
         scan = project.scans[scan_no]
+        scan_cache.invalidate(scan.filename)
         new_scan = Scan(scan.filename)
         new_scan.no_of_pages = scan.no_of_pages
         project.scans[scan_no] = new_scan
@@ -0,0 +1,180 @@
+'''
+A process wide cache for decoded scans.
+
+Decoding a 400 dpi tiff (and applying the cropping rotation
+and crop) is by far the most expensive part of fetching a page
+image. Since the same scan is needed again and again (when
+paging through the project in the gui, for every export and
+for every page on a double sided scan) we keep the decoded
+images in memory until a byte budget is exhausted. Then the
+least recently used images are evicted.
+
+Several threads may ask for the same scan at the same time (the
+tiles of a page, the page prefetcher and the gui). Only the first
+one decodes the scan, the others wait for its result.
+
+The cache is a module level object and not injected, because
+the scans that use it are domain objects that are pickled
+together with the project.
+
+Created on 18.10.2026
+
+@author: michael
+'''
+from collections import OrderedDict
+from concurrent.futures import Future
+import os
+import threading
+
+from PIL import Image
+
+# An A3 color scan at 400 dpi is about 600 MB once decoded,
+# so we are able to keep at least three of them
+DEFAULT_BYTE_BUDGET = 2 * 1024 * 1024 * 1024
+
+BYTES_PER_PIXEL = {
+    "1": 1,
+    "L": 1,
+    "P": 1,
+    "LA": 2,
+    "I;16": 2,
+    "RGB": 3,
+    "RGBA": 4,
+    "CMYK": 4,
+    "I": 4,
+    "F": 4
+}
+
+class ScanCache(object):
+    '''
+    LRU cache for decoded scan images. The key consists of the
+    filename, the modification time of the file, the cropping
+    information and the reduction of the decoded image, so
+    changed files or changed cropping never return stale images.
+    '''
+
+    def __init__(self, byte_budget: int=DEFAULT_BYTE_BUDGET):
+
+        self.byte_budget = byte_budget
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._images = OrderedDict()
+        self._loading = {}
+        self._lock = threading.RLock()
+
+    def get_image(self, filename: str, cropping_information=None, loader=None, reduction: int=1) -> Image:
+        '''
+        Returns the decoded image for the scan file. If the image
+        is not cached, the loader is called with the filename
+        and the cropping information and the result is stored.
+        A loader that returns a smaller image than the scan must
+        be called with its reduction factor.
+        The returned image is shared, so callers must not modify
+        it in place.
+        If the image is being loaded by another thread, we wait
+        for its result instead of loading it a second time.
+        '''
+
+        key = self._get_key(filename, cropping_information, reduction)
+        with self._lock:
+            if key in self._images:
+                self._images.move_to_end(key)
+                self.hits += 1
+                return self._images[key]
+            future = self._loading.get(key)
+            if future is None:
+                self.misses += 1
+                future = Future()
+                self._loading[key] = future
+                is_loader = True
+            else:
+                self.hits += 1
+                is_loader = False
+
+        if not is_loader:
+            return future.result()
+
+        try:
+            img = loader(filename, cropping_information)
+        except BaseException as e:
+            with self._lock:
+                del self._loading[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._add(key, img)
+            del self._loading[key]
+        future.set_result(img)
+        return img
+
+    def contains(self, filename: str, cropping_information=None, reduction: int=1) -> bool:
+
+        key = self._get_key(filename, cropping_information, reduction)
+        with self._lock:
+            return key in self._images
+
+    def invalidate(self, filename: str):
+        '''
+        Removes all entries for the given file, regardless
+        of modification time and cropping
+        '''
+
+        with self._lock:
+            for key in [key for key in self._images.keys() if key[0] == filename]:
+                self._remove(key)
+
+    def clear(self):
+
+        with self._lock:
+            self._images.clear()
+            self.used_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def set_byte_budget(self, byte_budget: int):
+
+        with self._lock:
+            self.byte_budget = byte_budget
+            self._evict()
+
+    def _add(self, key, img: Image):
+
+        if key in self._images:
+            return
+        size = self._get_size(img)
+        if size > self.byte_budget:
+            # We do not throw away the whole cache
+            # for one monster image
+            return
+        self._images[key] = img
+        self.used_bytes += size
+        self._evict()
+
+    def _remove(self, key):
+
+        img = self._images.pop(key)
+        self.used_bytes -= self._get_size(img)
+
+    def _evict(self):
+
+        while self.used_bytes > self.byte_budget and len(self._images) > 0:
+            self._remove(next(iter(self._images)))
+
+    def _get_key(self, filename: str, cropping_information, reduction: int=1):
+
+        if cropping_information is None:
+            cropping_key = None
+        else:
+            cropping_key = (cropping_information.rotation_angle,
+                            tuple(cropping_information.bounding_box))
+        return (filename, os.path.getmtime(filename), cropping_key, reduction)
+
+    def _get_size(self, img: Image) -> int:
+
+        return img.width * img.height * BYTES_PER_PIXEL.get(img.mode, 4)
+
+    no_of_images = property(lambda self: len(self._images))
+
+scan_cache = ScanCache()
@@ -11,8 +11,14 @@ from Asb.ScanConvert2.Algorithms import Algorithm
 import os
 import re
 from Asb.ScanConvert2.CroppingService import CroppingInformation
+from Asb.ScanConvert2.ScanCache import scan_cache
+from Asb.ScanConvert2.Instrumentation import tracer
 from py_reform.core import straighten
 
+JPEG_FILE_EXTENSIONS = (".jpg", ".jpeg")
+# The scaling factors of the jpeg decoder (see Image.draft)
+DRAFT_REDUCTIONS = (8, 4, 2)
+
 class Mode(Enum):
     
     BW=1
@@ -291,12 +297,69 @@ class Scan(object):
         
         return True
     
-    def get_raw_image(self):
+    def get_raw_image(self, target_resolution: int=None):
 
-        img = Image.open(self.filename)
-        if self.cropping_information is not None:
-            img = img.rotate(self.cropping_information.rotation_angle, Image.BICUBIC)
-            img = img.crop(self.cropping_information.bounding_box)
+        return self.get_cached_image(target_resolution).copy()
+    
+    def get_cached_image(self, target_resolution: int=None):
+        '''
+        Returns the decoded (and cropped) scan from the scan cache.
+        The image is shared with all other users of the cache, so
+        it must not be modified in place.
+        
+        If the caller only needs the target resolution, jpeg scans
+        may be decoded at a fraction of their size (see
+        get_draft_reduction), which is several times faster.
+        '''
+        
+        reduction = self.get_draft_reduction(target_resolution)
+        return scan_cache.get_image(self.filename, self.cropping_information,
+                                    lambda filename, cropping_information:
+                                    self._load_image(filename, cropping_information, reduction),
+                                    reduction)
+    
+    def decode_image(self, target_resolution: int=None):
+        '''
+        Decodes (and crops) the scan without using the scan cache,
+        for callers that need the image only once
+        '''
+        
+        if target_resolution is None and scan_cache.contains(self.filename, self.cropping_information):
+            return self.get_cached_image()
+        return self._load_image(self.filename, self.cropping_information, self.get_draft_reduction(target_resolution))
+    
+    def get_draft_reduction(self, target_resolution: int=None) -> int:
+        '''
+        Returns by which factor the image get_cached_image returns
+        for the target resolution is smaller than the scan: The
+        largest scaling factor of the jpeg decoder that still
+        leaves at least the target resolution, 1 for other files.
+        '''
+        
+        if target_resolution is None or self.resolution is None:
+            return 1
+        if os.path.splitext(self.filename)[1].lower() not in JPEG_FILE_EXTENSIONS:
+            return 1
+        for reduction in DRAFT_REDUCTIONS:
+            if self.resolution / reduction >= target_resolution:
+                return reduction
+        return 1
+    
+    def _load_image(self, filename: str, cropping_information: CroppingInformation, reduction: int=1):
+        
+        with tracer.span("scan.decode", reduction=reduction):
+            with Image.open(filename) as img:
+                drafted = reduction > 1 and img.draft(img.mode, (img.width // reduction, img.height // reduction)) is not None
+                img.load()
+            if reduction > 1 and not drafted:
+                # Not a jpeg after all
+                img = img.reduce(reduction)
+            if reduction > 1 and 'dpi' in img.info:
+                img.info['dpi'] = tuple(value / reduction for value in img.info['dpi'])
+        if cropping_information is not None:
+            with tracer.span("scan.crop"):
+                img = img.rotate(cropping_information.rotation_angle, Image.BICUBIC)
+                img = img.crop(tuple(value / reduction for value in cropping_information.bounding_box))
         return img
  
     def _rotate_image(self, img: Image, angle: int) -> Image:
@@ -389,15 +452,26 @@ class Page:
         else:
             self.current_sub_region_no -= 1
             
-    def get_raw_image(self):
+    def get_raw_image(self, target_resolution: int=None):
         """
         The only operation performed on the scan is cutting
-        the page region from the scan and rotating it appropriately
+        the page region from the scan and rotating it appropriately.
+        With a target resolution the image may be smaller (see
+        Scan.get_draft_reduction), its dpi tell the resolution.
+        """
+        
+        return self.create_raw_image(self.scan.get_cached_image(target_resolution),
+                                     self.get_draft_reduction(target_resolution))
+    
+    def create_raw_image(self, scan_img: Image, reduction: int=1):
+        """
+        Creates the raw image from the scan image, which may be
+        reduced by the given factor
         """
         
-        img = self.scan.get_raw_image()
-        img = img.crop((self.main_region.x, self.main_region.y, self.main_region.x2, self.main_region.y2))
-        if img.mode == "1" or img.mode == "L":
+        img = scan_img.crop(tuple(value / reduction for value in (self.main_region.x, self.main_region.y,
+                                                             self.main_region.x2, self.main_region.y2)))
+        if img.mode == "1" or img.mode == "L" or img.mode == "RGB":
             pass
         elif img.mode == "LA":
             img = img.convert("L")
@@ -408,9 +482,14 @@ class Page:
         if self.dewarp:
             img = straighten(img)
         img = self.align_image(img)
-        img.info['dpi'] = (self.scan.resolution, self.scan.resolution)
+        resolution = self.scan.resolution / reduction
+        img.info['dpi'] = (resolution, resolution)
         return img
     
+    def get_draft_reduction(self, target_resolution: int=None) -> int:
+        
+        return self.scan.get_draft_reduction(target_resolution)
+    
     def align_image(self, img):
         
         if self.alignment_angle == 0.0:
@@ -430,7 +509,7 @@ class Page:
     def get_region_image(self, region: Region):
         
         region = self._calculate_selected_region(region, self.final_rotation_angle)
-        scan_region_image = self.scan.get_raw_image().crop((region.x, region.y, region.x2, region.y2))
+        scan_region_image = self.scan.get_cached_image().crop((region.x, region.y, region.x2, region.y2))
         print(self.final_rotation_angle)
         return self._rotate_image(scan_region_image, self.final_rotation_angle)
 
@@ -508,12 +587,25 @@ class Page:
         if len(self.sub_regions) == 0:
             raise NoRegionsOnPageException()
         return len(self.sub_regions)
+    
+    def _get_size(self):
+        """
+        The size of the raw image in full resolution
+        """
+        
+        region = self.main_region
+        width = round(region.x2) - round(region.x)
+        height = round(region.y2) - round(region.y)
+        if self.final_rotation_angle in (90, 270):
+            return (height, width)
+        return (width, height)
         
     main_algorithm = property(lambda self: self.main_region.mode_algorithm)
     final_rotation_angle = property(_get_final_rotation_angle)
     current_sub_region = property(_get_current_region)
     no_of_sub_regions = property(_get_number_of_sub_regions)
     source_resolution = property(lambda self: self.scan.resolution)
+    size = property(_get_size)
     
 class MetaData(object):
     
@@ -11,8 +11,9 @@ import tempfile
 from zipfile import ZipFile
 
 from PIL import Image, ImageColor
+import cv2
 from PIL.TiffImagePlugin import ImageFileDirectory_v2
-from injector import singleton, inject
+from injector import singleton, inject, Injector
 import ocrmypdf
 from reportlab.lib.units import inch
 from reportlab.lib.utils import ImageReader
@@ -22,13 +23,19 @@ import xml.etree.ElementTree as ET
 
 
 from Asb.ScanConvert2.Algorithms import AlgorithmImplementations, Algorithm, \
-    AlgorithmHelper
-from Asb.ScanConvert2.OCR import OcrRunner, OCRLine, OCRPage, OCRWord
+    AlgorithmHelper, AlgorithmModule, PaletteCache, QUANTIZATION_SEED
+from Asb.ScanConvert2.OCR import OcrRunner, OCRLine, OCRPage, OCRWord,\
+    OUTPUT_HOCR, OUTPUT_ALTO
 from Asb.ScanConvert2.ProjectGenerator import ProjectGenerator, SortType
 from Asb.ScanConvert2.ScanConvertDomain import Project, Page, Region, DDFFile,\
     DDFFileType, ScanPart, PdfMode, Scan
 from exiftool.helper import ExifToolHelper
 from Asb.ScanConvert2.CroppingService import CroppingService
+from Asb.ScanConvert2.ProcessPool import get_number_of_workers, ordered_map
+from Asb.ScanConvert2.Instrumentation import tracer
+from Asb.ScanConvert2.IptcEncoder import IPTCEncoder
+from Asb.ScanConvert2.TiledProcessing import TileProcessor, PageRaster, \
+    MIN_TILED_PROCESSING_PIXELS, get_reduce_factor
 # TODO: Replace minidom with ElementTree
 from xml.dom.minidom import Document
 import re
@@ -278,23 +285,57 @@ class METSService(XMLGenerator):
 
 @singleton
 class IPTCService(object):
+    """
+    Keeps a single exiftool process running (in its -stay_open
+    mode), so tagging a file does not start a new perl interpreter
+    every time. The session is started when it is needed first and
+    ends with close() or with the process.
+    """
     
     SOURCE = "1IPTC:Source"
     CITY = "1IPTC:City"
     SPECIAL_INSTRUCTIONS = "1IPTC:SpecialInstructions"
     CATALOG_SETS = "1IPTC:CatalogSets"
     
-    def write_iptc_tags(self, filename, tags):
+    def __init__(self):
         
-        with ExifToolHelper() as exif_tool:
-            exif_tool.set_tags([filename], tags, ["-P", "-overwrite_original"])
+        self._exif_tool = None
+    
+    def write_iptc_tags(self, filenames, tags):
+        """
+        Writes the tags into a single file or, in one exiftool
+        call, into a list of files.
+        """
+        
+        if isinstance(filenames, str):
+            filenames = [filenames]
+        if len(filenames) == 0:
+            return
+        with tracer.span("exiftool.write_iptc", files=len(filenames)):
+            self._get_exif_tool().set_tags(filenames, tags, ["-P", "-overwrite_original"])
             
-    def read_iptc_tags(self, filename):
+    def read_iptc_tags(self, filenames):
+        """
+        Returns the metadata of a single file or, for a list
+        of files, a list with the metadata of every file.
+        """
+        
+        if isinstance(filenames, str):
+            return self._get_exif_tool().get_metadata([filenames])[0]
+        return self._get_exif_tool().get_metadata(filenames)
+    
+    def close(self):
         
-        with ExifToolHelper() as exif_tool:
-            meta_data = exif_tool.get_meatadata(filename)
-            
-        return meta_data            
+        if self._exif_tool is not None:
+            if self._exif_tool.running:
+                self._exif_tool.terminate()
+            self._exif_tool = None
+    
+    def _get_exif_tool(self) -> ExifToolHelper:
+        
+        if self._exif_tool is None:
+            self._exif_tool = ExifToolHelper()
+        return self._exif_tool
 
 
 @singleton
@@ -317,6 +358,10 @@ class OCRService(object):
         
         page = self.ocr_runner.run_tesseract(img, lang)
         
+        return self.add_ocrpage_to_pdf(page, pdf)
+    
+    def add_ocrpage_to_pdf(self, page: OCRPage, pdf: Canvas) -> Canvas:
+        
         for line in page.lines:
             pdf = self._write_line(line, pdf, page)
         
@@ -390,42 +435,116 @@ class OCRService(object):
         
         return (text_origin_x, text_origin_y)
 
+def _not_cancelled():
+    pass
 
 @singleton
 class FinishingService(object):
     
     @inject
     def __init__(self, algorithm_implementations: AlgorithmImplementations,
-                 algorithm_helper: AlgorithmHelper):
+                 algorithm_helper: AlgorithmHelper,
+                 tile_processor: TileProcessor,
+                 palette_cache: PaletteCache):
         
         self.algorithm_implementations = algorithm_implementations
         self.algorithm_helper = algorithm_helper
+        self.tile_processor = tile_processor
+        # Shared by the quantization algorithms, see PaletteCache
+        self.palette_cache = palette_cache
+        self.min_tiled_processing_pixels = MIN_TILED_PROCESSING_PIXELS
         
     def create_scaled_image(self, scan_or_page, target_resolution: int) -> Image:
-
-        img = scan_or_page.get_raw_image()
-
-        if scan_or_page.source_resolution != target_resolution:
-            img = self.change_resolution(img, target_resolution / scan_or_page.source_resolution)
+        """
+        Jpeg scans are decoded at the smallest size that still has
+        the target resolution, so there is less to decode and resize.
+        """
+
+        with tracer.span("finishing.raw_image"):
+            img = scan_or_page.get_raw_image(target_resolution)
+
+        source_resolution = scan_or_page.source_resolution / scan_or_page.get_draft_reduction(target_resolution)
+        if source_resolution != target_resolution:
+            with tracer.span("finishing.resize"):
+                img = self.change_resolution(img, target_resolution / source_resolution)
             img.info['dpi'] = (target_resolution, target_resolution)
     
         return img
     
-    def create_final_image(self, page: Page, bg_colors: [], target_resolution: int) -> Image:
-        
-        img = page.get_raw_image()
+    def create_final_image(self, page: Page, bg_colors: [], target_resolution: int, raw_img: Image=None,
+                           check_cancelled=None) -> Image:
+        """
+        The algorithm gets the resized image in its input mode, so
+        there is no copy of the page for a mode conversion that is
+        not needed. Besides the raw image and the resized image
+        only the algorithm result takes up the size of the page.
+        
+        Instead of the raw image of the page a reduced version
+        of it (e.g. for a preview) may be given, its dpi tell
+        its resolution.
+        
+        If given, check_cancelled is called between the steps
+        and may raise an exception to stop the rendering.
+        """
+        
+        if check_cancelled is None:
+            check_cancelled = _not_cancelled
+        self._seed_random_generator()
+        if raw_img is None and self._use_tiles(page):
+            return self._create_tiled_final_image(page, bg_colors, target_resolution, check_cancelled)
+
+        source_resolution = page.source_resolution
+        if raw_img is None:
+            with tracer.span("finishing.raw_image"):
+                img = page.get_raw_image()
+        else:
+            img = raw_img.copy()
+            source_resolution = raw_img.info['dpi'][0]
 
         target_source_ratio = 1.0        
         if page.source_resolution != target_resolution:
             target_source_ratio = target_resolution / page.source_resolution
-            img = self.change_resolution(img, target_source_ratio)
-        
-        bg_img = img.convert("RGB")
-        bg_img, bg_color = self.algorithm_implementations[page.main_region.mode_algorithm].transform(bg_img, None)
+        if source_resolution != target_resolution:
+            with tracer.span("finishing.resize"):
+                img = self.change_resolution(img, target_resolution / source_resolution)
+        
+        check_cancelled()
+        algorithm = self.algorithm_implementations[page.main_region.mode_algorithm]
+        with tracer.span("finishing.algorithm", algorithm="%s" % page.main_region.mode_algorithm):
+            bg_img, bg_color = algorithm.transform(self.algorithm_helper.convert_image(img, algorithm.input_mode), None)
+        check_cancelled()
         if bg_color is not None:
             # We might have had a page with similar colors already
-            bg_img, bg_color, bg_colors = self._substitute_bg_color(bg_img, bg_color, bg_colors)
-        final_img = self._apply_regions(page.sub_regions, bg_img, img, bg_color, target_source_ratio)
+            with tracer.span("finishing.bg_color"):
+                bg_img, bg_color, bg_colors = self._substitute_bg_color(bg_img, bg_color, bg_colors)
+        with tracer.span("finishing.regions"):
+            final_img = self._apply_regions(page.sub_regions, bg_img, img, bg_color, target_source_ratio, check_cancelled)
+        return final_img, bg_colors
+
+    def _use_tiles(self, page: Page) -> bool:
+        """
+        Very large pages are processed in tiles, if the algorithm
+        allows it and the page does not need the whole image for
+        dewarping or alignment
+        """
+        
+        if page.main_region.width * page.main_region.height < self.min_tiled_processing_pixels:
+            return False
+        if not getattr(self.algorithm_implementations[page.main_region.mode_algorithm], "tile_safe", False):
+            return False
+        return not page.dewarp and page.alignment_angle == 0.0
+
+    def _create_tiled_final_image(self, page: Page, bg_colors: [], target_resolution: int, check_cancelled) -> Image:
+        
+        raster = PageRaster(page, target_resolution)
+        algorithm = self.algorithm_implementations[page.main_region.mode_algorithm]
+        with tracer.span("finishing.algorithm", algorithm="%s" % page.main_region.mode_algorithm, tiled=True):
+            final_img = self.tile_processor.transform(raster, algorithm, None)
+        with tracer.span("finishing.regions"):
+            for region in page.sub_regions:
+                check_cancelled()
+                box = self._get_region_box(region, raster.ratio)
+                final_img = self._paste_region(region, final_img, raster.get_image(box), None, box)
         return final_img, bg_colors
 
     def create_pdf_image(self, page: Page, bg_colors, project_properties) -> Image:
@@ -434,37 +553,84 @@ class FinishingService(object):
             img, bg_colors = self.create_final_image(page, bg_colors=bg_colors, target_resolution=project_properties.pdf_resolution)
             return img
         
-        img = page.get_raw_image()
+        with tracer.span("finishing.raw_image"):
+            img = page.get_raw_image()
 
         target_source_ratio = 1.0        
         if page.source_resolution != project_properties.pdf_resolution:
             target_source_ratio = project_properties.pdf_resolution / page.source_resolution
-            img = self.change_resolution(img, target_source_ratio)
+            with tracer.span("finishing.resize"):
+                img = self.change_resolution(img, target_source_ratio)
             
         if project_properties.pdf_mode == PdfMode.ORIGINAL:
             return img
         
         # OCR_PICTURE_MODE_OTSU
-        img = img.convert("RGB")
-        if project_properties.pdf_mode == PdfMode.OTSU:
-            img, bg_color = self.algorithm_implementations[Algorithm.OTSU].transform(img, None)
-        elif project_properties.pdf_mode == PdfMode.SAUVOLA:
-            img, bg_color = self.algorithm_implementations[Algorithm.SAUVOLA].transform(img, None)
-        else:
-            raise Exception("Unsupported PdfMode %s" % project_properties.pdf_mode)
+        with tracer.span("finishing.ocr_image", mode="%s" % project_properties.pdf_mode):
+            if project_properties.pdf_mode == PdfMode.OTSU:
+                algorithm = self.algorithm_implementations[Algorithm.OTSU]
+            elif project_properties.pdf_mode == PdfMode.SAUVOLA:
+                algorithm = self.algorithm_implementations[Algorithm.SAUVOLA]
+            else:
+                raise Exception("Unsupported PdfMode %s" % project_properties.pdf_mode)
+            img, bg_color = algorithm.transform(self.algorithm_helper.convert_image(img, algorithm.input_mode), None)
 
         return img
 
-    def _substitute_bg_color(self, bg_img, bg_color, bg_colors):
+    def get_background_color(self, page: Page, target_resolution: int):
+        """
+        Returns the background color the main algorithm of the
+        page determines, before any substitution takes place. For
+        algorithms that do not determine a background color, this
+        is just None and nothing is calculated.
+        """
+        
+        algorithm = self.algorithm_implementations[page.main_region.mode_algorithm]
+        if not getattr(algorithm, "determines_bg_color", False):
+            return None
         
+        self._seed_random_generator()
+        img = page.get_raw_image()
+        if page.source_resolution != target_resolution:
+            img = self.change_resolution(img, target_resolution / page.source_resolution)
+        _, bg_color = algorithm.transform(self.algorithm_helper.convert_image(img, algorithm.input_mode), None)
+        return bg_color
+    
+    def _seed_random_generator(self):
+        """
+        The k-means of the quantization algorithms starts from
+        random centers. Pages are rendered and their background
+        colors determined in different worker processes, so the
+        random generator of cv2 is seeded for every page and the
+        result does not depend on the process or the pages it
+        has processed before.
+        """
+        
+        cv2.setRNGSeed(QUANTIZATION_SEED)
+    
+    def register_bg_color(self, bg_color, bg_colors):
+        """
+        Does the bookkeeping of _substitute_bg_color without touching
+        an image: Returns the color that replaces the given background
+        color and adds the background color to the known colors, if
+        it is a new one.
+        """
+
         for color in bg_colors:
             if color == bg_color:
-                return bg_img, bg_color, bg_colors
+                return bg_color
             if self.algorithm_helper.colors_are_similar(color, bg_color):
-                return self.algorithm_helper.replace_color_with_color(bg_img, bg_color, color), color, bg_colors
+                return color
         # There is a new background color that differs sufficiently from all the other background colors
         bg_colors.append(bg_color)
-        return bg_img, bg_color, bg_colors
+        return bg_color
+
+    def _substitute_bg_color(self, bg_img, bg_color, bg_colors):
+        
+        substitute = self.register_bg_color(bg_color, bg_colors)
+        if substitute != bg_color:
+            bg_img = self.algorithm_helper.replace_color_with_color(bg_img, bg_color, substitute)
+        return bg_img, substitute, bg_colors
 
     def change_resolution(self, img: Image, target_source_ratio: float) -> Image:
 
@@ -472,38 +638,74 @@ class FinishingService(object):
         new_width = int(current_width * target_source_ratio)
         new_height = int(current_height * target_source_ratio)
 
-        resized_img = img.resize((new_width, new_height))
+        reduce_factor = get_reduce_factor(target_source_ratio)
+        if reduce_factor is not None and img.mode not in ("1", "P"):
+            resized_img = img.reduce(reduce_factor, box=(0, 0, new_width * reduce_factor, new_height * reduce_factor))
+        else:
+            resized_img = img.resize((new_width, new_height))
         new_dpi = img.info['dpi'][0] * target_source_ratio
         resized_img.info['dpi'] = (new_dpi, new_dpi)
         return resized_img
         
-    def _apply_regions(self, regions: [], bg_img: Image, original_img: Image, bg_color: (), target_source_ratio: float) -> Image:
+    def _apply_regions(self, regions: [], bg_img: Image, original_img: Image, bg_color: (), target_source_ratio: float,
+                       check_cancelled=None) -> Image:
         
-        final_img = bg_img.copy()
+        if len(regions) == 0:
+            return bg_img
+        final_img = bg_img
+        if final_img is original_img:
+            # Algorithms like NONE return the image itself, but
+            # the regions need the original image
+            final_img = bg_img.copy()
         for idx in range(0, len(regions)):
+            if check_cancelled is not None:
+                check_cancelled()
             final_img = self._apply_region(regions[idx], final_img, original_img, bg_color, target_source_ratio)
     
         return final_img
     
     def _apply_region(self, region: Region, final_img: Image, img: Image, bg_color, target_source_ratio) -> Image:
         
-        region_img = img.crop((round(region.x * target_source_ratio),
-                               round(region.y * target_source_ratio),
-                               round(region.x2 * target_source_ratio),
-                               round(region.y2 * target_source_ratio)))
+        box = self._get_region_box(region, target_source_ratio)
+        return self._paste_region(region, final_img, img.crop(box), bg_color, box)
+
+    def _get_region_box(self, region: Region, target_source_ratio: float) -> ():
+        
+        return (round(region.x * target_source_ratio),
+                round(region.y * target_source_ratio),
+                round(region.x2 * target_source_ratio),
+                round(region.y2 * target_source_ratio))
+
+    def _paste_region(self, region: Region, final_img: Image, region_img: Image, bg_color, box: ()) -> Image:
+        
         region_img, bg_color = self._apply_algorithm(region_img, region.mode_algorithm, bg_color)
+        final_img, region_img = self._match_modes(final_img, region_img)
+        final_img.paste(region_img, box)
+        return final_img
+
+    def _match_modes(self, final_img: Image, region_img: Image) -> (Image, Image):
+        """
+        Converts the page image to a mode that can take the region
+        image. Palette images (from the quantization algorithms) stay
+        palette images if the region is a palette or bilevel image
+        and the colors of both fit into one palette.
+        """
+        
+        if "P" in (final_img.mode, region_img.mode) and final_img.mode in ("1", "P") and region_img.mode in ("1", "P"):
+            merged_images = self.algorithm_helper.merge_palette_images(self.algorithm_helper.to_palette_image(final_img),
+                                                                       self.algorithm_helper.to_palette_image(region_img))
+            if merged_images is not None:
+                return merged_images
+        if final_img.mode == "P" or region_img.mode == "P":
+            return final_img.convert("RGB"), region_img.convert("RGB")
+        
         if final_img.mode == "1":
             if region_img.mode in ("L", "RGB"):
                 final_img = final_img.convert(region_img.mode)
         elif final_img.mode == "L":
             if region_img.mode == "RGB":
                 final_img = final_img.convert(region_img.mode)
-             
-        final_img.paste(region_img, (round(region.x * target_source_ratio),
-                                     round(region.y * target_source_ratio),
-                                     round(region.x2 * target_source_ratio),
-                                     round(region.y2 * target_source_ratio)))
-        return final_img
+        return final_img, region_img
 
     def _apply_algorithm(self, img: Image, algorithm: Algorithm, bg_color):
                 
@@ -514,8 +716,28 @@ class FinishingService(object):
         return self.algorithm_implementations[algorithm].get_bg_color(img, mode)
 
 
+class RenderedPdfPage(object):
+    """
+    Everything the pdf writer needs to know about a page: The
+    png encoded page image, its size in dots and the ocr result.
+    """
+    
+    def __init__(self, page_no: int, png_data: bytes, size: (), ocr_page: OCRPage=None):
+        
+        self.page_no = page_no
+        self.png_data = png_data
+        self.size = size
+        self.ocr_page = ocr_page
+
+
 @singleton
 class PdfService:
+    """
+    Creates a pdf file from a project. The pages are rendered and
+    ocred in parallel in worker processes, but written to the pdf
+    canvas in page order by the calling process, so the output
+    does not depend on the number of workers.
+    """
     
     @inject
     def __init__(self,
@@ -526,10 +748,131 @@ class PdfService:
         self.ocr_service = ocr_service
         self.finishing_service = finishing_service
         self.algorithm_helper = algorithm_helper
+        self.max_workers = None
     
-    def create_pdf_file(self, project: Project, filebase: str):
+    def create_pdf_file(self, project: Project, filebase: str, ocr_pages: []=None, progress_callback=None):
+        """
+        If the caller already has run ocr on the pages, it may
+        hand in the results (one per project page) and we do not
+        need to run tesseract again. The progress callback is
+        called with the number of written pages and the total
+        number of pages.
+        """
    
+        with tracer.span("pdf.bg_colors"):
+            page_bg_colors = self.collect_background_colors(project)
+        tasks = []
+        for page_no in range(0, len(project.pages)):
+            page = project.pages[page_no]
+            if page.skip_page:
+                continue
+            ocr_page = None
+            if ocr_pages is not None:
+                ocr_page = ocr_pages[page_no]
+            tasks.append((page_no + 1, page, page_bg_colors[page_no], project.project_properties, ocr_page))
+        
+        no_of_workers = get_number_of_workers(len(tasks), self.max_workers)
+        if no_of_workers > 1:
+            rendered_pages = ordered_map(_render_pdf_page, tasks, no_of_workers)
+        else:
+            rendered_pages = (self.render_page(*task) for task in tasks)
+        if progress_callback is not None:
+            rendered_pages = self._report_progress(rendered_pages, len(tasks), progress_callback)
+
+        self.write_pdf_file(project, rendered_pages, filebase)
+    
+    def _report_progress(self, rendered_pages, no_of_pages: int, progress_callback):
+        
+        counter = 0
+        for rendered_page in rendered_pages:
+            yield rendered_page
+            counter += 1
+            progress_callback(counter, no_of_pages)
+        
+    def collect_background_colors(self, project: Project) -> []:
+        """
+        The background color normalization depends on the order of
+        the pages: A page gets the background color of the first page
+        with a similar color. So before the pages may be rendered
+        independently, we determine in page order which background
+        colors are already known when a page is rendered.
+        
+        Returns a list with the known background colors for every page.
+        """
+        
+        properties = project.project_properties
+        pages = []
+        for page in project.pages:
+            if self._registers_bg_color(page, properties):
+                pages.append(page)
+        
+        tasks = [(page, properties.pdf_resolution) for page in pages]
+        no_of_workers = get_number_of_workers(len(tasks), self.max_workers)
+        if no_of_workers > 1:
+            page_colors = ordered_map(_get_background_color, tasks, no_of_workers)
+        else:
+            page_colors = (self.finishing_service.get_background_color(*task) for task in tasks)
+        page_colors = dict(zip([id(page) for page in pages], page_colors))
+        
         bg_colors = []
+        page_bg_colors = []
+        for page in project.pages:
+            page_bg_colors.append(list(bg_colors))
+            bg_color = page_colors.get(id(page))
+            if bg_color is not None:
+                self.finishing_service.register_bg_color(bg_color, bg_colors)
+        
+        return page_bg_colors
+    
+    def _registers_bg_color(self, page: Page, properties) -> bool:
+        """
+        Replicates when a page image is calculated with the
+        final image algorithms and thus may add a background color
+        """
+        
+        if page.skip_page:
+            return False
+        algorithm = self.finishing_service.algorithm_implementations[page.main_region.mode_algorithm]
+        if not getattr(algorithm, "determines_bg_color", False):
+            return False
+        if properties.pdf_mode != PdfMode.MANUAL_WITH_ORIGINAL:
+            return True
+        return properties.run_ocr
+        
+    def render_page(self, page_no: int, page: Page, bg_colors: [], project_properties, ocr_page: OCRPage=None) -> RenderedPdfPage:
+        """
+        Creates the page image and the ocr result for a single page.
+        """
+        
+        with tracer.span("pdf.render_page", page=page_no):
+            return self._render_page(page_no, page, bg_colors, project_properties, ocr_page)
+        
+    def _render_page(self, page_no: int, page: Page, bg_colors: [], project_properties, ocr_page: OCRPage) -> RenderedPdfPage:
+        
+        bg_colors = list(bg_colors)
+        if project_properties.pdf_mode == PdfMode.MANUAL_WITH_ORIGINAL: 
+            image = page.get_raw_image()
+        else:
+            image, bg_colors = self.finishing_service.create_final_image(page, bg_colors, project_properties.pdf_resolution)
+
+        img_stream = io.BytesIO()
+        # if image.mode == "1":
+        with tracer.span("pdf.png_encode"):
+            image.save(img_stream, format='png')
+        # else:
+        # image.save(img_stream, format='jpeg2000', quality=65, optimize=True)
+        
+        if project_properties.run_ocr and ocr_page is None:
+            if project_properties.pdf_mode == PdfMode.MANUAL:
+                # This is exactly the image we already have
+                ocr_image = image
+            else:
+                ocr_image = self.finishing_service.create_pdf_image(page, bg_colors, project_properties)
+            ocr_page = self.ocr_service.ocr_runner.run_tesseract(ocr_image, project_properties.ocr_lang)
+        
+        return RenderedPdfPage(page_no, img_stream.getvalue(), image.size, ocr_page)
+    
+    def write_pdf_file(self, project: Project, rendered_pages, filebase: str):
 
         with tempfile.TemporaryDirectory() as temp_dir:
             temp_file = os.path.join(temp_dir, "output.pdf")
@@ -540,46 +883,30 @@ class PdfService:
             pdf.setKeywords(project.metadata.keywords)
             pdf.setSubject(project.metadata.subject)
         
-            page_counter = 0
+            resolution = project.project_properties.pdf_resolution
+            for rendered_page in rendered_pages:
+                width_in_dots, height_in_dots = rendered_page.size
             
-            for page in project.pages:
-                page_counter += 1
-                print("Processing page %d/%d." % (page_counter, len(project.pages)))
-                if page.skip_page:
-                    continue
-
-                if project.project_properties.pdf_mode == PdfMode.MANUAL_WITH_ORIGINAL: 
-                    image = page.get_raw_image()
-                else:
-                    image, new_bg_colors = self.finishing_service.create_final_image(page, bg_colors, project.project_properties.pdf_resolution)
-                    if project.project_properties.normalize_background_colors:
-                        bg_colors = new_bg_colors
-                width_in_dots, height_in_dots = image.size
-            
-                page_width = width_in_dots * 72 / project.project_properties.pdf_resolution
-                page_height = height_in_dots * 72 / project.project_properties.pdf_resolution
+                page_width = width_in_dots * 72 / resolution
+                page_height = height_in_dots * 72 / resolution
             
-                pdf.setPageSize((width_in_dots * inch / project.project_properties.pdf_resolution,
-                                 height_in_dots * inch / project.project_properties.pdf_resolution))
-                img_stream = io.BytesIO()
-                # if image.mode == "1":
-                image.save(img_stream, format='png')
-                # else:
-                # image.save(img_stream, format='jpeg2000', quality=65, optimize=True)
-                img_stream.seek(0)
-                img_reader = ImageReader(img_stream)
-                pdf.drawImage(img_reader, 0, 0, width=page_width, height=page_height)
-                if project.project_properties.run_ocr:
-                    ocr_image = self.finishing_service.create_pdf_image(page, bg_colors, project.project_properties)
-                    pdf = self.ocr_service.add_ocrresult_to_pdf(ocr_image, pdf, project.project_properties.ocr_lang)
-                pdf.showPage()
-        
-            pdf.save()
+                with tracer.span("pdf.write_page", page=rendered_page.page_no):
+                    pdf.setPageSize((width_in_dots * inch / resolution,
+                                     height_in_dots * inch / resolution))
+                    img_reader = ImageReader(io.BytesIO(rendered_page.png_data))
+                    pdf.drawImage(img_reader, 0, 0, width=page_width, height=page_height)
+                    if rendered_page.ocr_page is not None:
+                        pdf = self.ocr_service.add_ocrpage_to_pdf(rendered_page.ocr_page, pdf)
+                    pdf.showPage()
+        
+            with tracer.span("pdf.save"):
+                pdf.save()
             # Convert to pdfa and optimize graphics
             if project.project_properties.create_pdfa:
                 # ocrmypdf.configure_logging(verbosity=Verbosity.quiet)
                 ocrmypdf_temp_file = os.path.join(temp_dir, "ocrmypdf_output.pdf")
-                ocrmypdf.ocr(temp_file, ocrmypdf_temp_file, skip_text=True)
+                with tracer.span("pdf.ocrmypdf"):
+                    ocrmypdf.ocr(temp_file, ocrmypdf_temp_file, skip_text=True)
                 #document = PdfDocument(ocrmypdf_temp_file)
                 #document.set_metadata(project.metadata.as_pdf_metadata_dict())
                 #document.save(self._get_file_name(filebase))
@@ -593,6 +920,26 @@ class PdfService:
             return filebase
         return filebase + ".pdf"
 
+_worker_pdf_service = None
+
+def _get_worker_pdf_service() -> PdfService:
+    """
+    Worker processes build their own service graph once
+    """
+    
+    global _worker_pdf_service
+    if _worker_pdf_service is None:
+        _worker_pdf_service = Injector([AlgorithmModule]).get(PdfService)
+    return _worker_pdf_service
+
+def _render_pdf_page(task) -> RenderedPdfPage:
+    
+    return _get_worker_pdf_service().render_page(*task)
+
+def _get_background_color(task):
+    
+    return _get_worker_pdf_service().finishing_service.get_background_color(*task)
+
 
 class ExportService(object):
 
@@ -647,7 +994,11 @@ class TiffService(ExportService):
     
         self.finishing_service = finishing_service
         
-    def create_tiff_file_archive(self, project: Project, filebase):
+    def create_tiff_file_archive(self, project: Project, filebase, progress_callback=None):
+        '''
+        The progress callback is called with the number of written
+        pages and the total number of pages.
+        '''
         
         zipfile = ZipFile(self._get_file_name(filebase, "zip"), mode='w')
         tiff_meta_data = self._build_tiff_metadata(project)
@@ -662,9 +1013,14 @@ class TiffService(ExportService):
                 tiff_meta_data[self.page_name_tag] = "Seite %d von %d des Dokuments" % (counter, no_of_pages)
                 page_name = "Seite%04d.tif" % counter
                 file_name = os.path.join(tempdir, page_name)
-                img = self.finishing_service.create_scaled_image(page, project.project_properties.tif_resolution)
-                img.save(file_name, tiffinfo=tiff_meta_data, compression="tiff_lzw")
-                zipfile.write(file_name, page_name)
+                with tracer.span("tif.page", page=counter):
+                    img = self.finishing_service.create_scaled_image(page, project.project_properties.tif_resolution)
+                    with tracer.span("tif.tiff_encode"):
+                        img.save(file_name, tiffinfo=tiff_meta_data, compression="tiff_lzw")
+                    with tracer.span("tif.zip"):
+                        zipfile.write(file_name, page_name)
+                if progress_callback is not None:
+                    progress_callback(counter, no_of_pages)
             
             readme_file = os.path.join(tempdir, "readme.txt")
             with open(readme_file, 'w') as readme:
@@ -684,6 +1040,32 @@ class TiffService(ExportService):
             zipfile.close()
 
 
+class DDFPageResult(object):
+    """
+    The files of a single page: The display jpeg (on disk), its
+    alto and the rendered page for the pdf (None for skipped pages).
+    """
+    
+    def __init__(self, page_no: int, display_file: DDFFile, alto: bytes, rendered_page: RenderedPdfPage):
+        
+        self.page_no = page_no
+        self.display_file = display_file
+        self.alto = alto
+        self.rendered_page = rendered_page
+
+class DDFScanResult(object):
+    """
+    The archive tif of a scan (on disk), its alto and the
+    results for the pages on the scan.
+    """
+    
+    def __init__(self, scan_no: int, archive_file: DDFFile, archive_alto: bytes, page_results: []):
+        
+        self.scan_no = scan_no
+        self.archive_file = archive_file
+        self.archive_alto = archive_alto
+        self.page_results = page_results
+
 @singleton
 class DDFService(ExportService, XMLGenerator):
     
@@ -694,132 +1076,240 @@ class DDFService(ExportService, XMLGenerator):
                  cropping_service: CroppingService,
                  ocr_runner: OcrRunner,
                  pdf_service: PdfService,
-                 mets_service: METSService
+                 mets_service: METSService,
+                 iptc_encoder: IPTCEncoder
                  ):
         
         self.finishing_service = finishing_service
         self.iptc_service = iptc_service
+        self.iptc_encoder = iptc_encoder
         self.cropping_service = cropping_service
         self.ocr_runner = ocr_runner
         self.pdf_service = pdf_service
         self.mets_service = mets_service
+        self.max_workers = None
     
-    def create_ddf_file_archive(self, project: Project, filebase):
+    def create_ddf_file_archive(self, project: Project, filebase, progress_callback=None):
+        '''
+        Every scan is decoded just once: A task creates the archive
+        tif of a scan and the display jpegs and pdf page images of its
+        pages from the same decoded image. The finished files are
+        streamed into the zip file and deleted at once, the pdf page
+        images go straight to the pdf writer. So only the files of the
+        scans currently in work are in the temporary directory.
+        
+        The progress callback is called with the number of finished
+        scans and the total number of scans.
+        '''
+        
+        try:
+            self._create_ddf_file_archive(project, filebase, progress_callback)
+        finally:
+            self.iptc_service.close()
+
+    def _create_ddf_file_archive(self, project: Project, filebase, progress_callback=None):
         
         with tempfile.TemporaryDirectory() as tempdir:
-
-            projectfiles = self._write_scans(project, tempdir)
-            projectfiles += self._write_pages(project, tempdir)
-
-            pdf_file = self._write_stupid_pdf(project, tempdir)
-            self._join_alto_files(projectfiles, "%s.alto" % pdf_file.temp_file_name)
-            projectfiles.append(pdf_file)
-            
-            mets_file_name = os.path.join(tempdir, "%s_display.mets" % project.metadata.ddf_prefix)
-            mets_file = self.mets_service.export_mets_data(DDFFileType.DISPLAY, project, projectfiles, mets_file_name)
-            projectfiles.append(mets_file)
-            
-            mets_file_name = os.path.join(tempdir, "%s_archive.mets" % project.metadata.ddf_prefix)
-            mets_file = self.mets_service.export_mets_data(DDFFileType.ARCHIVE, project, projectfiles, mets_file_name)
-            projectfiles.append(mets_file)
-            
-            ddf_xml_file_name = os.path.join(tempdir, "%s_ddf.xml" % project.metadata.ddf_prefix)
-            ddf_xml_file = self._write_ddf_xml(project, ddf_xml_file_name)
-            projectfiles.append(ddf_xml_file)
-
-            self._create_zip_file(filebase, projectfiles)
-    
-    def _create_zip_file(self, filebase, projectfiles):
-
-        zipfile = ZipFile(self._get_file_name(filebase, "zip"), mode='w')
-        for ddf_file in projectfiles:
-            zipfile.write(ddf_file.temp_file_name, "%s/%s" % (ddf_file.directory, os.path.basename(ddf_file.temp_file_name)))
-            try:
-                zipfile.write(ddf_file.alto_file_name, "%s/%s" % (ddf_file.directory, os.path.basename(ddf_file.alto_file_name)))
-            except:
-                pass
-        zipfile.close()
-        
-    def _write_scans(self, project, tempdir):
-
-            projectfiles = []        
-            no_of_scans = len(project.pages)
-            file_prefix = project.metadata.ddf_prefix
-            
-            tiff_meta_data = self._build_tiff_metadata(project)
-            tiff_meta_data[self.x_resolution] = 400
-            tiff_meta_data[self.y_resolution] = 400
-
-            iptc_tags = self._build_iptc_metadata(project)
-            
-            counter = 0
-            for scan in project.scans:
+            with ZipFile(self._get_file_name(filebase, "zip"), mode='w') as zipfile:
+
+                archive_files = []
+                display_files = []
+                display_altos = []
+                rendered_pages = self._stream_scans(project, tempdir, zipfile, archive_files, display_files, display_altos,
+                                                    progress_callback)
+                pdf_file = self._write_stupid_pdf(project, tempdir, rendered_pages)
+                with tracer.span("ddf.join_alto"):
+                    self._join_alto_files(display_altos, "%s.alto" % pdf_file.temp_file_name)
+                self._add_to_zip_file(zipfile, pdf_file)
+                projectfiles = archive_files + display_files + [pdf_file]
                 
-                counter += 1
-                
-                tiff_meta_data[self.page_name_tag] = "Scan %d von %d" % (counter, no_of_scans)
-                
-                if project.project_properties.sort_type == SortType.SHEET:
-                    sequence_no = "%05d" % int(((counter - 1) / 2) + 1)
-                    if counter % 2 == 0:
-                        sequence_no += "verso"
-                    else:
-                        sequence_no += "recto"
-                elif project.project_properties.sort_type == SortType.SHEET_ALL_FRONT_ALL_BACK:
-                    sheet_no = counter
-                    if counter > no_of_scans / 2:
-                        sheet_no = counter - (no_of_scans / 2)
-                        sequence_no = "%05verso" % sheet_no
-                    else: 
-                        sequence_no = "%05recto" % sheet_no
-                else:
-                    sequence_no = "%05d" % counter
-                scan_file_name = "%s%s.tif" % (file_prefix, sequence_no)
-                file_name = os.path.join(tempdir, scan_file_name)
-                ddf_file = DDFFile(DDFFileType.ARCHIVE, sequence_no, file_name)
-                ddf_file.img_object = scan
-                projectfiles.append(ddf_file)
-
-                img = self.finishing_service.create_scaled_image(scan, 400)
-                transposition = self.get_transposition(project, counter)
-                if transposition is not None:
-                    img = img.transpose(transposition)
-                if counter == 1:
-                    img = self.add_color_card(img)
-                img = self.add_black_border(img)
-                img.save(file_name, tiffinfo=tiff_meta_data, compression=None)
-                self._write_alto_file(img, ddf_file.alto_file_name, project.project_properties.ocr_lang)
-                self.iptc_service.write_iptc_tags(file_name, iptc_tags)
-
-            return projectfiles
-
-    def _write_pages(self, project, tempdir):
-
-            projectfiles = []
+                with tracer.span("ddf.metadata"):
+                    mets_file_name = os.path.join(tempdir, "%s_display.mets" % project.metadata.ddf_prefix)
+                    mets_file = self.mets_service.export_mets_data(DDFFileType.DISPLAY, project, projectfiles, mets_file_name)
+                    projectfiles.append(mets_file)
                     
-            no_of_pages = len(project.pages)
-            file_prefix = project.metadata.ddf_prefix
-            # TODO: Create Metadata
-            
-            iptc_tags = self._build_iptc_metadata(project)
-            
-            counter = 0
-            for page in project.pages:
-                counter += 1
-                
-                scan_file_name = "%s%05d.jpg" % (file_prefix, counter)
-                file_name = os.path.join(tempdir, scan_file_name)
-                ddf_file = DDFFile(DDFFileType.DISPLAY, counter, file_name)
-                ddf_file.img_object = page
-                projectfiles.append(ddf_file)
-
-                img = self.finishing_service.create_scaled_image(page, 300)
-                self._write_alto_file(img, ddf_file.alto_file_name, project.project_properties.ocr_lang)
-                img.save(file_name, quality=95, optimize=True)
-                self.iptc_service.write_iptc_tags(file_name, iptc_tags)
-    
-            return projectfiles
+                    mets_file_name = os.path.join(tempdir, "%s_archive.mets" % project.metadata.ddf_prefix)
+                    mets_file = self.mets_service.export_mets_data(DDFFileType.ARCHIVE, project, projectfiles, mets_file_name)
+                    projectfiles.append(mets_file)
+                    
+                    ddf_xml_file_name = os.path.join(tempdir, "%s_ddf.xml" % project.metadata.ddf_prefix)
+                    ddf_xml_file = self._write_ddf_xml(project, ddf_xml_file_name)
+                    projectfiles.append(ddf_xml_file)
+
+                for ddf_file in projectfiles[-3:]:
+                    self._add_to_zip_file(zipfile, ddf_file)
+
+    def _stream_scans(self, project, tempdir, zipfile, archive_files, display_files, display_altos, progress_callback=None):
+        '''
+        Renders the scans (in worker processes, if possible), adds
+        the files to the zip file and yields the pdf page images
+        in page order. The lists are filled on the fly.
+        '''
+        
+        tasks = self._create_scan_tasks(project, tempdir)
+        no_of_workers = get_number_of_workers(len(tasks), self.max_workers)
+        if no_of_workers > 1:
+            scan_results = ordered_map(_render_ddf_scan, tasks, no_of_workers)
+        else:
+            scan_results = (self.render_scan(*task) for task in tasks)
+        
+        # Depending on the sort type, the pages of a
+        # scan do not follow each other
+        finished_pages = {}
+        next_page_no = 1
+        finished_scans = 0
+        for scan_result in scan_results:
+            scan_result.archive_file.img_object = project.scans[scan_result.scan_no - 1]
+            archive_files.append(scan_result.archive_file)
+            self._add_to_zip_file(zipfile, scan_result.archive_file, scan_result.archive_alto)
+            for page_result in scan_result.page_results:
+                page_result.display_file.img_object = project.pages[page_result.page_no - 1]
+                self._add_to_zip_file(zipfile, page_result.display_file, page_result.alto)
+                finished_pages[page_result.page_no] = page_result
+            while next_page_no in finished_pages:
+                page_result = finished_pages.pop(next_page_no)
+                display_files.append(page_result.display_file)
+                display_altos.append(page_result.alto)
+                next_page_no += 1
+                if page_result.rendered_page is not None:
+                    yield page_result.rendered_page
+            finished_scans += 1
+            if progress_callback is not None:
+                progress_callback(finished_scans, len(tasks))
+
+    def _create_scan_tasks(self, project, tempdir) -> []:
+        '''
+        The background colors depend on the page order, so they
+        are determined before the scans are rendered independently.
+        '''
+        
+        page_bg_colors = self.pdf_service.collect_background_colors(project)
+        no_of_scans = len(project.pages)
         
+        tiff_meta_data = self._build_tiff_metadata(project)
+        tiff_meta_data[self.x_resolution] = 400
+        tiff_meta_data[self.y_resolution] = 400
+        iptc_tags = self._build_iptc_metadata(project)
+
+        tasks = []
+        counter = 0
+        for scan in project.scans:
+            counter += 1
+            pages = []
+            for page_idx in range(0, len(project.pages)):
+                if project.pages[page_idx].scan == scan:
+                    pages.append((page_idx + 1, project.pages[page_idx], page_bg_colors[page_idx]))
+            tasks.append((counter,
+                          scan,
+                          self._get_sequence_no(project, counter, no_of_scans),
+                          self.get_transposition(project, counter),
+                          pages,
+                          project.project_properties,
+                          project.metadata.ddf_prefix,
+                          tiff_meta_data,
+                          "Scan %d von %d" % (counter, no_of_scans),
+                          iptc_tags,
+                          tempdir))
+        return tasks
+
+    def _get_sequence_no(self, project, counter, no_of_scans) -> str:
+        
+        if project.project_properties.sort_type == SortType.SHEET:
+            sequence_no = "%05d" % int(((counter - 1) / 2) + 1)
+            if counter % 2 == 0:
+                sequence_no += "verso"
+            else:
+                sequence_no += "recto"
+        elif project.project_properties.sort_type == SortType.SHEET_ALL_FRONT_ALL_BACK:
+            sheet_no = counter
+            if counter > no_of_scans / 2:
+                sheet_no = counter - (no_of_scans / 2)
+                sequence_no = "%05verso" % sheet_no
+            else: 
+                sequence_no = "%05recto" % sheet_no
+        else:
+            sequence_no = "%05d" % counter
+        return sequence_no
+
+    def render_scan(self, scan_no, scan, sequence_no, transposition, pages, project_properties,
+                    file_prefix, tiff_meta_data, page_name, iptc_tags, tempdir):
+        '''
+        Creates the archive tif of the scan and the files of its
+        pages. The scan cache hands the decoded scan to the pages.
+        
+        The iptc tags are embedded when the files are written. Only
+        if we do not know how to encode the tags, exiftool has to
+        tag the files afterwards (all files of the scan at once).
+        '''
+        
+        embed_iptc_tags = self.iptc_encoder.can_encode(iptc_tags)
+        jpeg_segments = b""
+        if embed_iptc_tags:
+            tiff_meta_data = self.iptc_encoder.add_to_tiff_metadata(tiff_meta_data, iptc_tags)
+            jpeg_segments = self.iptc_encoder.get_jpeg_segment(iptc_tags)
+        
+        scan_file_name = os.path.join(tempdir, "%s%s.tif" % (file_prefix, sequence_no))
+        archive_file = DDFFile(DDFFileType.ARCHIVE, sequence_no, scan_file_name)
+        with tracer.span("ddf.scan", scan=scan_no):
+            img = self.finishing_service.create_scaled_image(scan, 400)
+            if transposition is not None:
+                img = img.transpose(transposition)
+            if scan_no == 1:
+                img = self.add_color_card(img)
+            img = self.add_black_border(img)
+            tiff_meta_data[self.page_name_tag] = page_name
+            with tracer.span("ddf.tiff_encode"):
+                img.save(scan_file_name, tiffinfo=tiff_meta_data, compression=None)
+            archive_alto = self._get_alto_data(self.ocr_runner.run_tesseract_for_alto(img, project_properties.ocr_lang))
+
+        page_results = []
+        for page_no, page, bg_colors in pages:
+            page_results.append(self.render_display_page(page_no, page, bg_colors, project_properties, file_prefix, jpeg_segments, tempdir))
+        if not embed_iptc_tags:
+            self.iptc_service.write_iptc_tags([scan_file_name] + [page_result.display_file.temp_file_name for page_result in page_results],
+                                              iptc_tags)
+        return DDFScanResult(scan_no, archive_file, archive_alto, page_results)
+
+    def render_display_page(self, page_no, page, bg_colors, project_properties, file_prefix, jpeg_segments: bytes, tempdir):
+        '''
+        Writes the display image with the given additional jpeg
+        segments (the iptc data). If the pdf needs ocr, we let
+        tesseract create the hocr in the same run as the alto
+        and hand the ocr page to the pdf page.
+        '''
+
+        outputs = (OUTPUT_ALTO,)
+        if project_properties.run_ocr:
+            outputs = (OUTPUT_HOCR, OUTPUT_ALTO)
+
+        file_name = os.path.join(tempdir, "%s%05d.jpg" % (file_prefix, page_no))
+        display_file = DDFFile(DDFFileType.DISPLAY, page_no, file_name)
+        with tracer.span("ddf.page", page=page_no):
+            img = self.finishing_service.create_scaled_image(page, 300)
+            ocr_result = self.ocr_runner.run_tesseract_multi(img, project_properties.ocr_lang, outputs)
+            with tracer.span("ddf.jpeg_encode"):
+                img.save(file_name, quality=95, optimize=True, extra=jpeg_segments)
+
+        rendered_page = None
+        if not page.skip_page:
+            rendered_page = self.pdf_service.render_page(page_no, page, bg_colors, project_properties, ocr_result.page)
+        return DDFPageResult(page_no, display_file, self._get_alto_data(ocr_result.alto), rendered_page)
+
+    def _add_to_zip_file(self, zipfile, ddf_file, alto_data: bytes=None):
+        '''
+        Moves the file into the zip file
+        '''
+        
+        with tracer.span("ddf.zip"):
+            zipfile.write(ddf_file.temp_file_name, "%s/%s" % (ddf_file.directory, ddf_file.basename))
+            os.remove(ddf_file.temp_file_name)
+            if alto_data is not None:
+                zipfile.writestr("%s/%s" % (ddf_file.directory, ddf_file.alto_basename), alto_data)
+            elif os.path.exists(ddf_file.alto_file_name):
+                zipfile.write(ddf_file.alto_file_name, "%s/%s" % (ddf_file.directory, ddf_file.alto_basename))
+                os.remove(ddf_file.alto_file_name)
+        
+
     def _write_ddf_xml(self, project, output_file_name):
         
         doc = Document()
@@ -884,30 +1374,25 @@ class DDFService(ExportService, XMLGenerator):
 
         return DDFFile(DDFFileType.DDFXML, None, output_file_name)
         
-    def _write_alto_file(self, img, file_name, ocr_lang):
+    def _get_alto_data(self, alto_dom) -> bytes:
         
-        alto_dom = self.ocr_runner.run_tesseract_for_alto(img, ocr_lang)
-        with open(file_name, "wb") as file: 
-            alto_dom.write(file, encoding='utf-8')
+        alto_data = io.BytesIO()
+        alto_dom.write(alto_data, encoding='utf-8')
+        return alto_data.getvalue()
 
-    def _join_alto_files(self, projectfiles, file_name):
+    def _join_alto_files(self, alto_documents: [], file_name):
         
         id_re = re.compile(r'ID="([a-z]+)_')
         
-        alto_files = self._fetch_page_alto_files(projectfiles)
-        with open(alto_files[0], 'r') as file:
-            alto1_as_string = file.read()
-            main_dom = ET.ElementTree(ET.fromstring(re.sub(id_re, r'ID="\1_1_', alto1_as_string)))
+        main_dom = ET.ElementTree(ET.fromstring(re.sub(id_re, r'ID="\1_1_', alto_documents[0].decode("utf-8"))))
         
         layouts = main_dom.findall('.//{*}Layout')
         layout = layouts[0]
         
         counter = 1
-        for alto_file in alto_files[1:]:
+        for alto_document in alto_documents[1:]:
             counter += 1
-            with open(alto_file, 'r') as file:
-                alto_as_string = file.read()
-                dom = ET.ElementTree(ET.fromstring(re.sub(id_re, r'ID="\1_%d_' % counter, alto_as_string)))
+            dom = ET.ElementTree(ET.fromstring(re.sub(id_re, r'ID="\1_%d_' % counter, alto_document.decode("utf-8"))))
             for page in dom.findall('.//{*}Page'):
                 layout.append(page)
 
@@ -916,19 +1401,12 @@ class DDFService(ExportService, XMLGenerator):
         
         return file_name
         
-    def _fetch_page_alto_files(self, projectfiles):
-        
-        page_alto_files = []
-        for ddf_file in projectfiles:
-            if ddf_file.file_type == DDFFileType.DISPLAY:
-                page_alto_files.append(ddf_file.alto_file_name)
-        return page_alto_files 
-                
-    def _write_stupid_pdf(self, project, tempdir):
+    def _write_stupid_pdf(self, project, tempdir, rendered_pages):
         
         pdf_name = project.metadata.ddf_prefix + "00001.pdf"
         output_name = os.path.join(tempdir, pdf_name)
-        self.pdf_service.create_pdf_file(project, output_name)
+        with tracer.span("ddf.pdf"):
+            self.pdf_service.write_pdf_file(project, rendered_pages, output_name)
         
         return DDFFile(DDFFileType.PDF, 1, output_name)
     
@@ -983,6 +1461,15 @@ class DDFService(ExportService, XMLGenerator):
         new_img.paste(img, (int(additional_pixels / 2), int(additional_pixels / 2)))
         return new_img
 
+_worker_ddf_service = None
+
+def _render_ddf_scan(task) -> DDFScanResult:
+    
+    global _worker_ddf_service
+    if _worker_ddf_service is None:
+        _worker_ddf_service = Injector([AlgorithmModule]).get(DDFService)
+    return _worker_ddf_service.render_scan(*task)
+
 @singleton    
 class ProjectService(object):
     
@@ -1037,19 +1524,23 @@ class ProjectService(object):
         file.close()
         return project
 
-    def export_pdf(self, project: Project, file_name: str):
+    def export_pdf(self, project: Project, file_name: str, progress_callback=None, save_project: bool=True):
         
-        if file_name[-4:] == '.pdf':
-            self.save_project(file_name.replace("pdf", "scp"), project)
-        else:
-            self.save_project(file_name + ".scp", project)
+        if save_project:
+            if file_name[-4:] == '.pdf':
+                self.save_project(file_name.replace("pdf", "scp"), project)
+            else:
+                self.save_project(file_name + ".scp", project)
             
-        self.pdf_service.create_pdf_file(project, file_name)
+        with tracer.trace("Pdf export"):
+            self.pdf_service.create_pdf_file(project, file_name, progress_callback=progress_callback)
 
-    def export_tif(self, project: Project, filename: str):
+    def export_tif(self, project: Project, filename: str, progress_callback=None):
         
-        self.tiff_service.create_tiff_file_archive(project, filename)
+        with tracer.trace("Tif export"):
+            self.tiff_service.create_tiff_file_archive(project, filename, progress_callback)
 
-    def export_ddf(self, project: Project, filename: str):
+    def export_ddf(self, project: Project, filename: str, progress_callback=None):
         
-        self.ddf_service.create_ddf_file_archive(project, filename)
+        with tracer.trace("DDF export"):
+            self.ddf_service.create_ddf_file_archive(project, filename, progress_callback)
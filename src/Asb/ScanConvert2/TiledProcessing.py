@@ -0,0 +1,291 @@
+'''
+Tiled processing of very large pages, e.g. posters scanned
+at 600 dpi.
+
+The normal way to create the final image of a page decodes the
+whole scan, crops, rotates and resizes it and hands it to the mode
+transformation algorithm, which makes several copies of it as
+numpy arrays. For an A1 color poster this adds up to several GB.
+
+For tile safe algorithms (see ModeTransformationAlgorithm) the
+FinishingService uses the TileProcessor instead: The page is read
+tile by tile through a PageRaster, every tile is transformed and
+pasted into the output image. Uncompressed tiffs are memory mapped,
+so the scan is never decoded as a whole. For all other files the
+raster decodes the scan once (or takes it from the scan cache) and
+keeps it while the tiles are cut out of it, which still saves the
+copies of the whole page.
+
+Pages reduced by an integer factor (see get_reduce_factor) are
+reduced tile by tile, which gives the same pixels as reducing the
+whole page. Resampling a tile does not: pillow calculates the filter
+weights for the shifted coordinates of a tile with different
+rounding, so single pixels at the tile borders would differ. For
+other resolution changes the raster therefore resizes the whole
+page once and cuts the tiles out of it. The resized page still is
+far smaller than the copies the algorithms make of it.
+
+Created on 18.10.2026
+
+@author: michael
+'''
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+from PIL import Image
+from injector import singleton
+import numpy as np
+import tifffile
+
+from Asb.ScanConvert2.Algorithms import ModeTransformationAlgorithm
+from Asb.ScanConvert2.Instrumentation import tracer
+from Asb.ScanConvert2.ProcessPool import get_max_workers
+from Asb.ScanConvert2.ScanConvertDomain import Page, Scan
+
+DEFAULT_TILE_SIZE = 1024
+
+# Pages with less pixels are processed as a whole. This is
+# about an A2 page at 400 dpi, 200 MB as RGB image.
+MIN_TILED_PROCESSING_PIXELS = 64 * 1024 * 1024
+
+TIFF_FILE_EXTENSIONS = (".tif", ".tiff")
+
+def get_reduce_factor(target_source_ratio: float) -> int:
+    '''
+    Returns the factor for Image.reduce if the image is downsized
+    by an integer factor (e.g. from 600 dpi to 300 dpi), otherwise
+    None. Reducing averages blocks of pixels, which is a lot faster
+    than resampling.
+    '''
+    
+    factor = round(1 / target_source_ratio)
+    if factor < 2 or abs(target_source_ratio * factor - 1) > 1e-9:
+        return None
+    return factor
+
+def open_memmap(scan: Scan) -> np.ndarray:
+    '''
+    Returns the scan as read only memory mapped array, or None
+    if the scan is not an uncompressed 8 bit gray or RGB tiff.
+    Cropped scans are rotated when decoded, so they can't be
+    mapped either.
+    '''
+
+    if scan.cropping_information is not None:
+        return None
+    if os.path.splitext(scan.filename)[1].lower() not in TIFF_FILE_EXTENSIONS:
+        return None
+    try:
+        with tifffile.TiffFile(scan.filename) as tiff:
+            tiff_page = tiff.pages.first
+            if not tiff_page.is_memmappable or tiff_page.dtype != np.uint8:
+                return None
+            if (tiff_page.photometric, tiff_page.samplesperpixel) not in ((tifffile.PHOTOMETRIC.MINISBLACK, 1),
+                                                                          (tifffile.PHOTOMETRIC.RGB, 3)):
+                return None
+        return tifffile.memmap(scan.filename, page=0, mode="r")
+    except (tifffile.TiffFileError, ValueError, OSError):
+        return None
+
+class PageRaster(object):
+    '''
+    The image of a page as Page.get_raw_image() returns it, resized
+    to the target resolution, but read in parts. Dewarping and
+    alignment need the whole page, so they are not supported.
+    
+    Scans that can't be memory mapped are held as decoded image,
+    so the tiles do not fetch the scan again and again (if it does
+    not fit into the scan cache, it would be decoded for every tile).
+    '''
+
+    def __init__(self, page: Page, target_resolution: int):
+
+        self.page = page
+        self.memmap = open_memmap(page.scan)
+        region = page.main_region
+        self.page_box = tuple(round(value) for value in (region.x, region.y, region.x2, region.y2))
+        if self.memmap is not None and (min(self.page_box) < 0 or
+                                        self.page_box[2] > self.memmap.shape[1] or
+                                        self.page_box[3] > self.memmap.shape[0]):
+            # Pillow fills the part outside of the scan, slicing does not
+            self.memmap = None
+        self.scan_image = None
+        if self.memmap is None:
+            self.scan_image = page.scan.get_cached_image()
+
+        self.unrotated_width = self.page_box[2] - self.page_box[0]
+        self.unrotated_height = self.page_box[3] - self.page_box[1]
+        self.source_width, self.source_height = self.unrotated_width, self.unrotated_height
+        if page.final_rotation_angle in (90, 270):
+            self.source_width, self.source_height = self.unrotated_height, self.unrotated_width
+
+        self.ratio = 1.0
+        self.reduce_factor = None
+        self.width, self.height = self.source_width, self.source_height
+        if page.source_resolution != target_resolution:
+            self.ratio = target_resolution / page.source_resolution
+            self.reduce_factor = get_reduce_factor(self.ratio)
+            self.width = int(self.source_width * self.ratio)
+            self.height = int(self.source_height * self.ratio)
+        resolution = page.scan.resolution * self.ratio
+        self.dpi = (resolution, resolution)
+
+        self.resized_image = None
+        if self.ratio != 1.0 and (self.reduce_factor is None or self.mode in ("1", "P")):
+            # Exactly as FinishingService.change_resolution does it
+            self.resized_image = self._get_page_image((0, 0, self.source_width, self.source_height)).resize(self.size)
+
+    def get_tile_boxes(self, tile_size: int):
+
+        for y in range(0, self.height, tile_size):
+            for x in range(0, self.width, tile_size):
+                yield (x, y, min(x + tile_size, self.width), min(y + tile_size, self.height))
+
+    def get_image(self, box: ()) -> Image:
+        '''
+        Returns the part of the (resized) page. Like with
+        Image.crop, the part outside of the page is black.
+        '''
+
+        clipped_box = (max(box[0], 0), max(box[1], 0), min(box[2], self.width), min(box[3], self.height))
+        if clipped_box[0] >= clipped_box[2] or clipped_box[1] >= clipped_box[3]:
+            img = Image.new(self.mode, (box[2] - box[0], box[3] - box[1]))
+        else:
+            img = self._get_resized_image(clipped_box)
+            if clipped_box != tuple(box):
+                padded_img = Image.new(img.mode, (box[2] - box[0], box[3] - box[1]))
+                padded_img.paste(img, (clipped_box[0] - box[0], clipped_box[1] - box[1]))
+                img = padded_img
+        img.info['dpi'] = self.dpi
+        return img
+
+    def _get_resized_image(self, box: ()) -> Image:
+
+        if self.ratio == 1.0:
+            return self._get_page_image(box)
+        if self.resized_image is not None:
+            return self.resized_image.crop(box)
+        return self._get_page_image(tuple(value * self.reduce_factor for value in box)).reduce(self.reduce_factor)
+
+    def _get_page_image(self, box: ()) -> Image:
+        '''
+        The box is in the coordinates of the rotated, but not
+        resized page
+        '''
+
+        x0, y0, x1, y1 = self._unrotate_box(box)
+        scan_box = (self.page_box[0] + x0, self.page_box[1] + y0, self.page_box[0] + x1, self.page_box[1] + y1)
+        if self.memmap is not None:
+            img = Image.fromarray(np.ascontiguousarray(self.memmap[scan_box[1]:scan_box[3], scan_box[0]:scan_box[2]]))
+        else:
+            img = self._convert_mode(self.scan_image.crop(scan_box))
+        return self.page._rotate_image(img, self.page.final_rotation_angle)
+
+    def _unrotate_box(self, box: ()) -> ():
+        '''
+        Maps a box of the rotated page onto the page as it
+        is on the scan
+        '''
+
+        x0, y0, x1, y1 = box
+        width, height = self.unrotated_width, self.unrotated_height
+        angle = self.page.final_rotation_angle
+        if angle == 270:
+            return (width - y1, x0, width - y0, x1)
+        if angle == 180:
+            return (width - x1, height - y1, width - x0, height - y0)
+        if angle == 90:
+            return (y0, height - x1, y1, height - x0)
+        return box
+
+    def _convert_mode(self, img: Image) -> Image:
+
+        if img.mode == "1" or img.mode == "L":
+            return img
+        if img.mode == "LA":
+            return img.convert("L")
+        return img.convert("RGB")
+
+    def _get_mode(self):
+
+        if self.memmap is not None:
+            if self.memmap.ndim == 2:
+                return "L"
+            return "RGB"
+        return self._convert_mode(Image.new(self.scan_image.mode, (1, 1))).mode
+
+    size = property(lambda self: (self.width, self.height))
+    mode = property(_get_mode)
+
+@singleton
+class TileProcessor(object):
+    '''
+    Applies tile safe algorithms to a page raster. The tiles are
+    spread over a thread pool (the algorithms spend their time in
+    numpy, cv2 and pillow, which release the GIL). Only two tiles
+    per thread are in flight, so at any time just a few tiles are
+    in memory, besides the output image. In a worker process of a
+    pool the threads get the share of the pool (see ProcessPool).
+
+    Local algorithms get their tiles with a halo of neighbouring
+    pixels, the result is cut out of the transformed tile. At the
+    borders of the page there is no halo, so the algorithms handle
+    the borders of a tile exactly as on the whole page.
+    '''
+
+    def __init__(self):
+
+        self.tile_size = DEFAULT_TILE_SIZE
+        self.max_threads = get_max_workers()
+
+    def transform(self, raster: PageRaster, algorithm: ModeTransformationAlgorithm, bg_color) -> Image:
+
+        statistics = None
+        if algorithm.needs_tile_statistics:
+            with tracer.span("tiles.statistics"):
+                for tile_statistics in self._map_tiles(raster, algorithm, lambda tile, core, box:
+                                                       algorithm.get_tile_statistics(tile, core)):
+                    statistics = algorithm.merge_tile_statistics(statistics, tile_statistics)
+                statistics = algorithm.finish_tile_statistics(statistics)
+
+        output = Image.new(algorithm.get_tile_mode(bg_color), raster.size)
+        with tracer.span("tiles.transform"):
+            for tile, box in self._map_tiles(raster, algorithm, lambda tile, core, box:
+                                             (algorithm.transform_tile(tile, bg_color, statistics)[core], box)):
+                output.paste(Image.fromarray(tile), box[:2])
+        output.info['dpi'] = raster.dpi
+        return output
+
+    def _map_tiles(self, raster: PageRaster, algorithm: ModeTransformationAlgorithm, function):
+        '''
+        Calls the function with every tile (including the halo), the
+        slices of the tile without halo and the box of the tile and
+        yields the results in the order of the tiles
+        '''
+
+        boxes = raster.get_tile_boxes(self.tile_size)
+        max_threads = max(1, self.max_threads)
+        with ThreadPoolExecutor(max_workers=max_threads) as executor:
+            pending = deque()
+            for box in boxes:
+                pending.append(executor.submit(self._call_with_tile, raster, algorithm, box, function))
+                if len(pending) >= 2 * max_threads:
+                    break
+            while len(pending) > 0:
+                result = pending.popleft().result()
+                for box in boxes:
+                    pending.append(executor.submit(self._call_with_tile, raster, algorithm, box, function))
+                    break
+                yield result
+
+    def _call_with_tile(self, raster: PageRaster, algorithm: ModeTransformationAlgorithm, box: (), function):
+
+        halo = algorithm.tile_halo
+        halo_box = (max(0, box[0] - halo), max(0, box[1] - halo),
+                    min(raster.width, box[2] + halo), min(raster.height, box[3] + halo))
+        core = (slice(box[1] - halo_box[1], box[3] - halo_box[1]),
+                slice(box[0] - halo_box[0], box[2] - halo_box[0]))
+        tile = np.asarray(algorithm.convert_image(raster.get_image(halo_box), algorithm.input_mode))
+        with tracer.span("tiles.tile"):
+            return function(tile, core, box)
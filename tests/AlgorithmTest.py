@@ -5,7 +5,11 @@ Created on 16.01.2023
 '''
 import unittest
 from Asb.ScanConvert2.Algorithms import AlgorithmModule, Algorithm,\
-    ModeTransformationAlgorithm, RGB_WHITE, AlgorithmHelper
+    ModeTransformationAlgorithm, RGB_WHITE, AlgorithmHelper, \
+    fast_threshold_sauvola, SAUVOLA_WINDOW_SIZE, ColorQuantizer, PaletteCache
+import cv2
+import numpy as np
+from skimage.filters.thresholding import threshold_sauvola
 import os
 from PIL import Image
 from _ast import Or
@@ -124,6 +128,99 @@ class AlgorithmTests(unittest.TestCase):
         self.assertIn(RUST_BACKGROUND, colors)
         self.assertIn((0,0,0), colors)
 
+    def testSauvolaLikeSkimage(self):
+        """
+        The tolerances documented in fast_threshold_sauvola
+        """
+        
+        gray = np.asarray(self.img.convert("L"))
+        expected = threshold_sauvola(gray, window_size=SAUVOLA_WINDOW_SIZE)
+        
+        threshold = fast_threshold_sauvola(gray)
+        self.assertLess(np.abs(threshold - expected).max(), 0.01)
+        self.assertTrue(np.array_equal(gray > threshold, gray > expected))
+        
+        for grid_step, max_difference, max_switched in ((2, 3, 0.003), (4, 7, 0.01)):
+            threshold = fast_threshold_sauvola(gray, grid_step=grid_step)
+            self.assertLess(np.abs(threshold - expected).max(), max_difference)
+            self.assertLess(np.count_nonzero((gray > threshold) != (gray > expected)), gray.size * max_switched)
+
+    def testSauvolaInBands(self):
+        
+        gray = np.asarray(self.img.convert("L"))
+        cv2.setNumThreads(4)
+        try:
+            threshold = fast_threshold_sauvola(gray)
+        finally:
+            cv2.setNumThreads(-1)
+        self.assertTrue(np.array_equal(threshold, fast_threshold_sauvola(gray)))
+
+    def testQuantizationLikeKMeans(self):
+        """
+        Fitting on a sample finds the same palette as fitting on
+        all pixels, with a fixed seed always the same one
+        """
+        
+        np_array = np.asarray(self.img.convert("RGB"))
+        condition = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 1.0)
+        _, _, expected = cv2.kmeans(np.float32(np_array).reshape(-1, 3), 2, None, condition, 10, cv2.KMEANS_RANDOM_CENTERS)
+        
+        quantizer = ColorQuantizer()
+        centers = quantizer.fit(np_array, 2)
+        self.assertTrue(np.array_equal(centers, quantizer.fit(np_array, 2)))
+        self.assertLess(np.abs(np.sort(centers, axis=0) - np.sort(expected, axis=0)).max(), 2)
+        
+    def testQuantizationLookupTable(self):
+        
+        np_array = np.asarray(self.img.convert("RGB"))
+        quantizer = ColorQuantizer()
+        quantized_array, centers = quantizer.quantize(np_array, 4)
+        
+        distances = ((np.float32(np_array).reshape(-1, 1, 3) - centers.reshape(1, -1, 3)) ** 2).sum(axis=2)
+        expected = np.uint8(centers)[np.argmin(distances, axis=1)].reshape(np_array.shape)
+        self.assertTrue(np.array_equal(quantized_array, expected))
+
+    def testPaletteCache(self):
+        
+        np_array = np.asarray(self.img.convert("RGB"))
+        pixels = np.float32(np_array.reshape(-1, 3))
+        palette_cache = PaletteCache()
+        quantizer = ColorQuantizer(palette_cache)
+        _, centers = quantizer.quantize(np_array, 4)
+        self.assertEqual(palette_cache.hits, 0)
+        _, cached_centers = quantizer.quantize(np_array, 4)
+        self.assertEqual(palette_cache.hits, 1)
+        self.assertTrue(np.array_equal(centers, cached_centers))
+        
+        # Another cache gives the same palette
+        _, other_centers = ColorQuantizer(PaletteCache()).quantize(np_array, 4)
+        self.assertTrue(np.array_equal(centers, other_centers))
+        
+        # The warm start is as good as the fit from random centers
+        _, uncached_centers = ColorQuantizer().quantize(np_array, 4)
+        compactness = ((pixels[:, np.newaxis] - centers[np.newaxis]) ** 2).sum(axis=2).min(axis=1).sum()
+        uncached_compactness = ((pixels[:, np.newaxis] - uncached_centers[np.newaxis]) ** 2).sum(axis=2).min(axis=1).sum()
+        self.assertLess(compactness, uncached_compactness * 1.01)
+        
+    def testReplaceColors(self):
+        
+        rng = np.random.default_rng(4711)
+        colors = np.array(((0, 0, 0), (255, 255, 255), (200, 40, 40), (40, 40, 200)), dtype=np.uint8)
+        np_array = colors[rng.integers(0, 4, (1100, 70))]
+        red, green, blue = np_array.T
+        red_areas = ((red == 200) & (green == 40) & (blue == 40)).T
+        blue_areas = ((red == 40) & (green == 40) & (blue == 200)).T
+        
+        # Swapping colors works, because all masks are calculated first
+        self.helper.replace_colors_in_array(np_array, {(200, 40, 40): (40, 40, 200), (40, 40, 200): (200, 40, 40)})
+        self.assertTrue(np.all(np_array[red_areas] == (40, 40, 200)))
+        self.assertTrue(np.all(np_array[blue_areas] == (200, 40, 40)))
+        self.assertTrue(np.array_equal(self.helper.get_color_mask(np_array, (40, 40, 200)), red_areas))
+        
+        target = np.zeros_like(np_array)
+        self.helper.replace_colors_in_array(target, {(40, 40, 200): RGB_WHITE}, mask_array=np_array)
+        self.assertTrue(np.array_equal(self.helper.get_color_mask(target, RGB_WHITE), red_areas))
+        
     def testFloydSteinberg(self):
         
         result = self.algorithms[Algorithm.FLOYD_STEINBERG].transform(self.img, None)
@@ -198,6 +295,19 @@ class AlgorithmTests(unittest.TestCase):
         self.assertTrue(self.helper.colors_are_similar(RUST_BACKGROUND, colors[0]) or 
                         self.helper.colors_are_similar(RUST_BACKGROUND, colors[1]))
 
+    def testPaletteImages(self):
+        
+        result = self.algorithms[Algorithm.FOUR_COLORS].transform(self.img, RUST_BACKGROUND)
+        self.assertEqual(result[0].mode, "P")
+        self.assertEqual(len(self.helper.get_palette(result[0])), 4)
+        self.assertIn(RUST_BACKGROUND, self.get_colors(result[0]))
+        
+        bilevel_img = self.algorithms[Algorithm.OTSU].transform(self.img, None)[0]
+        merged_img, mapped_img = self.helper.merge_palette_images(result[0].copy(), self.helper.to_palette_image(bilevel_img))
+        self.assertTrue(np.array_equal(np.asarray(mapped_img.convert("RGB")), np.asarray(bilevel_img.convert("RGB"))))
+        self.assertLessEqual(len(self.helper.get_palette(merged_img)), 6)
+        self.assertTrue(np.array_equal(np.asarray(merged_img.convert("RGB")), np.asarray(result[0].convert("RGB"))))
+
     def testErase(self):
         
         result = self.algorithms[Algorithm.ERASE].transform(self.img, None)
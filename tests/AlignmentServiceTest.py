@@ -0,0 +1,100 @@
+'''
+Created on 18.10.2026
+
+@author: michael
+'''
+import os
+import tempfile
+import unittest
+
+from PIL import Image, ImageDraw
+from injector import Injector
+
+from Asb.ScanConvert2.Algorithms import AlgorithmModule
+from Asb.ScanConvert2.AngleCorrection import AlignmentService, SMEAR_CONSTRAINT
+from Asb.ScanConvert2.ProjectGenerator import ProjectGenerator, SortType
+from Asb.ScanConvert2.ScanConvertDomain import Scan, Page, ScanPart, Region
+from Base import BaseTest
+
+
+class AlignmentServiceTest(BaseTest):
+
+    def setUp(self):
+
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        injector = Injector(AlgorithmModule)
+        self.alignment_service = injector.get(AlignmentService)
+        self.skew_angles = (2.0, 0.7)
+        scans = []
+        for idx in range(0, len(self.skew_angles)):
+            file_name = os.path.join(self.temp_dir.name, "Seite%d.png" % idx)
+            self.create_text_page(self.skew_angles[idx]).save(file_name, dpi=(300, 300))
+            scans.append(Scan(file_name))
+        self.project = injector.get(ProjectGenerator).scans_to_project(scans, 1, SortType.STRAIGHT, 0, False)
+
+    def tearDown(self):
+
+        self.alignment_service.max_workers = None
+        self.temp_dir.cleanup()
+
+    def create_text_page(self, skew_angle):
+        '''
+        Something that looks like lines of words to the smearing algorithm
+        '''
+
+        img = Image.new("L", (1748, 2480), 255)
+        draw = ImageDraw.Draw(img)
+        for y in range(200, 2300, 60):
+            x = 150
+            while x < 1500:
+                width = 40 + (x * 7 + y) % 120
+                draw.rectangle((x, y, x + width, y + 25), fill=0)
+                x += width + 18
+        return img.rotate(skew_angle, fillcolor=255, resample=Image.BICUBIC)
+
+    def testAlignPages(self):
+
+        progress = []
+        self.project.pages[0].alignment_angle = 5.0
+        self.alignment_service.max_workers = 1
+        angles = self.alignment_service.align_pages(self.project.pages,
+                                                    progress_callback=lambda done, total: progress.append((done, total)))
+        self.assertEqual(progress, [(1, 2), (2, 2)])
+        for page, angle, skew_angle in zip(self.project.pages, angles, self.skew_angles):
+            self.assertAlmostEqual(angle, -skew_angle, delta=0.2)
+            self.assertEqual(page.alignment_angle, angle)
+
+    def testParallel(self):
+
+        self.alignment_service.max_workers = 1
+        sequential = self.alignment_service.align_pages(self.project.pages)
+        self.alignment_service.max_workers = 2
+        parallel = self.alignment_service.align_pages(self.project.pages)
+        self.assertEqual(sequential, parallel)
+
+    def testProxyImage(self):
+        '''
+        The angle found on the reduced image is the angle
+        found on the scan itself
+        '''
+
+        file_name = os.path.join(self.temp_dir.name, "Seite400dpi.png")
+        self.create_text_page(1.3).save(file_name, dpi=(400, 400))
+        page = Page(Scan(file_name), ScanPart.WHOLE, Region(0, 0, 1748, 2480))
+        proxy_angle = self.alignment_service.get_correct_angle(page)
+        full_angle = self.alignment_service.angle_correction_service.get_correct_angle(page.get_raw_image().convert("L"),
+                                                                                      SMEAR_CONSTRAINT)
+        self.assertAlmostEqual(proxy_angle, full_angle, delta=0.2)
+        self.assertAlmostEqual(proxy_angle, -1.3, delta=0.2)
+
+    def testDeskewLibrary(self):
+
+        self.alignment_service.max_workers = 1
+        angles = self.alignment_service.align_pages(self.project.pages, use_deskew_library=True)
+        for angle, skew_angle in zip(angles, self.skew_angles):
+            self.assertAlmostEqual(angle, -skew_angle, delta=0.6)
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
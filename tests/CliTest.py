@@ -0,0 +1,88 @@
+'''
+Created on 18.10.2026
+
+@author: michael
+'''
+import os
+import shutil
+import tempfile
+import unittest
+
+from injector import Injector
+
+from Asb.ScanConvert2.Algorithms import AlgorithmModule
+from Asb.ScanConvert2.Cli import split_workers, ConversionTask, ProjectOptions,\
+    EXPORT_PDF, EXPORT_TIF, EXPORT_DDF, convert_projects, ProjectConverter,\
+    create_argument_parser
+from Asb.ScanConvert2.ProjectGenerator import SortType
+from Asb.ScanConvert2.ScanConvertServices import ProjectService
+from Base import BaseTest
+
+
+class CliTest(BaseTest):
+
+    def setUp(self):
+
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.scan_dir = os.path.join(self.temp_dir.name, "Projekt")
+        os.mkdir(self.scan_dir)
+        for idx in (1, 2):
+            shutil.copy(os.path.join(self.test_file_dir, "Single000", "Seite%d.png" % idx), self.scan_dir)
+
+    def tearDown(self):
+
+        self.temp_dir.cleanup()
+
+    def testSplitWorkers(self):
+
+        self.assertEqual(split_workers(1, 8), (1, 8))
+        self.assertEqual(split_workers(3, 8), (3, 2))
+        self.assertEqual(split_workers(20, 8), (8, 1))
+        self.assertEqual(split_workers(0, 8), (1, 8))
+
+    def testArguments(self):
+
+        args = create_argument_parser().parse_args(["--tif", "--ddf", "--sort-type", "SHEET", "--workers", "3", "a.scp"])
+        self.assertEqual(args.exports, [EXPORT_TIF, EXPORT_DDF])
+        self.assertEqual(SortType[args.sort_type], SortType.SHEET)
+        self.assertEqual(args.workers, 3)
+        self.assertTrue(args.run_ocr)
+
+    def testOutputFiles(self):
+
+        converter = ProjectConverter(None)
+        task = ConversionTask("/scans/Projekt.scp", [EXPORT_PDF], ProjectOptions())
+        self.assertEqual(converter.get_output_file(task, EXPORT_PDF), "/scans/Projekt.pdf")
+        task = ConversionTask("/scans/Projekt/", [EXPORT_PDF], ProjectOptions(), output_dir="/out")
+        self.assertEqual(converter.get_output_file(task, EXPORT_TIF), "/out/Projekt_tif.zip")
+        self.assertEqual(converter.get_output_file(task, EXPORT_DDF), "/out/Projekt.zip")
+
+    def testConvertDirectory(self):
+
+        task = ConversionTask(self.scan_dir, [EXPORT_PDF], ProjectOptions(), run_ocr=False, create_pdfa=False)
+        results = convert_projects([task], max_workers=1)
+        self.assertIsNone(results[0].error)
+        self.assertEqual(results[0].no_of_pages, 2)
+        self.assertTrue(os.path.exists(os.path.join(self.temp_dir.name, "Projekt.pdf")))
+
+    def testProjectFileIsUnchanged(self):
+
+        project_service = Injector([AlgorithmModule]).get(ProjectService)
+        project = ProjectConverter(project_service).create_project(self.scan_dir, ProjectOptions())
+        project_file = os.path.join(self.temp_dir.name, "Projekt.scp")
+        project_service.save_project(project_file, project)
+        with open(project_file, "rb") as file:
+            content = file.read()
+
+        task = ConversionTask(project_file, [EXPORT_PDF], ProjectOptions(), run_ocr=False, create_pdfa=False)
+        results = convert_projects([task], max_workers=1)
+        self.assertIsNone(results[0].error)
+        self.assertTrue(os.path.exists(os.path.join(self.temp_dir.name, "Projekt.pdf")))
+        with open(project_file, "rb") as file:
+            self.assertEqual(file.read(), content)
+        self.assertTrue(project_service.load_project(project_file).project_properties.run_ocr)
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
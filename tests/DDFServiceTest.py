@@ -11,8 +11,59 @@ from Asb.ScanConvert2.ProjectGenerator import ProjectGenerator, SortType
 from injector import Injector
 from Asb.ScanConvert2.ScanConvertServices import DDFService, METSService
 from Asb.ScanConvert2.Algorithms import AlgorithmModule
+import io
+import shutil
 import tempfile
 from lxml import etree
+from PIL import Image
+from zipfile import ZipFile
+from Asb.ScanConvert2.Instrumentation import tracer
+from Asb.ScanConvert2.OCR import OcrRunner
+from Asb.ScanConvert2.OcrCache import OcrCache
+from Asb.ScanConvert2.ScanCache import scan_cache
+from Asb.ScanConvert2.ScanConvertServices import IPTCService
+
+ALTO = b'''<?xml version="1.0" encoding="UTF-8"?>
+<alto xmlns="http://www.loc.gov/standards/alto/ns-v3#">
+ <Layout><Page ID="page_0" WIDTH="1000" HEIGHT="1500"/></Layout>
+</alto>
+'''
+
+class CannedOcrCache(OcrCache):
+    '''
+    Knows the alto for every image, so we do not need tesseract
+    '''
+    
+    def get_outputs(self, img, lang, outputs):
+        
+        return {output: ALTO for output in outputs}
+
+class RecordingIPTCService(IPTCService):
+    '''
+    Just remembers the tagged files, so we do not need exiftool
+    '''
+    
+    def __init__(self):
+        
+        self.tagged_files = []
+        self.no_of_calls = 0
+        self.closed = False
+    
+    def write_iptc_tags(self, filenames, tags):
+        
+        self.no_of_calls += 1
+        self.tagged_files += [os.path.basename(filename) for filename in filenames]
+        
+    def close(self):
+        
+        self.closed = True
+
+class UnknownTagIPTCService(RecordingIPTCService):
+    '''
+    Uses a tag the iptc encoder does not know
+    '''
+    
+    SOURCE = "1IPTC:Credit"
 
 
 class Test(BaseTest):
@@ -72,6 +123,129 @@ class Test(BaseTest):
         self.assertTrue(result)
 
 
+class StreamingTest(BaseTest):
+    
+    def setUp(self):
+        
+        super().setUp()
+        
+        filedir = os.path.join(self.test_file_dir, "Double090")
+        scans = [
+            Scan(os.path.join(filedir, "Seite8_1.png")),
+            Scan(os.path.join(filedir, "Seite2_7.png")),
+            Scan(os.path.join(filedir, "Seite6_3.png")),
+            Scan(os.path.join(filedir, "Seite4_5.png")),
+        ]
+        
+        self.create_service(RecordingIPTCService())
+        self.project = self.project_generator.scans_to_project(
+                    scans=scans,
+                    pages_per_scan=2,
+                    sort_type=SortType.SHEET,
+                    scan_rotation=90,
+                    rotation_alternating=False)
+        self.project.metadata.ddf_prefix ="ddftest"
+        self.project.metadata.title ="Testdatei"
+        self.project.project_properties.run_ocr = False
+        self.project.project_properties.create_pdfa = False
+        self.temp_dir = tempfile.TemporaryDirectory()
+        
+    def create_service(self, iptc_service):
+        
+        self.iptc_service = iptc_service
+        injector = Injector([AlgorithmModule])
+        injector.binder.bind(IPTCService, to=self.iptc_service)
+        injector.binder.bind(OcrRunner, to=OcrRunner(CannedOcrCache(tesseract_version="5.3.0")))
+        self.ddf_service = injector.get(DDFService)
+        self.project_generator = injector.get(ProjectGenerator)
+        
+    def tearDown(self):
+        
+        self.ddf_service.max_workers = None
+        self.temp_dir.cleanup()
+        
+    def create_archive(self, max_workers):
+        
+        self.ddf_service.max_workers = max_workers
+        scan_cache.clear()
+        with tracer.collect() as spans:
+            self.ddf_service.create_ddf_file_archive(self.project, os.path.join(self.temp_dir.name, "ddf_test"))
+        return ZipFile(os.path.join(self.temp_dir.name, "ddf_test.zip")), spans
+        
+    def testArchiveContent(self):
+        
+        zipfile, _ = self.create_archive(1)
+        names = zipfile.namelist()
+        
+        self.assertEqual(len([name for name in names if name.startswith("archive/") and name.endswith(".tif")]), 4)
+        self.assertEqual(len([name for name in names if name.startswith("archive/") and name.endswith(".tif.alto")]), 4)
+        self.assertEqual(len([name for name in names if name.startswith("display/") and name.endswith(".jpg")]), 8)
+        self.assertEqual(len([name for name in names if name.startswith("display/") and name.endswith(".jpg.alto")]), 8)
+        self.assertIn("pdf/ddftest00001.pdf", names)
+        self.assertIn("pdf/ddftest00001.pdf.alto", names)
+        self.assertIn("display/ddftest_display.mets", names)
+        self.assertIn("archive/ddftest_archive.mets", names)
+        self.assertIn("ddftest_ddf.xml", names)
+        self.assertTrue(self.iptc_service.closed)
+        
+        pdf_alto = etree.fromstring(zipfile.read("pdf/ddftest00001.pdf.alto"))
+        self.assertEqual(len(pdf_alto.findall(".//{*}Page")), 8)
+        
+        display_mets = etree.fromstring(zipfile.read("display/ddftest_display.mets"))
+        file_ids = [pointer.get("FILEID") for pointer in display_mets.iterfind(".//{*}fptr")]
+        self.assertEqual(file_ids, ["df_ddftest%05d" % page_no for page_no in range(1, 9)])
+
+    def testEmbeddedIPTCTags(self):
+        
+        zipfile, _ = self.create_archive(1)
+        
+        self.assertEqual(self.iptc_service.no_of_calls, 0)
+        tif = Image.open(io.BytesIO(zipfile.read("archive/ddftest00001recto.tif")))
+        self.assertIn(b"Feministisches Archiv Freiburg", tif.tag_v2[33723])
+        jpg = Image.open(io.BytesIO(zipfile.read("display/ddftest00001.jpg")))
+        self.assertIn(b"Feministisches Archiv Freiburg", jpg.info["photoshop"][0x0404])
+        
+    def testExiftoolFallback(self):
+        
+        self.create_service(UnknownTagIPTCService())
+        self.create_archive(1)
+        
+        self.assertEqual(len(self.iptc_service.tagged_files), 12)
+        # One call per scan
+        self.assertEqual(self.iptc_service.no_of_calls, 4)
+
+    def testProgress(self):
+        
+        progress = []
+        self.ddf_service.max_workers = 1
+        self.ddf_service.create_ddf_file_archive(self.project, os.path.join(self.temp_dir.name, "ddf_test"),
+                                                 lambda done, total: progress.append((done, total)))
+        self.assertEqual(progress, [(1, 4), (2, 4), (3, 4), (4, 4)])
+
+    def testCancel(self):
+        
+        def cancel(done, total):
+            raise InterruptedError()
+        
+        self.ddf_service.max_workers = 1
+        with self.assertRaises(InterruptedError):
+            self.ddf_service.create_ddf_file_archive(self.project, os.path.join(self.temp_dir.name, "ddf_test"), cancel)
+        self.assertTrue(self.iptc_service.closed)
+
+    def testEveryScanIsDecodedOnce(self):
+        
+        _, spans = self.create_archive(1)
+        
+        self.assertEqual(len([span for span in spans if span.name == "scan.decode"]), 4)
+        
+    @unittest.skipIf(shutil.which("tesseract") is None or shutil.which("exiftool") is None,
+                     "The worker processes need tesseract and exiftool")
+    def testParallelArchiveIsComplete(self):
+        
+        sequential_names = sorted(self.create_archive(1)[0].namelist())
+        parallel_zipfile, _ = self.create_archive(2)
+        
+        self.assertEqual(sorted(parallel_zipfile.namelist()), sequential_names)
 
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
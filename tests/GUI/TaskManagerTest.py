@@ -0,0 +1,146 @@
+'''
+Created on 18.10.2026
+
+@author: michael
+'''
+import os
+import signal
+import sys
+import threading
+import time
+import unittest
+
+from PySide6.QtWidgets import QApplication
+
+from Asb.ScanConvert2.GUI.TaskRunner import TaskManager, JobDefinition,\
+    JobPriority, JobStatus
+
+
+def sleep_job(progress_reporter, name, seconds):
+
+    time.sleep(seconds)
+    return name
+
+def counting_job(progress_reporter, total):
+
+    for counter in range(1, total + 1):
+        progress_reporter(counter, total)
+    return total
+
+def endless_job(progress_reporter):
+
+    counter = 0
+    while True:
+        counter += 1
+        progress_reporter(counter, 0)
+        time.sleep(0.05)
+
+def failing_job(progress_reporter):
+
+    raise ValueError("Kaputt")
+
+def dying_job(progress_reporter):
+
+    os.kill(os.getpid(), signal.SIGKILL)
+
+class TaskManagerTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.app = QApplication.instance()
+        if self.app is None:
+            self.app = QApplication(sys.argv)
+        self.task_manager = TaskManager()
+
+    def tearDown(self):
+
+        self.task_manager.shutdown()
+
+    def wait_for(self, condition, timeout=60):
+
+        start = time.time()
+        while not condition():
+            self.app.processEvents()
+            self.assertLess(time.time() - start, timeout)
+            time.sleep(0.01)
+
+    def testPriorities(self):
+
+        self.task_manager.max_workers = 1
+        self.task_manager.add_task(JobDefinition(None, sleep_job, ("first", 1)))
+        self.task_manager.add_task(JobDefinition(None, sleep_job, ("low", 0), priority=JobPriority.LOW))
+        self.task_manager.add_task(JobDefinition(None, sleep_job, ("high", 0), priority=JobPriority.HIGH))
+        self.wait_for(lambda: len(self.task_manager.unfinished_tasks) == 0)
+        self.assertEqual([job.result for job in self.task_manager.finished_tasks], ["first", "high", "low"])
+
+    def testProgressAndResult(self):
+
+        results = []
+        job = JobDefinition(None, counting_job, (5,), post_job_method=lambda result: results.append(
+            (result, threading.current_thread() is threading.main_thread())))
+        self.task_manager.add_task(job)
+        self.wait_for(lambda: len(results) == 1)
+        self.assertEqual(job.status, JobStatus.FINISHED)
+        self.assertEqual(results, [(5, True)])
+
+    def testCancel(self):
+
+        self.task_manager.max_workers = 1
+        running_job = JobDefinition(None, endless_job)
+        waiting_job = JobDefinition(None, sleep_job, ("never", 0))
+        self.task_manager.add_task(running_job)
+        self.task_manager.add_task(waiting_job)
+        self.wait_for(lambda: running_job.progress is not None)
+
+        self.task_manager.cancel_task(waiting_job)
+        self.assertEqual(waiting_job.status, JobStatus.CANCELLED)
+        self.task_manager.cancel_task(running_job)
+        self.wait_for(lambda: running_job.status == JobStatus.CANCELLED)
+        self.assertEqual(len(self.task_manager.unfinished_tasks), 0)
+        self.assertIsNone(waiting_job.result)
+
+    def testFailingJob(self):
+
+        finished_jobs = []
+        self.task_manager.job_finished.connect(finished_jobs.append)
+        job = JobDefinition(None, failing_job, description="Export")
+        with self.assertLogs("Asb.ScanConvert2.GUI.TaskRunner", level="ERROR") as logs:
+            self.task_manager.add_task(job)
+            self.wait_for(lambda: len(finished_jobs) == 1)
+        self.assertEqual(job.status, JobStatus.FAILED)
+        self.assertIsInstance(job.error, ValueError)
+        self.assertIn("Export ist fehlgeschlagen", logs.output[0])
+
+    def testDyingWorker(self):
+
+        self.task_manager.max_workers = 1
+        dying = JobDefinition(None, dying_job)
+        self.task_manager.add_task(dying)
+        self.wait_for(lambda: dying.status == JobStatus.FAILED)
+        self.assertIsNotNone(dying.error)
+
+        # A new pool runs the next jobs
+        job = JobDefinition(None, counting_job, (3,))
+        self.task_manager.add_task(job)
+        self.wait_for(lambda: job.status != JobStatus.RUNNING and job.status != JobStatus.WAITING)
+        self.assertEqual(job.status, JobStatus.FINISHED)
+        self.assertEqual(job.result, 3)
+        self.assertEqual(len(self.task_manager.unfinished_tasks), 0)
+
+    def testUnusablePool(self):
+
+        job = JobDefinition(None, counting_job, (1,))
+        self.task_manager.add_task(job)
+        self.wait_for(lambda: job.status == JobStatus.FINISHED)
+        self.task_manager._executor.shutdown()
+
+        failing = JobDefinition(None, counting_job, (2,))
+        self.task_manager.add_task(failing)
+        self.assertEqual(failing.status, JobStatus.FAILED)
+        job = JobDefinition(None, counting_job, (3,))
+        self.task_manager.add_task(job)
+        self.wait_for(lambda: job.status == JobStatus.FINISHED)
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -44,6 +44,28 @@ class Test(BaseTest):
             self.assertEqual(b'Freiburg im Breisgau', jpg_info["city"])
             self.assertEqual(b'Erstellt mit Mitteln des Bundesministeriums fuer Familie, Senioren, Frauen und Jugend', jpg_info["special instructions"])
             self.assertEqual(b'12.0.1: Anti-AKW- und Oekologiebewegung', jpg_info[255])
+    def testBatchWritingInOneSession(self):
+        
+        iptc_tags = {"1IPTC:Source": "Archiv Soziale Bewegungen",
+                     "1IPTC:City": "Freiburg im Breisgau"}
+        
+        with tempfile.TemporaryDirectory(prefix="iptc") as temp_dir:
+
+            test_files = [os.path.join(temp_dir, "test.tif"), os.path.join(temp_dir, "test.jpg")]
+            copyfile(self.tif_test_file_source, test_files[0])
+            copyfile(self.jpg_test_file_source, test_files[1])
+            self.iptc_service.write_iptc_tags(test_files, iptc_tags)
+            exif_tool = self.iptc_service._exif_tool
+            meta_data = self.iptc_service.read_iptc_tags(test_files)
+            self.assertIs(self.iptc_service._exif_tool, exif_tool)
+            self.iptc_service.close()
+
+            self.assertEqual(len(meta_data), 2)
+            for file_meta_data in meta_data:
+                self.assertEqual(file_meta_data["IPTC:Source"], "Archiv Soziale Bewegungen")
+                self.assertEqual(file_meta_data["IPTC:City"], "Freiburg im Breisgau")
+            self.assertEqual(self.iptc_service.read_iptc_tags(test_files[0])["IPTC:Source"], "Archiv Soziale Bewegungen")
+            self.iptc_service.close()
 
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
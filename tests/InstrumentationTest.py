@@ -0,0 +1,75 @@
+'''
+Created on 18.10.2026
+
+@author: michael
+'''
+import json
+import os
+import tempfile
+import unittest
+
+from Asb.ScanConvert2.Instrumentation import tracer, Tracer
+from Asb.ScanConvert2.ProcessPool import ordered_map
+from Base import BaseTest
+
+
+def traced_square(number):
+
+    with tracer.span("test.square", number=number):
+        return number * number
+
+class InstrumentationTest(BaseTest):
+
+    def setUp(self):
+
+        super().setUp()
+        self.tracer = Tracer()
+        self.tracer.trace_dir = None
+
+    def testSpansOutsideTraceAreDropped(self):
+
+        with self.tracer.span("test.outside"):
+            pass
+        with self.tracer.trace("Test", print_summary=False) as trace:
+            with self.tracer.span("test.inside"):
+                pass
+        self.assertEqual([span.name for span in trace.spans], ["test.inside", "Test"])
+        self.assertEqual(self.tracer._spans, [])
+
+    def testSummary(self):
+
+        with self.tracer.trace("Test", print_summary=False) as trace:
+            for number in range(0, 3):
+                with self.tracer.span("test.stage", number=number):
+                    pass
+        summary = dict([(name, count) for name, count, _ in trace.get_summary()])
+        self.assertEqual(summary, {"Test": 1, "test.stage": 3})
+        self.assertIn("test.stage", trace.format_summary())
+
+    def testChromeTrace(self):
+
+        with self.tracer.trace("Test", print_summary=False) as trace:
+            with self.tracer.span("test.stage", page=1):
+                pass
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_name = os.path.join(temp_dir, "trace.json")
+            trace.write_chrome_trace(file_name)
+            with open(file_name) as file:
+                events = json.load(file)["traceEvents"]
+        self.assertEqual(events[0]["name"], "test.stage")
+        self.assertEqual(events[0]["cat"], "test")
+        self.assertEqual(events[0]["ph"], "X")
+        self.assertEqual(events[0]["args"], {"page": 1})
+
+    def testWorkerSpansAreMerged(self):
+
+        with tracer.trace("Test", print_summary=False) as trace:
+            results = list(ordered_map(traced_square, range(0, 4), 2))
+        self.assertEqual(results, [0, 1, 4, 9])
+        spans = [span for span in trace.spans if span.name == "test.square"]
+        self.assertEqual(sorted([span.args["number"] for span in spans]), [0, 1, 2, 3])
+        self.assertTrue(all([span.pid != os.getpid() for span in spans]))
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
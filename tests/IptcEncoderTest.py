@@ -0,0 +1,80 @@
+'''
+Created on 18.10.2026
+
+@author: michael
+'''
+import os
+import tempfile
+import unittest
+
+from PIL import Image
+from PIL.TiffImagePlugin import ImageFileDirectory_v2
+from iptcinfo3 import IPTCInfo
+
+from Asb.ScanConvert2.IptcEncoder import IPTCEncoder, UnsupportedIPTCTag
+from Base import BaseTest
+
+
+class IptcEncoderTest(BaseTest):
+
+    def setUp(self):
+
+        super().setUp()
+        self.encoder = IPTCEncoder()
+        self.tags = {"1IPTC:Source": "Feministisches Archiv Freiburg",
+                     "1IPTC:City": "Freiburg im Breisgau",
+                     "1IPTC:SpecialInstructions": "Erstellt mit Mitteln des Bundesministeriums fuer Familie, Senioren, Frauen und Jugend",
+                     "1IPTC:CatalogSets": "12.0.1: Anti-AKW- und Oekologiebewegung"}
+        self.img = Image.new("RGB", (200, 100), "white")
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+
+        self.temp_dir.cleanup()
+
+    def assertTags(self, file_name):
+
+        info = IPTCInfo(file_name)
+        self.assertEqual(b'Feministisches Archiv Freiburg', info["source"])
+        self.assertEqual(b'Freiburg im Breisgau', info["city"])
+        self.assertEqual(b'Erstellt mit Mitteln des Bundesministeriums fuer Familie, Senioren, Frauen und Jugend', info["special instructions"])
+        self.assertEqual(b'12.0.1: Anti-AKW- und Oekologiebewegung', info[255])
+
+    def testJpeg(self):
+
+        file_name = os.path.join(self.temp_dir.name, "test.jpg")
+        self.img.save(file_name, quality=95, extra=self.encoder.get_jpeg_segment(self.tags))
+        self.assertTags(file_name)
+
+    def testTiff(self):
+
+        file_name = os.path.join(self.temp_dir.name, "test.tif")
+        tiff_meta_data = ImageFileDirectory_v2()
+        tiff_meta_data[315] = "Autor"
+        self.img.save(file_name, tiffinfo=self.encoder.add_to_tiff_metadata(tiff_meta_data, self.tags))
+        self.assertTags(file_name)
+        self.assertEqual(len(Image.open(file_name).tag_v2[33723]) % 4, 0)
+
+    def testEncoding(self):
+
+        iim_data = self.encoder.encode({"1IPTC:City": "Freiburg"})
+        self.assertEqual(iim_data, b"\x1c\x02\x00\x00\x02\x00\x04" + b"\x1c\x02\x5a\x00\x08Freiburg")
+
+        iim_data = self.encoder.encode({"1IPTC:City": "München", "1IPTC:Source": ""})
+        self.assertTrue(iim_data.startswith(b"\x1c\x01\x5a\x00\x03\x1b%G"))
+        self.assertTrue(iim_data.endswith(b"\x1c\x02\x5a\x00\x08" + "München".encode("utf-8")))
+
+    def testTruncation(self):
+
+        iim_data = self.encoder.encode({"1IPTC:City": "ü" * 20})
+        self.assertTrue(iim_data.endswith(b"\x1c\x02\x5a\x00\x20" + ("ü" * 16).encode("utf-8")))
+
+    def testUnsupportedTag(self):
+
+        self.assertTrue(self.encoder.can_encode(self.tags))
+        self.assertFalse(self.encoder.can_encode({"1IPTC:Credit": "Archiv"}))
+        self.assertRaises(UnsupportedIPTCTag, self.encoder.encode, {"1IPTC:Credit": "Archiv"})
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,87 @@
+'''
+Created on 18.10.2026
+
+@author: michael
+'''
+import os
+import tempfile
+import unittest
+
+from PIL import Image
+from injector import Injector
+import numpy as np
+
+from Asb.ScanConvert2.Algorithms import AlgorithmModule, Algorithm
+from Asb.ScanConvert2.LivePreview import LivePreviewer
+from Asb.ScanConvert2.ScanCache import scan_cache
+from Asb.ScanConvert2.ScanConvertDomain import Scan, Page, ScanPart, Region
+from Base import BaseTest
+
+
+class LivePreviewTest(BaseTest):
+
+    def setUp(self):
+
+        super().setUp()
+        scan_cache.clear()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.previewer = Injector([AlgorithmModule]).get(LivePreviewer)
+
+        pixels = np.full((1200, 800, 3), 225, dtype=np.uint8)
+        pixels[100:1100:40, 50:750] = 30
+        pixels[300:500, 100:300] = (200, 40, 40)
+        file_name = os.path.join(self.temp_dir.name, "scan.png")
+        Image.fromarray(pixels).save(file_name, dpi=(400, 400))
+        scan = Scan(file_name)
+        self.page = Page(scan, ScanPart.LEFT, Region(40, 80, 600, 1000, mode_algorithm=Algorithm.GRAY), 90)
+        self.page.add_region(Region(200, 100, 400, 300, mode_algorithm=Algorithm.NONE))
+
+    def tearDown(self):
+
+        self.previewer.page_prefetcher.clear()
+        # Pages without preview levels schedule building them
+        self.previewer.page_prefetcher.preview_pyramid._executor.submit(lambda: None).result()
+        scan_cache.clear()
+        self.temp_dir.cleanup()
+
+    def testPreviewResolution(self):
+
+        self.assertEqual(self.previewer.get_preview_resolution(self.page, 150.4, 300), 150)
+        self.assertEqual(self.previewer.get_preview_resolution(self.page, 40, 300), 100)
+        self.assertEqual(self.previewer.get_preview_resolution(self.page, 600, 300), 300)
+        self.assertEqual(self.previewer.get_preview_resolution(self.page, None, 300), 300)
+        self.assertTrue(self.previewer.needs_refinement(self.page, 150, 300))
+        self.assertFalse(self.previewer.needs_refinement(self.page, 400, 300))
+
+    def testPreview(self):
+
+        img = self.previewer.create_preview(self.page, 100, 300)
+        self.assertEqual(img.size, (250, 150))
+        self.assertEqual(round(img.info['dpi'][0]), 100)
+        final_img, _ = self.previewer.finishing_service.create_final_image(self.page, [], 100)
+        self.assertEqual(img.mode, final_img.mode)
+        self.assertEqual(img.size, final_img.size)
+        difference = np.abs(np.asarray(img.convert("RGB"), dtype=np.int16) - np.asarray(final_img.convert("RGB"), dtype=np.int16))
+        self.assertLessEqual(difference.max(), 1)
+
+    def testCancelledRefinement(self):
+
+        calls = []
+        self.previewer.finishing_service.create_final_image(self.page, [], 100, check_cancelled=lambda: calls.append(1))
+        self.assertEqual(len(calls), 3)
+
+        def cancel():
+            raise InterruptedError()
+
+        with self.assertRaises(InterruptedError):
+            self.previewer.finishing_service.create_final_image(self.page, [], 100, check_cancelled=cancel)
+
+    def testPageKey(self):
+
+        key = self.previewer.get_page_key(self.page)
+        self.page.sub_regions[0].mode_algorithm = Algorithm.OTSU
+        self.assertNotEqual(key, self.previewer.get_page_key(self.page))
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
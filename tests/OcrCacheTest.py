@@ -0,0 +1,86 @@
+'''
+Created on 18.10.2026
+
+@author: michael
+'''
+import os
+import tempfile
+import unittest
+
+from PIL import Image
+
+from Asb.ScanConvert2.OCR import OcrRunner, OUTPUT_ALTO, OUTPUT_TEXT
+from Asb.ScanConvert2.OcrCache import OcrCache
+from Base import BaseTest
+
+
+class OcrCacheTest(BaseTest):
+
+    def setUp(self):
+
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache = OcrCache(self.temp_dir.name, tesseract_version="5.3.0")
+        self.img = self.create_image(255)
+
+    def tearDown(self):
+
+        self.temp_dir.cleanup()
+
+    def create_image(self, color):
+
+        img = Image.new("L", (100, 50), color)
+        img.info['dpi'] = (300, 300)
+        return img
+
+    def testHit(self):
+
+        self.assertIsNone(self.cache.get_outputs(self.img, "deu", (OUTPUT_TEXT,)))
+        self.cache.put_outputs(self.img, "deu", {OUTPUT_TEXT: b"Text"})
+        self.assertEqual(self.cache.get_outputs(self.create_image(255), "deu", (OUTPUT_TEXT,)),
+                         {OUTPUT_TEXT: b"Text"})
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 1)
+
+    def testKey(self):
+
+        self.cache.put_outputs(self.img, "deu", {OUTPUT_TEXT: b"Text"})
+        self.assertIsNone(self.cache.get_outputs(self.create_image(254), "deu", (OUTPUT_TEXT,)))
+        self.assertIsNone(self.cache.get_outputs(self.img, "eng", (OUTPUT_TEXT,)))
+        self.assertIsNone(self.cache.get_outputs(self.img, "deu", (OUTPUT_TEXT, OUTPUT_ALTO)))
+        other_version = OcrCache(self.temp_dir.name, tesseract_version="4.1.1")
+        self.assertIsNone(other_version.get_outputs(self.img, "deu", (OUTPUT_TEXT,)))
+
+    def testEviction(self):
+
+        self.cache.byte_budget = 10
+        self.cache.put_outputs(self.img, "deu", {OUTPUT_TEXT: b"Text1"})
+        key = self.cache.get_key(self.img, "deu")
+        os.utime(self.cache._get_file_name(key, OUTPUT_TEXT), (0, 0))
+        self.cache.put_outputs(self.img, "eng", {OUTPUT_TEXT: b"Text2"})
+        self.cache.put_outputs(self.img, "fra", {OUTPUT_TEXT: b"Text3"})
+        self.assertIsNone(self.cache.get_outputs(self.img, "deu", (OUTPUT_TEXT,)))
+        self.assertIsNotNone(self.cache.get_outputs(self.img, "fra", (OUTPUT_TEXT,)))
+
+    def testUsedBytes(self):
+
+        self.cache.put_outputs(self.img, "deu", {OUTPUT_TEXT: b"Text1"})
+        # Another process (or run) finds the entries on disk
+        other_cache = OcrCache(self.temp_dir.name, tesseract_version="5.3.0")
+        other_cache.put_outputs(self.img, "eng", {OUTPUT_TEXT: b"Text2"})
+        self.assertEqual(other_cache.used_bytes, 10)
+
+        # Below the budget the directory is not walked at all
+        other_cache._scan_files = None
+        other_cache.put_outputs(self.img, "fra", {OUTPUT_TEXT: b"Text3"})
+        self.assertEqual(other_cache.used_bytes, 15)
+
+    def testRunnerSkipsTesseract(self):
+
+        self.cache.put_outputs(self.img, "deu", {OUTPUT_TEXT: "Gecachter Text".encode("utf-8")})
+        ocr_runner = OcrRunner(self.cache)
+        self.assertEqual(ocr_runner.run_tesseract_for_string(self.img, "deu"), "Gecachter Text")
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
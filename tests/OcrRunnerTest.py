@@ -0,0 +1,85 @@
+'''
+Created on 18.10.2026
+
+@author: michael
+'''
+import unittest
+
+from PIL import Image
+
+from Asb.ScanConvert2.OCR import OcrRunner, OUTPUT_HOCR, OUTPUT_ALTO,\
+    OUTPUT_TEXT
+from Base import BaseTest
+
+HOCR = b'''<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN"
+    "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">
+ <head>
+  <title></title>
+  <meta name='ocr-system' content='tesseract 5.3.0' />
+ </head>
+ <body>
+  <div class='ocr_page' id='page_1' title='image "input.png"; bbox 0 0 1000 1500; ppageno 0'>
+   <div class='ocr_carea' id='block_1_1' title="bbox 100 100 900 250">
+    <p class='ocr_par' id='par_1_1' lang='deu' title="bbox 100 100 900 250">
+     <span class='ocr_line' id='line_1_1' title="bbox 100 100 900 150; baseline 0.001 -10; x_size 50; x_descenders 10; x_ascenders 12">
+      <span class='ocrx_word' id='word_1_1' title='bbox 100 100 400 150; x_wconf 96'>Einfacher</span>
+      <span class='ocrx_word' id='word_1_2' title='bbox 450 100 600 150; x_wconf 95'><strong>Text</strong></span>
+     </span>
+     <span class='ocr_line' id='line_1_2' title="bbox 100 200 150 250; textangle 180; x_size 50; x_descenders 10; x_ascenders 12">
+      <span class='ocrx_word' id='word_1_3' title='bbox 100 200 150 250; x_wconf 90'>Kopf</span>
+     </span>
+    </p>
+   </div>
+  </div>
+ </body>
+</html>
+'''
+
+ALTO = b'''<?xml version="1.0" encoding="UTF-8"?>
+<alto xmlns="http://www.loc.gov/standards/alto/ns-v3#">
+ <Layout><Page ID="page_0" WIDTH="1000" HEIGHT="1500"/></Layout>
+</alto>
+'''
+
+class OcrRunnerTest(BaseTest):
+
+    def setUp(self):
+
+        super().setUp()
+        self.ocr_runner = OcrRunner()
+        self.img = Image.new("L", (1000, 1500), 255)
+        self.img.info['dpi'] = (300, 300)
+
+    def testParseHocr(self):
+
+        result = self.ocr_runner.parse_outputs(self.img, {OUTPUT_HOCR: HOCR})
+
+        self.assertIsNone(result.alto)
+        self.assertIsNone(result.text)
+        page = result.page
+        self.assertEqual(page.dpi, 300)
+        self.assertEqual(page.height, 1500)
+        # Lines with upside down text are not supported
+        self.assertEqual(len(page.lines), 1)
+        line = page.lines[0]
+        self.assertEqual(line.font_size, 12)
+        self.assertEqual(line.bbox, (100.0, 1400.0, 900.0, 1350.0))
+        self.assertEqual(line.baseline_coefficients, (0.001, -10.0))
+        self.assertEqual([word.text for word in line.words], ["Einfacher", "Text"])
+        self.assertEqual(line.words[1].bbox, (450.0, 1400.0, 600.0, 1350.0))
+
+    def testParseAllOutputs(self):
+
+        result = self.ocr_runner.parse_outputs(self.img, {OUTPUT_HOCR: HOCR,
+                                                          OUTPUT_ALTO: ALTO,
+                                                          OUTPUT_TEXT: "Einfacher Text\n".encode("utf-8")})
+
+        self.assertEqual(len(result.page.lines), 1)
+        self.assertEqual(len(result.alto.findall('.//{*}Page')), 1)
+        self.assertEqual(result.text, "Einfacher Text\n")
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,89 @@
+'''
+Created on 18.10.2026
+
+@author: michael
+'''
+import os
+import tempfile
+import threading
+import unittest
+
+from PIL import Image
+
+from Asb.ScanConvert2.PagePrefetcher import PagePrefetcher
+from Asb.ScanConvert2.PreviewPyramid import PreviewPyramid
+from Asb.ScanConvert2.ScanCache import scan_cache
+from Asb.ScanConvert2.ScanConvertDomain import Scan, Page, ScanPart, Region
+from Base import BaseTest
+
+
+class PagePrefetcherTest(BaseTest):
+
+    def setUp(self):
+
+        super().setUp()
+        scan_cache.clear()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.prefetcher = PagePrefetcher(PreviewPyramid())
+        self.pages = []
+        for page_no in range(10):
+            file_name = os.path.join(self.temp_dir.name, "scan%d.png" % page_no)
+            Image.new("RGB", (200, 300), (page_no * 20, 0, 0)).save(file_name, dpi=(400, 400))
+            scan = Scan(file_name)
+            self.pages.append(Page(scan, ScanPart.WHOLE, Region(0, 0, 200, 300)))
+
+    def tearDown(self):
+
+        self.wait_for_prefetching()
+        scan_cache.clear()
+        self.temp_dir.cleanup()
+
+    def wait_for_prefetching(self):
+
+        self.prefetcher._executor.submit(lambda: None).result()
+
+    def testPrefetch(self):
+
+        self.prefetcher.prefetch(self.pages, 1)
+        self.wait_for_prefetching()
+        self.assertEqual(self.prefetcher.no_of_images, 4)
+
+        misses = scan_cache.misses
+        for page_no in (2, 3, 9, 10):
+            img = self.prefetcher.get_page_image(self.pages[page_no - 1])
+            self.assertEqual(img.getpixel((0, 0)), ((page_no - 1) * 20, 0, 0))
+        self.assertEqual(self.prefetcher.hits, 4)
+        self.assertEqual(scan_cache.misses, misses)
+
+    def testChangedPage(self):
+
+        self.prefetcher.prefetch(self.pages, 1)
+        self.wait_for_prefetching()
+        self.pages[1].additional_rotation_angle = 90
+        img = self.prefetcher.get_page_image(self.pages[1])
+        self.assertEqual(img.size, (300, 200))
+        self.assertEqual(self.prefetcher.hits, 0)
+
+    def testJumpCancelsPrefetching(self):
+
+        event = threading.Event()
+        self.prefetcher._executor.submit(event.wait)
+        self.prefetcher.prefetch(self.pages, 1)
+        self.prefetcher.prefetch(self.pages, 6)
+        event.set()
+        self.wait_for_prefetching()
+        self.assertEqual(self.prefetcher.no_of_images, 4)
+        for page_no in (4, 5, 7, 8):
+            self.prefetcher.get_page_image(self.pages[page_no - 1])
+        self.assertEqual(self.prefetcher.hits, 4)
+
+    def testBoundedCache(self):
+
+        self.prefetcher.max_entries = 3
+        for page in self.pages:
+            self.prefetcher.get_page_image(page)
+        self.assertEqual(self.prefetcher.no_of_images, 3)
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,95 @@
+'''
+Created on 18.10.2026
+
+@author: michael
+'''
+import os
+import tempfile
+import unittest
+
+from injector import Injector
+from reportlab import rl_config
+
+from Asb.ScanConvert2.Algorithms import AlgorithmModule, Algorithm
+from Asb.ScanConvert2.ProjectGenerator import ProjectGenerator, SortType
+from Asb.ScanConvert2.ScanConvertDomain import Scan
+from Asb.ScanConvert2.ScanConvertServices import PdfService
+from Base import BaseTest
+
+
+class PdfServiceTest(BaseTest):
+
+    def setUp(self):
+
+        super().setUp()
+        injector = Injector(AlgorithmModule)
+        self.pdf_service = injector.get(PdfService)
+        project_generator = injector.get(ProjectGenerator)
+        scans = []
+        for i in range(1, 9):
+            scans.append(Scan(os.path.join(self.test_file_dir, "Single000", "Seite%s.png" % i)))
+        self.project = project_generator.scans_to_project(scans, 1, SortType.STRAIGHT, 0, False)
+        self.project.project_properties.run_ocr = False
+        self.project.project_properties.create_pdfa = False
+        self.invariant = rl_config.invariant
+        rl_config.invariant = 1
+
+    def tearDown(self):
+
+        rl_config.invariant = self.invariant
+        self.pdf_service.max_workers = None
+
+    def create_pdf(self, max_workers):
+
+        self.pdf_service.max_workers = max_workers
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pdf_file = os.path.join(tmp_dir, "test.pdf")
+            self.pdf_service.create_pdf_file(self.project, pdf_file)
+            with open(pdf_file, "rb") as file:
+                return file.read()
+
+    def testParallelOutputIsIdentical(self):
+
+        self.project.pages[3].skip_page = True
+        self.project.pages[5].main_region.mode_algorithm = Algorithm.GRAY
+
+        sequential = self.create_pdf(1)
+        parallel = self.create_pdf(3)
+        self.assertEqual(sequential, parallel)
+
+    def testParallelQuantizationIsIdentical(self):
+
+        for page in self.project.pages[1:4]:
+            page.main_region.mode_algorithm = Algorithm.TWO_COLOR_QUANTIZATION
+
+        self.pdf_service.max_workers = 1
+        sequential_bg_colors = self.pdf_service.collect_background_colors(self.project)
+        self.pdf_service.max_workers = 3
+        parallel_bg_colors = self.pdf_service.collect_background_colors(self.project)
+        self.assertEqual(sequential_bg_colors, parallel_bg_colors)
+
+        sequential = self.create_pdf(1)
+        parallel = self.create_pdf(3)
+        self.assertEqual(sequential, parallel)
+
+    def testBackgroundColorsFollowPageOrder(self):
+
+        for page in self.project.pages:
+            page.main_region.mode_algorithm = Algorithm.TWO_COLOR_QUANTIZATION
+        self.project.pages[0].main_region.mode_algorithm = Algorithm.OTSU
+        self.project.pages[2].skip_page = True
+
+        self.pdf_service.max_workers = 2
+        page_bg_colors = self.pdf_service.collect_background_colors(self.project)
+
+        self.assertEqual(len(page_bg_colors), len(self.project.pages))
+        self.assertEqual(page_bg_colors[0], [])
+        self.assertEqual(page_bg_colors[1], [])
+        self.assertEqual(len(page_bg_colors[2]), 1)
+        self.assertEqual(page_bg_colors[2], page_bg_colors[3])
+        for idx in range(1, len(page_bg_colors)):
+            self.assertEqual(page_bg_colors[idx][:len(page_bg_colors[idx - 1])], page_bg_colors[idx - 1])
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,107 @@
+'''
+Created on 18.10.2026
+
+@author: michael
+'''
+import os
+import tempfile
+import unittest
+
+from PIL import Image
+import numpy as np
+
+from Asb.ScanConvert2.PreviewPyramid import PreviewPyramid, PREVIEW_DIRECTORY
+from Asb.ScanConvert2.ScanCache import scan_cache
+from Asb.ScanConvert2.ScanConvertDomain import Scan, Page, ScanPart, Region
+from Base import BaseTest
+
+
+class PreviewPyramidTest(BaseTest):
+
+    def setUp(self):
+
+        super().setUp()
+        scan_cache.clear()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.pyramid = PreviewPyramid()
+
+        rng = np.random.default_rng(4711)
+        pixels = np.full((1200, 800, 3), 225, dtype=np.uint8)
+        pixels[100:1100:40, 50:750] = 30
+        pixels[300:500, 100:300] = (200, 40, 40)
+        pixels = np.clip(pixels.astype(np.int16) + rng.integers(-20, 20, pixels.shape), 0, 255).astype(np.uint8)
+        self.img = Image.fromarray(pixels)
+
+    def tearDown(self):
+
+        scan_cache.clear()
+        self.temp_dir.cleanup()
+
+    def create_scan(self, file_name: str, img: Image=None) -> Scan:
+
+        if img is None:
+            img = self.img
+        file_name = os.path.join(self.temp_dir.name, file_name)
+        img.save(file_name, dpi=(400, 400))
+        return Scan(file_name)
+
+    def get_difference(self, img: Image, other: Image) -> int:
+        '''
+        The levels are reduced from each other, so
+        they may differ by one from a single reduction
+        '''
+
+        return np.abs(np.asarray(img, dtype=np.int16) - np.asarray(other, dtype=np.int16)).max()
+
+    def testBuild(self):
+
+        scan = self.create_scan("scan.png")
+        self.assertIsNone(self.pyramid.get_level(scan, 4))
+        self.pyramid.build(scan).result()
+        self.assertEqual(len(os.listdir(os.path.join(self.temp_dir.name, PREVIEW_DIRECTORY))), 3)
+        for reduction in (2, 4, 8):
+            level = self.pyramid.get_level(scan, reduction)
+            self.assertEqual(level.size, (800 // reduction, 1200 // reduction))
+            self.assertLessEqual(self.get_difference(level, self.img.reduce(reduction)), 1)
+
+    def testBilevelScan(self):
+
+        scan = self.create_scan("scan.tif", self.img.convert("1"))
+        self.pyramid.build(scan).result()
+        self.assertEqual(self.pyramid.get_level(scan, 2).mode, "L")
+
+    def testChangedScan(self):
+
+        scan = self.create_scan("scan.png")
+        level_filename = self.pyramid.get_level_filename(scan, 2)
+        os.utime(scan.filename, (0, 0))
+        self.assertNotEqual(level_filename, self.pyramid.get_level_filename(scan, 2))
+
+    def testReduction(self):
+
+        scan = self.create_scan("scan.png")
+        self.assertEqual(self.pyramid.get_reduction(scan, None), 1)
+        self.assertEqual(self.pyramid.get_reduction(scan, 300), 1)
+        self.assertEqual(self.pyramid.get_reduction(scan, 150), 2)
+        self.assertEqual(self.pyramid.get_reduction(scan, 100), 4)
+        self.assertEqual(self.pyramid.get_reduction(scan, 20), 8)
+
+    def testPageImage(self):
+
+        scan = self.create_scan("scan.png")
+        page = Page(scan, ScanPart.LEFT, Region(40, 80, 400, 600), 90)
+
+        # Without levels the page comes from the scan
+        img = self.pyramid.get_page_image(page, 100)
+        self.assertEqual(img.size, page.size)
+        self.pyramid.build(scan).result()
+
+        img = self.pyramid.get_page_image(page, 100)
+        self.assertEqual(img.size, (150, 100))
+        self.assertEqual(round(img.info['dpi'][0]), 100)
+        full_img = page.get_raw_image().reduce(4)
+        self.assertLessEqual(self.get_difference(img, full_img), 1)
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
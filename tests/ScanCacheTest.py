@@ -0,0 +1,167 @@
+'''
+Created on 18.10.2026
+
+@author: michael
+'''
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from PIL import Image
+import numpy as np
+
+from Asb.ScanConvert2.ProcessPool import ordered_map
+from Asb.ScanConvert2.ScanCache import ScanCache, scan_cache
+from Asb.ScanConvert2.ScanConvertDomain import Scan, Page, ScanPart, Region
+from Base import BaseTest
+
+
+def get_byte_budget(item):
+
+    return scan_cache.byte_budget
+
+class ScanCacheTest(BaseTest):
+
+    def setUp(self):
+
+        super().setUp()
+        self.filename = os.path.join(self.test_file_dir, "Single000", "Seite1.png")
+        self.other_filename = os.path.join(self.test_file_dir, "Single000", "Seite2.png")
+        self.cache = ScanCache()
+        self.loads = 0
+        scan_cache.clear()
+
+    def load(self, filename, cropping_information):
+
+        self.loads += 1
+        return Scan(filename)._load_image(filename, cropping_information)
+
+    def testHit(self):
+
+        img1 = self.cache.get_image(self.filename, None, self.load)
+        img2 = self.cache.get_image(self.filename, None, self.load)
+        self.assertIs(img1, img2)
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(self.cache.hits, 1)
+
+    def testConcurrentMisses(self):
+
+        def slow_load(filename, cropping_information):
+            time.sleep(0.2)
+            return self.load(filename, cropping_information)
+
+        images = []
+        threads = [threading.Thread(target=lambda: images.append(self.cache.get_image(self.filename, None, slow_load)))
+                   for _ in range(0, 2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.loads, 1)
+        self.assertIs(images[0], images[1])
+        self.assertEqual(self.cache.misses, 1)
+
+    def testFailingLoader(self):
+
+        def failing_load(filename, cropping_information):
+            raise OSError()
+
+        with self.assertRaises(OSError):
+            self.cache.get_image(self.filename, None, failing_load)
+        self.cache.get_image(self.filename, None, self.load)
+        self.assertEqual(self.loads, 1)
+
+    def testEviction(self):
+
+        img = self.cache.get_image(self.filename, None, self.load)
+        self.cache.set_byte_budget(self.cache._get_size(img) + 1)
+        self.cache.get_image(self.other_filename, None, self.load)
+        self.assertEqual(self.cache.no_of_images, 1)
+        self.cache.get_image(self.filename, None, self.load)
+        self.assertEqual(self.loads, 3)
+
+    def testTooLarge(self):
+
+        self.cache.set_byte_budget(1)
+        self.cache.get_image(self.filename, None, self.load)
+        self.assertEqual(self.cache.no_of_images, 0)
+        self.assertEqual(self.cache.used_bytes, 0)
+
+    def testInvalidate(self):
+
+        self.cache.get_image(self.filename, None, self.load)
+        self.cache.get_image(self.other_filename, None, self.load)
+        self.cache.invalidate(self.filename)
+        self.assertEqual(self.cache.no_of_images, 1)
+        self.cache.get_image(self.filename, None, self.load)
+        self.assertEqual(self.loads, 3)
+
+    def testPagesShareScan(self):
+
+        scan = Scan(self.filename)
+        left = Page(scan, ScanPart.LEFT, Region(0, 0, scan.width / 2, scan.height))
+        right = Page(scan, ScanPart.RIGHT, Region(scan.width / 2, 0, scan.width / 2, scan.height))
+        left.get_raw_image()
+        right.get_raw_image()
+        scan.get_raw_image()
+        self.assertEqual(scan_cache.misses, 1)
+        self.assertEqual(scan_cache.hits, 2)
+
+    def testWorkersShareTheBudget(self):
+
+        budgets = list(ordered_map(get_byte_budget, range(0, 4), 4))
+        self.assertEqual(budgets, [scan_cache.byte_budget // 4] * 4)
+
+    def testRawImageIsNotShared(self):
+
+        scan = Scan(self.filename)
+        img = scan.get_raw_image()
+        img.paste(0, (0, 0, 10, 10))
+        self.assertIsNot(img, scan.get_cached_image())
+        self.assertNotEqual(img.tobytes(), scan.get_cached_image().tobytes())
+
+    def create_jpeg_scan(self, temp_dir: str) -> Scan:
+
+        img = Image.open(self.filename).convert("RGB").resize((800, 1200))
+        filename = os.path.join(temp_dir, "scan.jpg")
+        img.save(filename, dpi=(400, 400), quality=95)
+        return Scan(filename)
+
+    def testDraftReduction(self):
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            scan = self.create_jpeg_scan(temp_dir)
+            self.assertEqual(scan.get_draft_reduction(), 1)
+            self.assertEqual(scan.get_draft_reduction(300), 1)
+            self.assertEqual(scan.get_draft_reduction(200), 2)
+            self.assertEqual(scan.get_draft_reduction(150), 2)
+            self.assertEqual(scan.get_draft_reduction(50), 8)
+            self.assertEqual(Scan(self.filename).get_draft_reduction(50), 1)
+
+            img = scan.get_raw_image(100)
+            self.assertEqual(img.size, (200, 300))
+            self.assertEqual(round(img.info['dpi'][0]), 100)
+            full_img = scan.get_raw_image().reduce(4)
+            difference = np.abs(np.asarray(img, dtype=np.int16) - np.asarray(full_img, dtype=np.int16))
+            self.assertLess(difference.mean(), 3)
+
+            self.assertEqual(scan_cache.misses, 2)
+            scan.get_raw_image(100)
+            self.assertEqual(scan_cache.hits, 1)
+
+    def testReducedPage(self):
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            scan = self.create_jpeg_scan(temp_dir)
+            page = Page(scan, ScanPart.LEFT, Region(40, 80, 400, 600), 90)
+            self.assertEqual(page.size, (600, 400))
+            self.assertEqual(page.get_raw_image().size, page.size)
+            img = page.get_raw_image(100)
+            self.assertEqual(img.size, (150, 100))
+            self.assertEqual(round(img.info['dpi'][0]), 100)
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,94 @@
+'''
+Created on 18.10.2026
+
+@author: michael
+'''
+import unittest
+
+import numpy as np
+
+from Asb.ScanConvert2.AngleCorrection import SmearingService, BINARY_BLACK,\
+    BINARY_WHITE
+import Asb.ScanConvert2.AngleCorrection
+from Base import BaseTest
+
+
+def reference_smear_horizontal(bin_img, constraint, boundary_color):
+    '''
+    The original pixel by pixel implementation
+    '''
+    height = bin_img.shape[0]
+    width = bin_img.shape[1]
+    smeared_img = bin_img.copy()
+    for row_idx in range(0, height):
+        line = bin_img[row_idx]
+        col_idx = 0
+        gap_size = None
+        while col_idx < width:
+            if line[col_idx] == boundary_color:
+                if gap_size is not None and gap_size > 0:
+                    if gap_size < constraint:
+                        gap_start = col_idx - gap_size
+                        smeared_img[row_idx, gap_start:col_idx] = boundary_color
+                gap_size = 0
+            else:
+                if gap_size is not None:
+                    gap_size += 1
+            col_idx += 1
+    return smeared_img
+
+def reference_smear_vertical(bin_img, constraint, boundary_color):
+
+    smeared_img = reference_smear_horizontal(np.rot90(bin_img, -1), constraint, boundary_color)
+    return np.rot90(smeared_img)
+
+class SmearingServiceTest(BaseTest):
+
+    def setUp(self):
+
+        super().setUp()
+        self.smearing_service = SmearingService()
+        rng = np.random.default_rng(0)
+        self.bin_img = rng.random((60, 90)) > 0.15
+
+    def testHorizontal(self):
+
+        for boundary_color in (BINARY_BLACK, BINARY_WHITE):
+            for constraint in (0, 1, 3, 25):
+                np.testing.assert_array_equal(
+                    self.smearing_service.smear_horizontal(self.bin_img, constraint, boundary_color),
+                    reference_smear_horizontal(self.bin_img, constraint, boundary_color))
+
+    def testVertical(self):
+
+        for boundary_color in (BINARY_BLACK, BINARY_WHITE):
+            for constraint in (0, 1, 3, 25):
+                np.testing.assert_array_equal(
+                    self.smearing_service.smear_vertical(self.bin_img, constraint, boundary_color),
+                    reference_smear_vertical(self.bin_img, constraint, boundary_color))
+
+    def testChunks(self):
+
+        chunk_pixels = Asb.ScanConvert2.AngleCorrection.SMEARING_CHUNK_PIXELS
+        Asb.ScanConvert2.AngleCorrection.SMEARING_CHUNK_PIXELS = 7 * 90
+        try:
+            np.testing.assert_array_equal(
+                self.smearing_service.smear_horizontal(self.bin_img, 10),
+                reference_smear_horizontal(self.bin_img, 10, BINARY_BLACK))
+            np.testing.assert_array_equal(
+                self.smearing_service.smear_vertical(self.bin_img, 10),
+                reference_smear_vertical(self.bin_img, 10, BINARY_BLACK))
+        finally:
+            Asb.ScanConvert2.AngleCorrection.SMEARING_CHUNK_PIXELS = chunk_pixels
+
+    def testEdges(self):
+
+        line = np.array([[True, True, False, True, True, False, True, True]])
+        smeared = self.smearing_service.smear_horizontal(line, 5)
+        # The leading and trailing gaps are not filled
+        np.testing.assert_array_equal(smeared,
+                                      np.array([[True, True, False, False, False, False, True, True]]))
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
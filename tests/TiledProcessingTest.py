@@ -0,0 +1,203 @@
+'''
+Created on 18.10.2026
+
+@author: michael
+'''
+import os
+import tempfile
+import unittest
+
+from PIL import Image
+from injector import Injector
+import numpy as np
+
+from Asb.ScanConvert2.Algorithms import AlgorithmModule, Algorithm
+from Asb.ScanConvert2.Instrumentation import tracer
+from Asb.ScanConvert2.ScanCache import scan_cache
+from Asb.ScanConvert2.ScanConvertDomain import Scan, Page, Region, ScanPart
+from Asb.ScanConvert2.ScanConvertServices import FinishingService
+from Asb.ScanConvert2.ProcessPool import ordered_map, get_max_workers, set_max_workers
+from Asb.ScanConvert2.TiledProcessing import PageRaster, open_memmap, TileProcessor
+from Base import BaseTest
+
+
+def get_tile_threads(item):
+
+    return Injector([AlgorithmModule]).get(TileProcessor).max_threads
+
+class TiledProcessingTest(BaseTest):
+
+    def setUp(self):
+
+        super().setUp()
+        scan_cache.clear()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.finishing_service = Injector([AlgorithmModule]).get(FinishingService)
+        self.finishing_service.tile_processor.tile_size = 100
+        self.finishing_service.tile_processor.max_threads = 3
+
+        # Some text on a slightly gray paper with a colored box
+        rng = np.random.default_rng(4711)
+        pixels = np.full((620, 450, 3), 225, dtype=np.uint8)
+        pixels[100:500:20, 50:400] = 30
+        pixels[300:400, 100:200] = (200, 40, 40)
+        pixels = np.clip(pixels.astype(np.int16) + rng.integers(-20, 20, pixels.shape), 0, 255).astype(np.uint8)
+        self.img = Image.fromarray(pixels)
+
+    def tearDown(self):
+
+        scan_cache.clear()
+        self.temp_dir.cleanup()
+
+    def create_scan(self, file_name: str, img: Image=None) -> Scan:
+
+        if img is None:
+            img = self.img
+        file_name = os.path.join(self.temp_dir.name, file_name)
+        img.save(file_name, dpi=(400, 400))
+        return Scan(file_name)
+
+    def create_page(self, scan: Scan, algorithm: Algorithm, rotation_angle: int=0) -> Page:
+
+        return Page(scan, ScanPart.LEFT, Region(10.4, 20, 401, 580, mode_algorithm=algorithm), rotation_angle)
+
+    def create_images(self, page: Page, target_resolution: int) -> (Image, Image):
+
+        self.finishing_service.min_tiled_processing_pixels = 0
+        with tracer.collect() as spans:
+            tiled_img, _ = self.finishing_service.create_final_image(page, [], target_resolution)
+        self.assertIn("tiles.transform", [span.name for span in spans])
+        self.finishing_service.min_tiled_processing_pixels = float("inf")
+        img, _ = self.finishing_service.create_final_image(page, [], target_resolution)
+        self.assertEqual(img.size, tiled_img.size)
+        self.assertEqual(round(img.info['dpi'][0]), round(tiled_img.info['dpi'][0]))
+        return img, tiled_img
+
+    def testMemoryMapping(self):
+
+        self.assertIsNotNone(open_memmap(self.create_scan("rgb.tif")))
+        self.assertIsNotNone(open_memmap(self.create_scan("gray.tif", self.img.convert("L"))))
+        self.assertIsNone(open_memmap(self.create_scan("bilevel.tif", self.img.convert("1"))))
+        self.assertIsNone(open_memmap(self.create_scan("scan.png")))
+
+        file_name = os.path.join(self.temp_dir.name, "compressed.tif")
+        self.img.save(file_name, dpi=(400, 400), compression="tiff_lzw")
+        self.assertIsNone(open_memmap(Scan(file_name)))
+
+    def testRaster(self):
+
+        for file_name in ("rgb.tif", "scan.png"):
+            scan = self.create_scan(file_name)
+            for rotation_angle in (0, 90, 180, 270):
+                page = self.create_page(scan, Algorithm.NONE, rotation_angle)
+                raster = PageRaster(page, 400)
+                img = page.get_raw_image()
+                self.assertEqual(img.size, raster.size)
+                self.assertEqual(img.mode, raster.mode)
+                for box in ((0, 0, 100, 100), (13, 257, 100, 550), (250, 17, 391, 560), (-10, -10, 20, 20)):
+                    if img.width < box[2]:
+                        box = (box[1], box[0], box[3], box[2])
+                    self.assertTrue(np.array_equal(np.asarray(img.crop(box)), np.asarray(raster.get_image(box))),
+                                    "%s, %d°, %s" % (file_name, rotation_angle, box))
+
+    def testScanIsDecodedOnce(self):
+        '''
+        Even if the scan does not fit into the scan cache
+        '''
+
+        file_name = os.path.join(self.temp_dir.name, "compressed.tif")
+        self.img.save(file_name, dpi=(400, 400), compression="tiff_lzw")
+        page = self.create_page(Scan(file_name), Algorithm.OTSU)
+        byte_budget = scan_cache.byte_budget
+        scan_cache.set_byte_budget(1)
+        try:
+            self.finishing_service.min_tiled_processing_pixels = 0
+            with tracer.collect() as spans:
+                self.finishing_service.create_final_image(page, [], 400)
+        finally:
+            scan_cache.set_byte_budget(byte_budget)
+        self.assertGreater(len([span for span in spans if span.name == "tiles.tile"]), 1)
+        self.assertEqual(len([span for span in spans if span.name == "scan.decode"]), 1)
+
+    def testIdenticalResults(self):
+
+        scan = self.create_scan("rgb.tif")
+        for algorithm in (Algorithm.NONE, Algorithm.GRAY, Algorithm.INVERT, Algorithm.ERASE, Algorithm.OTSU,
+                          Algorithm.SAUVOLA, Algorithm.DENOISE, Algorithm.BAD_CONTRAST):
+            for rotation_angle in (0, 90):
+                img, tiled_img = self.create_images(self.create_page(scan, algorithm, rotation_angle), 400)
+                self.assertEqual(img.mode, tiled_img.mode)
+                self.assertTrue(np.array_equal(np.asarray(img), np.asarray(tiled_img)), "%s" % algorithm)
+
+    def testResizedResults(self):
+        '''
+        Resizing by a non integer factor gives the same
+        pixels for tiles and the whole page
+        '''
+
+        for file_name in ("scan.png", "rgb.tif"):
+            scan = self.create_scan(file_name)
+            for algorithm in (Algorithm.GRAY, Algorithm.OTSU, Algorithm.SAUVOLA, Algorithm.DENOISE):
+                for rotation_angle in (0, 270):
+                    img, tiled_img = self.create_images(self.create_page(scan, algorithm, rotation_angle), 300)
+                    self.assertEqual(img.mode, tiled_img.mode)
+                    self.assertTrue(np.array_equal(np.asarray(img), np.asarray(tiled_img)),
+                                    "%s, %s, %d°" % (file_name, algorithm, rotation_angle))
+
+    def testReducedResults(self):
+        '''
+        Reducing by an integer factor gives the same pixels
+        for tiles and the whole page
+        '''
+
+        scan = self.create_scan("rgb.tif")
+        for algorithm in (Algorithm.GRAY, Algorithm.OTSU, Algorithm.SAUVOLA):
+            img, tiled_img = self.create_images(self.create_page(scan, algorithm, 90), 200)
+            self.assertEqual((580 // 2, 401 // 2), img.size)
+            self.assertTrue(np.array_equal(np.asarray(img), np.asarray(tiled_img)), "%s" % algorithm)
+
+    def testRegions(self):
+
+        page = self.create_page(self.create_scan("rgb.tif"), Algorithm.OTSU)
+        page.add_region(Region(100, 100, 150, 200, mode_algorithm=Algorithm.NONE))
+        page.add_region(Region(300, 400, 150, 200, mode_algorithm=Algorithm.GRAY))
+        img, tiled_img = self.create_images(page, 400)
+        self.assertEqual("RGB", tiled_img.mode)
+        self.assertTrue(np.array_equal(np.asarray(img), np.asarray(tiled_img)))
+
+    def testPaletteRegions(self):
+
+        page = self.create_page(self.create_scan("rgb.tif"), Algorithm.OTSU)
+        page.add_region(Region(100, 100, 150, 200, mode_algorithm=Algorithm.TWO_COLOR_QUANTIZATION))
+        img, tiled_img = self.create_images(page, 400)
+        self.assertEqual("P", tiled_img.mode)
+        self.assertTrue(np.array_equal(np.asarray(img.convert("RGB")), np.asarray(tiled_img.convert("RGB"))))
+
+        page.add_region(Region(300, 400, 150, 100, mode_algorithm=Algorithm.GRAY))
+        img, tiled_img = self.create_images(page, 400)
+        self.assertEqual("RGB", tiled_img.mode)
+        self.assertTrue(np.array_equal(np.asarray(img), np.asarray(tiled_img)))
+
+    def testTileThreadsInWorkers(self):
+
+        max_workers = get_max_workers()
+        set_max_workers(4)
+        try:
+            self.assertEqual(list(ordered_map(get_tile_threads, range(0, 2), 2)), [2, 2])
+            self.assertEqual(list(ordered_map(get_tile_threads, range(0, 4), 4)), [1, 1, 1, 1])
+        finally:
+            set_max_workers(max_workers)
+
+    def testAlgorithmsThatNeedTheWholePage(self):
+
+        page = self.create_page(self.create_scan("rgb.tif"), Algorithm.FOUR_COLORS)
+        self.finishing_service.min_tiled_processing_pixels = 0
+        self.assertFalse(self.finishing_service._use_tiles(page))
+        page.main_region.mode_algorithm = Algorithm.SAUVOLA
+        self.assertTrue(self.finishing_service._use_tiles(page))
+        page.alignment_angle = 1.5
+        self.assertFalse(self.finishing_service._use_tiles(page))
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()